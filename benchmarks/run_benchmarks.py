@@ -0,0 +1,409 @@
+"""
+Benchmark suite of the grid generator, light curve codecs and database paths. Results are stored in JSON file which
+can be compared with the results of another commit to catch throughput regressions:
+
+    python benchmarks/run_benchmarks.py --output results/new.json --compare results/baseline.json
+
+Light curves are produced by the stand-ins of ELISa (see `stand_in.py`), therefore the suite measures only the code
+of this package and runs within minutes.
+"""
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import time, perf_counter
+from multiprocessing import Pool
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+
+from eb_gridmaker import config, dtb, eb_grid_generator
+from eb_gridmaker.utils import aux, physics, precalc, phase_schemes
+from eb_gridmaker.utils.sqlite_data_adapters import adapt_array, convert_array, encode_curve, decode_curves
+
+from stand_in import StandInSystem, StandInObserver, stand_in_elisa
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+
+
+@contextmanager
+def override_config(**values):
+    """
+    Temporarily sets `config` attributes, original values are restored on exit.
+    """
+    originals = {key: getattr(config, key) for key in values}
+    originals.update({key: getattr(config, key) for key in ('DATABASE_NAME', 'CURVE_DTYPE', 'CUMULATIVE_PRODUCT')
+                      if key not in originals})
+    try:
+        for key, value in values.items():
+            setattr(config, key, value)
+        yield
+    finally:
+        for key, value in originals.items():
+            setattr(config, key, value)
+
+
+@contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def measure(fn, repeat, setup=None):
+    """
+    Measures duration of `fn` call `repeat` times.
+
+    :param fn: callable; benchmarked function
+    :param repeat: int; number of measurements
+    :param setup: callable; function called before each measurement, its duration is not measured
+    :return: dict; {'seconds': best duration, 'median_seconds': median duration, 'repeat': int}
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return dict(seconds=min(times), median_seconds=float(np.median(times)), repeat=repeat)
+
+
+def result_entry(timing, items, unit, **extra):
+    """
+    Benchmark result with the throughput derived from the best duration.
+
+    :param timing: dict; result of `measure`
+    :param items: int; number of processed items in a single measurement
+    :param unit: str; name of processed items
+    :return: dict;
+    """
+    return dict(timing, items=int(items), unit=unit, items_per_second=items / max(timing['seconds'], 1e-12), **extra)
+
+
+def synthetic_observer(iden):
+    """
+    Returns stand-in Observer with calculated light curves of random circular binary derived from the ID.
+
+    :param iden: int;
+    :return: StandInObserver;
+    """
+    rng = np.random.default_rng(int(iden))
+    r1, r2 = rng.uniform(0.05, 0.4, 2)
+    system = StandInSystem(rng.uniform(0.1, 1.0), r1, r2, rng.choice(config.T_ARRAY), rng.choice(config.T_ARRAY),
+                           rng.uniform(60, 90), rng.uniform(3, 20), rng.uniform(3, 20), False)
+    observer = StandInObserver(system)
+    observer.lc(phases=phase_schemes.uniform_phases(), normalize=True)
+    return observer
+
+
+def synthetic_records(ids):
+    return [dtb.observation_record(synthetic_observer(iden), iden, config.PARAMETER_COLUMNS_BINARY,
+                                   config.PARAMETER_TYPES_BINARY) for iden in ids]
+
+
+def create_filled_db(db_name, ids):
+    """
+    Creates binary database containing synthetic observations with given IDs.
+
+    :param db_name: str;
+    :param ids: numpy.array;
+    :return: None
+    """
+    dtb.create_ceb_db(db_name, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY)
+    records = synthetic_records(ids)
+    with dtb.ObservationWriter(db_name, config.PARAMETER_COLUMNS_BINARY) as writer:
+        for iden, record in zip(ids, records):
+            writer.add((iden, record))
+
+
+def bench_get_params_from_id(scale, repeat, workdir, **kwargs):
+    n_ids = int(20000 * scale)
+    with override_config():
+        config.CUMULATIVE_PRODUCT = np.cumprod([o.size for o in reversed(config.sampling_order())])
+        ids = np.random.default_rng(0).integers(0, config.CUMULATIVE_PRODUCT[-1], n_ids)
+        scalar = measure(lambda: [aux.get_params_from_id(iden) for iden in ids], repeat)
+
+        ids = np.random.default_rng(0).integers(0, config.CUMULATIVE_PRODUCT[-1], 50 * n_ids)
+        batch = measure(lambda: aux.get_params_from_ids(ids), repeat)
+    return {
+        'get_params_from_id': result_entry(scalar, n_ids, 'ids'),
+        'get_params_from_ids': result_entry(batch, 50 * n_ids, 'ids'),
+    }
+
+
+def bench_precalc_grid(scale, repeat, workdir, **kwargs):
+    q_array = np.linspace(0.05, 1.0, int(20 * scale))
+    r_array = np.linspace(0.01, 0.99, int(25 * scale))
+    potentials = measure(lambda: aux.precalc_grid(r_array, q_array, physics.back_radius_potential_primary), repeat)
+    binary_grid = measure(lambda: precalc.calculate_binary_grid(q_array, r_array), repeat)
+
+    cache_dir = os.path.join(workdir, 'precalc')
+    precalc.precalc_binary_grid(q_array, r_array, cache_dir=cache_dir)
+    cached = measure(lambda: precalc.precalc_binary_grid(q_array, r_array, cache_dir=cache_dir), repeat)
+    return {
+        'precalc_grid': result_entry(potentials, q_array.size * r_array.size, 'nodes'),
+        'precalc_binary_grid': result_entry(binary_grid, q_array.size * r_array.size ** 2, 'nodes'),
+        'precalc_binary_grid_cached': result_entry(cached, q_array.size * r_array.size ** 2, 'nodes'),
+    }
+
+
+def bench_codec(scale, repeat, workdir, **kwargs):
+    n_curves = int(20000 * scale)
+    curves = np.random.default_rng(0).random((n_curves, config.N_POINTS))
+    results = dict()
+
+    blobs = [adapt_array(curve) for curve in curves]
+    results['adapt_array'] = result_entry(measure(lambda: [adapt_array(curve) for curve in curves], repeat),
+                                          n_curves, 'curves')
+    results['convert_array'] = result_entry(measure(lambda: [convert_array(blob) for blob in blobs], repeat),
+                                            n_curves, 'curves')
+
+    for dtype in ('float64', 'float32', 'float16'):
+        blobs = [encode_curve(curve, dtype) for curve in curves]
+        results[f'encode_curve_{dtype}'] = result_entry(
+            measure(lambda: [encode_curve(curve, dtype) for curve in curves], repeat), n_curves, 'curves')
+        results[f'decode_curves_{dtype}'] = result_entry(
+            measure(lambda: decode_curves(blobs, dtype, config.N_POINTS), repeat), n_curves, 'curves')
+    return results
+
+
+def insert_observations_worker(db_name, ids):
+    """
+    Inserts synthetic observations one by one using `dtb.insert_observation`.
+
+    :return: tuple; (number of inserted observations, number of failed inserts)
+    """
+    n_failed = 0
+    for iden in ids:
+        try:
+            dtb.insert_observation(db_name, synthetic_observer(iden), iden, config.PARAMETER_COLUMNS_BINARY,
+                                   config.PARAMETER_TYPES_BINARY)
+        except sqlite3.OperationalError:
+            n_failed += 1
+    return len(ids) - n_failed, n_failed
+
+
+def bench_insert_observation(scale, repeat, workdir, processes=(1, 2, 4), **kwargs):
+    n_per_worker = int(200 * scale)
+    results = dict()
+    for n_workers in processes:
+        db_name = os.path.join(workdir, f'insert_{n_workers}.db')
+        chunks = np.array_split(np.arange(n_workers * n_per_worker), n_workers)
+        failures = []
+
+        def setup():
+            if os.path.isfile(db_name):
+                os.remove(db_name)
+            dtb.create_ceb_db(db_name, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY)
+
+        def run():
+            with Pool(processes=n_workers) as pool:
+                counts = pool.starmap(insert_observations_worker, [(db_name, chunk) for chunk in chunks])
+            failures.append(sum(count[1] for count in counts))
+
+        results[f'insert_observation_{n_workers}_workers'] = result_entry(
+            measure(run, repeat, setup), n_workers * n_per_worker, 'observations', failed_inserts=max(failures))
+
+    # the same number of observations inserted in batches by a single writer, as it is done by the grid generator
+    n_records = n_per_worker * max(processes)
+    db_name = os.path.join(workdir, 'writer.db')
+    ids = np.arange(n_records)
+
+    def setup():
+        if os.path.isfile(db_name):
+            os.remove(db_name)
+        dtb.create_ceb_db(db_name, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY)
+
+    def run():
+        records = synthetic_records(ids)
+        with dtb.ObservationWriter(db_name, config.PARAMETER_COLUMNS_BINARY) as writer:
+            for iden, record in zip(ids, records):
+                writer.add((iden, record))
+
+    results['observation_writer'] = result_entry(measure(run, repeat, setup), n_records, 'observations')
+    return results
+
+
+def bench_get_observations(scale, repeat, workdir, **kwargs):
+    n_records = int(20000 * scale)
+    db_name = os.path.join(workdir, 'observations.db')
+    create_filled_db(db_name, np.arange(n_records))
+    passbands = list(config.PASSBAND_COLLUMNS[:3])
+
+    rng = np.random.default_rng(0)
+    subset = rng.choice(n_records, n_records // 10, replace=False)
+    return {
+        'get_observations_all': result_entry(
+            measure(lambda: dtb.get_observations(db_name, np.arange(n_records), passbands), repeat), n_records,
+            'observations', passbands=len(passbands)),
+        'get_observations_random_subset': result_entry(
+            measure(lambda: dtb.get_observations(db_name, subset, passbands), repeat), subset.size,
+            'observations', passbands=len(passbands)),
+    }
+
+
+def bench_merge_databases(scale, repeat, workdir, **kwargs):
+    n_records = int(10000 * scale)
+    db_files = [os.path.join(workdir, f'merge_part{ii}.db') for ii in range(2)]
+    for ii, db_name in enumerate(db_files):
+        create_filled_db(db_name, np.arange(ii * n_records, (ii + 1) * n_records))
+    result_db = os.path.join(workdir, 'merged.db')
+
+    def setup():
+        if os.path.isfile(result_db):
+            os.remove(result_db)
+
+    with quiet():
+        timing = measure(lambda: dtb.merge_databases(db_files, result_db), repeat, setup)
+    return {'merge_databases': result_entry(timing, 2 * n_records, 'observations')}
+
+
+def bench_grid_end_to_end(scale, repeat, workdir, processes=(1, 2, 4), **kwargs):
+    grid = dict(
+        Q_ARRAY=np.round(np.linspace(0.2, 1.0, 3), 3),
+        R_ARRAY=np.round(np.linspace(0.05, 0.45, max(int(6 * scale), 2)), 6),
+        T_ARRAY=np.array([5000, 6000, 7000]),
+        I_ARRAY=np.round(np.linspace(0.1, 0.9, 3), 6),
+        PRECALC_CACHE_DIR=os.path.join(workdir, 'precalc'),
+        METRICS_INTERVAL=1e9,
+        NUMBER_OF_PROCESSES=max(processes),
+    )
+    results = dict()
+    for block_evaluation in (False, True):
+        mode = 'block' if block_evaluation else 'node'
+        db_name = os.path.join(workdir, f'grid_{mode}.db')
+
+        def setup():
+            for path in (db_name, os.path.splitext(db_name)[0] + '.metrics.json',
+                         os.path.splitext(db_name)[0] + '.metrics.prom'):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        def run():
+            with quiet():
+                eb_grid_generator.evaluate_binary_on_grid(db_name, block_evaluation=block_evaluation)
+
+        with override_config(**grid), stand_in_elisa():
+            timing = measure(run, repeat, setup)
+        with open(os.path.splitext(db_name)[0] + '.metrics.json') as fl:
+            snapshot = json.load(fl)
+        results[f'grid_end_to_end_{mode}'] = result_entry(timing, snapshot['nodes_finished'], 'nodes',
+                                                          nodes_stored=snapshot['nodes_stored'],
+                                                          processes=max(processes))
+    return results
+
+
+BENCHMARKS = {
+    'ids': bench_get_params_from_id,
+    'precalc': bench_precalc_grid,
+    'codec': bench_codec,
+    'insert': bench_insert_observation,
+    'get_observations': bench_get_observations,
+    'merge': bench_merge_databases,
+    'grid': bench_grid_end_to_end,
+}
+
+
+def environment():
+    """
+    Description of the benchmarked code and the machine.
+
+    :return: dict;
+    """
+    def git(*args):
+        try:
+            return subprocess.run(('git', ) + args, cwd=REPO_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return dict(
+        commit=git('rev-parse', 'HEAD'),
+        dirty=None if status is None else len(status) > 0,
+        timestamp=time(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        sqlite=sqlite3.sqlite_version,
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+    )
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares throughput of the benchmarks with the baseline results.
+
+    :param results: dict; {benchmark: result}
+    :param baseline: dict; {benchmark: result}
+    :param threshold: float; relative decrease of the throughput considered a regression
+    :return: list; names of regressed benchmarks
+    """
+    regressions = []
+    print(f'\n{"benchmark":<40} {"baseline":>14} {"current":>14} {"change":>8}')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['items_per_second'], result['items_per_second']
+        change = new / old - 1.0
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<40} {old:>14.1f} {new:>14.1f} {100 * change:>7.1f}%{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='run only selected benchmark groups')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the benchmark sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of measurements, the best one is reported')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4],
+                        help='numbers of concurrent workers for database inserts and the grid run')
+    parser.add_argument('--output', help=f'path to the JSON file with results, stored in {DEFAULT_OUTPUT_DIR} by '
+                                         f'default')
+    parser.add_argument('--compare', help='JSON file with the baseline results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative decrease of throughput reported as a regression')
+    args = parser.parse_args(argv)
+
+    env = environment()
+    workdir = tempfile.mkdtemp(prefix='eb_gridmaker_bench_')
+    results = dict()
+    try:
+        for group in args.only or list(BENCHMARKS):
+            group_results = BENCHMARKS[group](args.scale, args.repeat, workdir, processes=args.processes)
+            for name, result in group_results.items():
+                print(f'{name:<40} {result["items_per_second"]:>14.1f} {result["unit"]}/s '
+                      f'({result["items"]} {result["unit"]} in {result["seconds"]:.3f} s)')
+            results.update(group_results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f'{int(env["timestamp"])}_{(env["commit"] or "unknown")[:10]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fl:
+        json.dump(dict(environment=env, settings=vars(args), results=results), fl, indent=4)
+    print(f'Results stored in {output}')
+
+    if args.compare is not None:
+        with open(args.compare) as fl:
+            baseline = json.load(fl)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(f'Throughput regressions: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
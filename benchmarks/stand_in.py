@@ -0,0 +1,121 @@
+"""
+Lightweight stand-ins for ELISa binary system and Observer. They expose only the attributes used by the grid
+generator and the database writer and produce analytic light curves, so the benchmarks of the generator measure the
+overhead of the package itself (dispatch, IPC, serialization, database writes) instead of the ELISa integration.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+
+from eb_gridmaker import config
+from eb_gridmaker.utils import physics, cache, phase_schemes
+
+
+class StandInComponent(object):
+    def __init__(self, surface_potential, t_eff, equivalent_radius, critical_surface_potential):
+        self.surface_potential = surface_potential
+        self.t_eff = t_eff
+        self.equivalent_radius = equivalent_radius
+        self.polar_radius = equivalent_radius
+        self.critical_surface_potential = critical_surface_potential
+        # positive for components overflowing their Roche lobe, see `README.rst`
+        self.filling_factor = (critical_surface_potential - surface_potential) / critical_surface_potential
+        self.discretization_factor = np.radians(5)
+        self.spots = []
+
+
+class StandInSystem(object):
+    def __init__(self, mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, overcontact):
+        self.mass_ratio = mass_ratio
+        self.inclination = np.radians(inclination)
+        self.morphology = 'over-contact' if overcontact else 'detached'
+        self.additional_light = 0.0
+        critical_potential = max(omega1, omega2) if overcontact else min(omega1, omega2)
+        self.primary = StandInComponent(omega1, t1, r1, critical_potential)
+        self.secondary = StandInComponent(omega2, t2, r2, critical_potential)
+
+    @staticmethod
+    def has_spots():
+        return False
+
+    @staticmethod
+    def has_pulsations():
+        return False
+
+
+class StandInObserver(object):
+    """
+    Observer producing gaussian eclipses with widths given by `phase_schemes.eclipse_half_width` and depths given by
+    the ratio of the surface brightness of the components.
+    """
+    def __init__(self, system, passbands=None):
+        self._system = system
+        self.passbands = config.PASSBANDS if passbands is None else passbands
+        self.phases = None
+        self.fluxes = dict()
+
+    def lc(self, phases, normalize=True):
+        system = self._system
+        r1, r2 = system.primary.equivalent_radius, system.secondary.equivalent_radius
+        width = max(phase_schemes.eclipse_half_width(r1, r2, np.degrees(system.inclination)), 1e-3) / 2
+        l1 = r1 ** 2 * system.primary.t_eff ** 4
+        l2 = r2 ** 2 * system.secondary.t_eff ** 4
+
+        distance = np.abs(np.mod(phases + 0.5, 1.0) - 0.5)
+        primary_eclipse = np.exp(-0.5 * (distance / width) ** 2)
+        secondary_eclipse = np.exp(-0.5 * ((np.abs(phases - 0.5)) / width) ** 2)
+
+        self.phases = phases
+        self.fluxes = dict()
+        for ii, band in enumerate(self.passbands):
+            # mild colour dependence of the eclipse depths
+            depth1 = min(r2 / r1, 1.0) * l1 / (l1 + l2) * (1 - 0.02 * ii)
+            depth2 = min(r1 / r2, 1.0) * l2 / (l1 + l2) * (1 + 0.02 * ii)
+            flux = 1.0 - 0.9 * depth1 * primary_eclipse - 0.9 * depth2 * secondary_eclipse
+            self.fluxes[band] = flux / flux.max() if normalize else flux
+
+
+def initialize_system(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, overcontact, sma=None, period=None):
+    return StandInSystem(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, overcontact)
+
+
+def get_observer(system, passbands=None):
+    return StandInObserver(system, passbands)
+
+
+def build_geometry(binary):
+    return None
+
+
+def build_surface(geometry, binary):
+    return binary
+
+
+def attach_prebuilt_system(binary, initial_system, symmetric=True):
+    return binary
+
+
+# replaced functions of the package modules, workers forked within the context inherit the replacements
+REPLACEMENTS = (
+    (physics, 'initialize_system', initialize_system),
+    (physics, 'build_geometry', build_geometry),
+    (physics, 'build_surface', build_surface),
+    (physics, 'attach_prebuilt_system', attach_prebuilt_system),
+    (cache, 'get_observer', get_observer),
+)
+
+
+@contextmanager
+def stand_in_elisa():
+    """
+    Replaces the ELISa system initialization, surface builds and Observer used by the grid generator with the
+    stand-ins within the context.
+    """
+    originals = [(module, name, getattr(module, name)) for module, name, _ in REPLACEMENTS]
+    try:
+        for module, name, replacement in REPLACEMENTS:
+            setattr(module, name, replacement)
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
@@ -0,0 +1,11 @@
+from eb_gridmaker.export import export_atlas, load_export
+
+home_dir = '/home/miro/elisa_models/ceb_atlas/'
+db_file = home_dir + 'ceb_atlas.db'
+export_dir = home_dir + 'ceb_atlas_export/'
+
+export_atlas(db_file, export_dir, passbands=['Bessell_V', 'Kepler', 'TESS'])
+
+atlas = load_export(export_dir)
+batch = atlas['fluxes'][1000:1256]  # (256, 3, N_POINTS) slice read directly from the disk
+print(atlas['parameters'][1000:1256]['mass_ratio'])
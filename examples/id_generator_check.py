@@ -2,26 +2,32 @@ import numpy as np
 from time import time
 
 from eb_gridmaker import config
-from eb_gridmaker.utils.aux import get_params_from_id
+from eb_gridmaker.utils.aux import get_params_from_id, get_params_from_ids, get_ids_from_params
 
 np.set_printoptions(precision=2, suppress=True)
 
 
 if __name__ == '__main__':
     n_id = 10000000
-    indices = np.empty((n_id, 6), dtype=int)
-    vals = np.empty((n_id, 6), dtype=float)
     config.CUMULATIVE_PRODUCT = np.cumprod([o.size for o in reversed(config.sampling_order())])
+
+    start = time()
+    vals, indices = get_params_from_ids(np.arange(n_id))
+    print(f'Elapsed time (batch decoding): {time() - start:.2f}')
+
     start = time()
-    for n in range(n_id):
-        vals[n, :], indices[n, :] = get_params_from_id(n)
-        # print(vals[n, :], indices[n, :])
+    ids = get_ids_from_params(vals)
+    print(f'Elapsed time (batch encoding): {time() - start:.2f}')
 
-    print(f'Elapsed time: {time() - start:.2f}')
+    # comparing with the scalar decoder on a small sample
+    for n in np.random.randint(0, n_id, 1000):
+        scalar_vals, scalar_indices = get_params_from_id(n)
+        assert np.allclose(scalar_vals, vals[n]) and np.all(scalar_indices == indices[n])
 
     print('generator has finished')
 
-    if indices.shape == np.unique(indices, axis=0).shape and vals.shape == np.unique(vals, axis=0).shape:
+    if indices.shape == np.unique(indices, axis=0).shape and vals.shape == np.unique(vals, axis=0).shape and \
+            np.all(ids == np.arange(n_id)):
         print("sucess")
     else:
         print("fail")
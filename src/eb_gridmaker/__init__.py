@@ -1,2 +1,2 @@
-from . eb_grid_generator import evaluate_grid
+from . eb_grid_generator import evaluate_grid, extend_grid
 from eb_gridmaker.dtb import merge_databases
\ No newline at end of file
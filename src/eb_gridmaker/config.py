@@ -4,9 +4,44 @@ import numpy as np
 from elisa.const import TEMPERATURE_LIST_LD
 
 DATABASE_NAME = 'ceb_atlas.db'
+# directory of cached grid-invariant quantities, set to None to disable caching
+PRECALC_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.eb_gridmaker', 'precalc')
+WRITER_BATCH_SIZE = 256  # number of nodes inserted to the database within a single transaction
+WRITER_FLUSH_INTERVAL = 30.0  # maximum time in seconds between database inserts
+WRITER_CACHE_SIZE = 65536  # page cache of the database writer in kB
+READ_BATCH_SIZE = 10000  # number of models read from the database at once during export and retrieval
+MATCHER_BATCH_SIZE = 32768  # number of exported models compared with the observations at once by the matcher
+PREFILTER_COMPONENTS = 16  # number of principal components of each passband stored in the pre-filter of the matcher
+PREFILTER_SAMPLE_SIZE = 100000  # number of light curves used to determine the principal components of the pre-filter
+PREFILTER_CANDIDATES = 1000  # minimal number of candidates of each observation compared in full resolution
+COMPLETION_BLOCK_SIZE = 65536  # number of nodes stored in a single row of the completion bitmap
+# JSON snapshot of run metrics (Prometheus text format is stored with `.prom` extension), `<database>.metrics.json`
+# is used if None
+METRICS_FILE = None
+METRICS_INTERVAL = 10.0  # time between snapshots of run metrics in seconds
+PRINT_NODE_PROGRESS = False  # print progress after each evaluated node in addition to periodic summaries
 # NUMBER_OF_PROCESSES = 1
 NUMBER_OF_PROCESSES = os.cpu_count()
+TASK_BATCH_SIZE = 16  # number of nodes sent to the worker within a single task
+TASKS_IN_FLIGHT_PER_PROCESS = 4  # maximum number of submitted and not yet finished tasks per worker
+LEASE_NODES = 50000  # approximate number of grid nodes leased at once by a machine from the coordinator
+LEASE_DURATION = 900.0  # lease not renewed by a heartbeat within this time (in seconds) is reclaimed by other machines
+COORDINATOR_TIMEOUT = 60.0  # maximum time in seconds spent by waiting for the lock of the coordinator database
+COORDINATOR_POLL_INTERVAL = 60.0  # time in seconds between attempts to reclaim leases of the other machines
+NODE_TIMEOUT = 3600.0  # wall-clock limit of the evaluation of a single node in seconds, None disables the limit
+MAX_RETRIES = 2  # number of repeated evaluations of the node after an unexpected exception
+FAILURE_REASON_LENGTH = 200  # maximum length of the failure reason stored in the `failures` table
+WORKER_CACHE_SIZE = 512  # memory cap of each worker-local cache of atmosphere and limb darkening tables in MB
+BLOCK_EVALUATION = True  # grid nodes sharing (q, r1, r2) are evaluated within single task reusing the surface mesh
+SYMMETRIC_EVALUATION = True  # LCs of circular grid are evaluated on <0, 0.5> phases and mirrored
+SYMMETRY_CHECK_FRACTION = 0.0  # fraction of grid nodes whose mirrored LCs are validated against full evaluation
+SYMMETRY_CHECK_TOLERANCE = 1e-5  # maximum allowed difference between mirrored and fully evaluated normalized LCs
 N_POINTS = 400  # number of points in LC
+CURVE_DTYPE = 'float32'  # storage format of LCs in new databases: `float64`, `float32`, `float16` (`npy` for legacy)
+# distribution of LC points of circular grid in new databases: `uniform` or `eclipse` (concentrated within eclipses)
+PHASE_SCHEME = 'uniform'
+ECLIPSE_POINT_FRACTION = 0.6  # fraction of LC points placed within eclipses in `eclipse` phase scheme
+ECLIPSE_WIDTH_MARGIN = 1.1  # factor of the sum of radii used for eclipse width to account for tidal deformation
 
 # ELISA names of used photometric filters
 PASSBANDS = [
@@ -28,9 +63,13 @@ PASSBANDS = [
 # _____________CONFIGURATIONS_FOR_CIRCULAR_ORBIT_GRID_SAMPLING________________
 T_MAX_OVERCONTACT = 8000  # maximum allowed temperature of the overcontact system components
 MAX_DIFF_T_OVERCONTACT = 500  # maximum temperature difference between overcontact components
+# per-node cost model of the grid used by `planner` in core-seconds: constant + overcontact flag + sum of squared radii
+# of the components, calibrate it on the timings of finished runs with `planner.calibrate_cost_model`
+COST_MODEL = dict(constant=2.0, overcontact=2.0, radii_area=10.0)
 
-# if you want to extend the table once the table is generated, do it only by appending the desired values to the end of
-# existing arrays, DO NOT INSERT additional values between original values once the table is (partially) generated
+# node IDs depend on all axes, databases are bound to the axes they were calculated with (recorded in their metadata),
+# to add values to the axes of the (partially) generated table use `eb_grid_generator.extend_grid`, DO NOT REMOVE values
+# (stored overcontacts invalidated by the new smallest radius or by the temperatures inserted between them are removed)
 Q_ARRAY = np.round(np.arange(0.1, 1.01, 0.1), 3)  # grid mass ratios
 R_ARRAY = np.round(np.arange(0.01, 1.0, 0.04), 6)  # grid of component's radii
 I_ARRAY = np.round(np.arange(0.0, 1.01, 0.1), 6)  # ranges of inclinations (i_min + I_ARRAY*(90-i_min))
@@ -70,6 +109,10 @@ PARAMETER_TYPES_BINARY = (
 )
 
 # ____________CONFIGURATIONS_FOR_SINGLE_RANDOM_SAMPLING_____________
+# seed of random sampling, parameters of each sample are derived from (seed, sample ID), if None, the seed is generated
+# for a new database, the seed is stored in the database metadata and reused when the calculation is resumed
+RANDOM_SEED = None
+PRESAMPLING_BATCH_SIZE = 100000  # maximum number of random candidates drawn and validated at once
 M_RANGE = [0.1, 10]  # mass
 LOG_G_RANGE = [1.0, 5.0]  # log surface gravity (cgs)
 T_EFF_RANGE = [3500, 50000]  # effective temperature
@@ -0,0 +1,270 @@
+import os
+import socket
+import sqlite3
+import threading
+from time import time, sleep
+from contextlib import contextmanager
+
+import numpy as np
+
+from eb_gridmaker import config
+from eb_gridmaker.eb_grid_generator import evaluate_binary_on_grid
+from eb_gridmaker.utils import aux, precalc
+from elisa import settings
+
+# states of the leases
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+
+
+def connect(path):
+    """
+    Opens connection to the coordinator database. Transactions are controlled explicitly, rollback journal is used
+    since WAL mode does not work on network file systems.
+
+    :param path: str;
+    :return: sqlite3.Connection;
+    """
+    return sqlite3.connect(path, timeout=config.COORDINATOR_TIMEOUT, isolation_level=None)
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Exclusive write transaction, concurrent workers wait up to `config.COORDINATOR_TIMEOUT` for the lock.
+
+    :param conn: sqlite3.Connection;
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def grid_hash():
+    """
+    Returns hash of the current grid axes, coordinator refuses workers configured with different grid.
+
+    :return: str;
+    """
+    return precalc.axes_hash(*config.sampling_order())
+
+
+def create_coordinator(path, desired_morphology='all', block_evaluation=None, lease_nodes=None):
+    """
+    Creates coordinator database in the location accessible from all machines (eg. shared file system with working
+    file locks). The order of evaluation of the grid (see `eb_grid_generator.grid_node_ids`) is divided into leases of
+    approximately `lease_nodes` nodes (whole blocks in case of block evaluation). Existing coordinator database is
+    kept if it was created with the same settings.
+
+    :param path: str; path to the coordinator database
+    :param desired_morphology: str; `all`, `detached`, `overcontact`
+    :param block_evaluation: bool; evaluation mode, `config.BLOCK_EVALUATION` by default
+    :param lease_nodes: int; number of nodes in a lease, `config.LEASE_NODES` by default
+    :return: dict; settings of the coordinator
+    """
+    block_evaluation = config.BLOCK_EVALUATION if block_evaluation is None else block_evaluation
+    lease_nodes = config.LEASE_NODES if lease_nodes is None else lease_nodes
+
+    if block_evaluation:
+        n_units = config.Q_ARRAY.size * config.R_ARRAY.size ** 2
+        unit_nodes = config.T_ARRAY.size ** 2 * config.I_ARRAY.size
+    else:
+        n_units, unit_nodes = int(np.prod(aux.grid_shape())), 1
+    lease_size = max(lease_nodes // unit_nodes, 1)
+    coordinator_settings = dict(desired_morphology=desired_morphology, block_evaluation=int(bool(block_evaluation)),
+                                n_units=n_units, lease_size=lease_size, grid_hash=grid_hash())
+
+    conn = connect(path)
+    with transaction(conn) as cursor:
+        cursor.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT, value TEXT, PRIMARY KEY (key))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS leases (lease INTEGER, start INTEGER, stop INTEGER, state TEXT, "
+                       "owner TEXT, expires REAL, attempts INTEGER, finished REAL, PRIMARY KEY (lease))")
+        existing = dict(cursor.execute("SELECT key, value FROM settings").fetchall())
+        if len(existing) > 0:
+            if existing != {key: str(value) for key, value in coordinator_settings.items()}:
+                raise ValueError(f'Coordinator {path} was already created with different settings: {existing}.')
+        else:
+            cursor.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                               [(key, str(value)) for key, value in coordinator_settings.items()])
+            starts = range(0, n_units, lease_size)
+            cursor.executemany("INSERT INTO leases (lease, start, stop, state, attempts) VALUES (?, ?, ?, ?, 0)",
+                               [(ii, start, min(start + lease_size, n_units), PENDING)
+                                for ii, start in enumerate(starts)])
+    conn.close()
+    return coordinator_settings
+
+
+class Coordinator(object):
+    """
+    Client of the coordinator database. Machines lease ranges of positions in the order of evaluation of the grid,
+    renew the leases by heartbeats during the calculation and mark them done afterwards. Leases which were not renewed
+    within `config.LEASE_DURATION` (eg. the machine died) are leased again by other machines.
+    """
+    def __init__(self, path, owner=None, lease_duration=None):
+        """
+        :param path: str; path to the database created by `create_coordinator`
+        :param owner: str; identifier of the machine, `hostname:pid` by default
+        :param lease_duration: float; `config.LEASE_DURATION` by default
+        """
+        if not os.path.isfile(path):
+            raise IOError(f'Coordinator {path} does not exist, create it with `create_coordinator`.')
+        self.path = path
+        self.owner = f'{socket.gethostname()}:{os.getpid()}' if owner is None else owner
+        self.lease_duration = config.LEASE_DURATION if lease_duration is None else lease_duration
+        self.conn = connect(path)
+
+        self.settings = dict(self.conn.execute("SELECT key, value FROM settings").fetchall())
+        if self.settings['grid_hash'] != grid_hash():
+            raise ValueError(f'Grid axes of coordinator {path} differ from the current configuration.')
+        self.settings['block_evaluation'] = bool(int(self.settings['block_evaluation']))
+
+    def lease(self):
+        """
+        Leases the first pending or expired range of positions.
+
+        :return: Union[None, tuple]; (lease ID, start, stop), None if no lease is available
+        """
+        now = time()
+        with transaction(self.conn) as cursor:
+            row = cursor.execute("SELECT lease, start, stop FROM leases WHERE state = ? OR (state = ? AND expires < ?) "
+                                 "ORDER BY lease LIMIT 1", (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return
+            cursor.execute("UPDATE leases SET state = ?, owner = ?, expires = ?, attempts = attempts + 1 "
+                           "WHERE lease = ?", (LEASED, self.owner, now + self.lease_duration, row[0]))
+        return row
+
+    def heartbeat(self, lease, conn=None):
+        """
+        Extends the lease.
+
+        :param lease: int; lease ID
+        :param conn: sqlite3.Connection; connection used from other than the creating thread
+        :return: bool; False if the lease was lost (expired and leased by another machine)
+        """
+        conn = self.conn if conn is None else conn
+        with transaction(conn) as cursor:
+            cursor.execute("UPDATE leases SET expires = ? WHERE lease = ? AND owner = ? AND state = ?",
+                           (time() + self.lease_duration, lease, self.owner, LEASED))
+            return cursor.rowcount == 1
+
+    def complete(self, lease):
+        """
+        Marks the lease as done, unless it was lost.
+
+        :param lease: int; lease ID
+        :return: bool; False if the lease was lost (expired and leased by another machine)
+        """
+        with transaction(self.conn) as cursor:
+            cursor.execute("UPDATE leases SET state = ?, expires = NULL, finished = ? "
+                           "WHERE lease = ? AND owner = ? AND state = ?", (DONE, time(), lease, self.owner, LEASED))
+            return cursor.rowcount == 1
+
+    def release(self, lease):
+        """
+        Returns unfinished lease, so it can be leased immediately by other machine.
+
+        :param lease: int; lease ID
+        :return: None
+        """
+        with transaction(self.conn) as cursor:
+            cursor.execute("UPDATE leases SET state = ?, owner = NULL, expires = NULL "
+                           "WHERE lease = ? AND owner = ? AND state = ?", (PENDING, lease, self.owner, LEASED))
+
+    def progress(self):
+        """
+        Returns number of leases in each state, expired leases are counted separately.
+
+        :return: dict; {'pending': int, 'leased': int, 'expired': int, 'done': int}
+        """
+        counts = {PENDING: 0, LEASED: 0, 'expired': 0, DONE: 0}
+        rows = self.conn.execute("SELECT state, expires < ?, COUNT(*) FROM leases GROUP BY state, expires < ?",
+                                 (time(), time())).fetchall()
+        for state, expired, count in rows:
+            counts['expired' if state == LEASED and expired else state] += count
+        return counts
+
+    @contextmanager
+    def keep_alive(self, lease, interval=None):
+        """
+        Renews the lease by heartbeats from a background thread for the duration of the context. The context yields
+        event which is set once the lease is lost.
+
+        :param lease: int; lease ID
+        :param interval: float; time between heartbeats in seconds, quarter of the lease duration by default
+        """
+        interval = self.lease_duration / 4 if interval is None else interval
+        stop, lost = threading.Event(), threading.Event()
+
+        def beat():
+            conn = connect(self.path)
+            while not stop.wait(interval):
+                try:
+                    if not self.heartbeat(lease, conn):
+                        print(f'Lease {lease} expired and it was taken over by other machine.')
+                        lost.set()
+                        break
+                except sqlite3.OperationalError as e:
+                    print(f'Heartbeat of lease {lease} failed: {e!r}')
+            conn.close()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def close(self):
+        self.conn.close()
+
+
+def run_worker(coordinator_path, db_name, owner=None, wait=True):
+    """
+    Evaluates leases of the grid from the coordinator until the whole grid is finished. Each machine stores the models
+    into its own database, use `dtb.merge_databases` with `on_duplicate='skip'` to join them afterwards (nodes of
+    the reclaimed leases might be stored by multiple machines).
+
+    :param coordinator_path: str; path to the database created by `create_coordinator`
+    :param db_name: str; path to the database of this machine
+    :param owner: str; identifier of the machine, `hostname:pid` by default
+    :param wait: bool; if True, machine without available leases waits for the leases of other machines and takes
+                       them over if they expire, otherwise it finishes
+    :return: None
+    """
+    settings.configure(LOG_CONFIG='fit', MAX_DISCRETIZATION_FACTOR=8)
+    coordinator = Coordinator(coordinator_path, owner)
+    try:
+        while True:
+            lease = coordinator.lease()
+            if lease is None:
+                progress = coordinator.progress()
+                if not wait or progress[LEASED] + progress['expired'] == 0:
+                    break
+                sleep(config.COORDINATOR_POLL_INTERVAL)
+                continue
+
+            lease_id, start, stop = lease
+            print(f'Evaluating lease {lease_id}: positions {start}-{stop}')
+            try:
+                with coordinator.keep_alive(lease_id) as lost:
+                    evaluate_binary_on_grid(db_name, desired_morphology=coordinator.settings['desired_morphology'],
+                                            block_evaluation=coordinator.settings['block_evaluation'],
+                                            positions=(start, stop))
+            except BaseException:
+                coordinator.release(lease_id)
+                raise
+            # the lease is finished by the machine which took it over, nodes evaluated here are kept in the database
+            if lost.is_set() or not coordinator.complete(lease_id):
+                print(f'Lease {lease_id} was lost, it is not marked as done by this machine.')
+                continue
+            progress = coordinator.progress()
+            print(f'Finished leases: {progress[DONE]}/{sum(progress.values())}')
+    finally:
+        coordinator.close()
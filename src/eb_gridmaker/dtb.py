@@ -1,22 +1,65 @@
 import sqlite3, os
+import re
+import json
+from time import time
 
 import numpy as np
 
-from eb_gridmaker.utils.sqlite_data_adapters import adapt_array, convert_array
-from eb_gridmaker.utils import aux
+from eb_gridmaker.utils.sqlite_data_adapters import (
+    adapt_array,
+    encode_curve,
+    decode_curves,
+    register_curve_converters,
+    CURVE_TYPES
+)
+from eb_gridmaker.utils import aux, metrics, multiproc
 from eb_gridmaker import config
 
 
 sqlite3.register_adapter(np.ndarray, adapt_array)
-sqlite3.register_converter("ARRAY", convert_array)
+register_curve_converters()
 
+# column of `curves` table containing phases of light curves sampled with non-uniform phase scheme
+PHASES_COLUMN = 'phases'
+PHASES_DTYPE = 'float64'
+# numpy types of the columns of `parameters` table
+SQL_NUMPY_TYPES = {'INTEGER': '<i8', 'REAL': '<f8', 'TEXT': 'U64'}
+# parameters of the binary models searchable by range queries, SQLite R-tree supports at most 5 dimensions, therefore
+# the inclination is searched by its own index or filtered among the candidates of the other indices
+RTREE_COLUMNS = ('mass_ratio', 'primary__equivalent_radius', 'secondary__equivalent_radius', 'primary__t_eff',
+                 'secondary__t_eff')
+RANGE_COLUMNS = RTREE_COLUMNS + ('inclination', )
+RTREE_TABLE = 'parameters_rtree'
+COMPOSITE_INDEX = 'parameters_range_idx'
+INCLINATION_INDEX = 'parameters_inclination_idx'
+MORPHOLOGIES = {'detached': 0, 'overcontact': 1}
+# metadata key storing named axes of the circular grid (see `aux.grid_axes`) defining the node IDs
+GRID_AXES_KEY = 'grid_axes'
+# metadata key storing axes of the grid before the last extension (see `remap_grid_ids`)
+ORIGINAL_GRID_AXES_KEY = 'original_grid_axes'
+# per-node records of the evaluation keyed by node ID: evaluation times used for calibration of the cost model of
+# `planner` and the failure ledger of nodes rejected during the evaluation, timed out or crashed
+NODE_LEDGERS = {
+    'timings': (('id', 'seconds'), ('INTEGER', 'REAL')),
+    'failures': (('id', 'reason', 'seconds', 'attempts'), ('INTEGER', 'TEXT', 'REAL', 'INTEGER')),
+}
 
-def create_ceb_db(db_name, param_columns, param_types):
+
+def create_ceb_db(db_name, param_columns, param_types, phase_scheme=None, grid_axes=None):
     """
-    Function creates dataframe for holding synthetic light curves and parameters of systems.
+    Function creates dataframe for holding synthetic light curves and parameters of systems. Light curves of a new
+    database are stored in `config.CURVE_DTYPE` format, existing databases keep their original curve format. Phases
+    of the light curves of each model are stored in `phases` column of `curves` table if the phase scheme differs
+    from `uniform` phases. Axes of the grid are recorded in the metadata and existing databases calculated on
+    different axes are refused, since node IDs depend on the axes (see `remap_grid_ids`).
 
     :param db_name: str; path to db location
-    :return:
+    :param param_columns: tuple; names of model parameters
+    :param param_types: tuple; SQL types of model parameters
+    :param phase_scheme: str; distribution of phases of light curves in a new database (see
+                              `utils.phase_schemes`), `config.PHASE_SCHEME` by default
+    :param grid_axes: dict; named axes of the grid (see `aux.grid_axes`), None for the random samples
+    :return: dict; metadata of the database
     """
     conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
     cursor = conn.cursor()
@@ -26,15 +69,162 @@ def create_ceb_db(db_name, param_columns, param_types):
     create_table('parameters', param_columns, param_types,
                  *db_args, **dict(additive='PRIMARY KEY (id)'))
 
+    # database metadata, databases created without metadata table contain curves in legacy `npy` format
+    metadata = get_metadata(cursor)
+    if 'curve_dtype' not in metadata:
+        metadata['curve_dtype'] = 'npy' if table_exists(cursor, 'curves') else config.CURVE_DTYPE
+        metadata['n_points'] = config.N_POINTS
+    elif int(metadata['n_points']) != config.N_POINTS:
+        raise ValueError(f'Database {db_name} contains light curves with {metadata["n_points"]} points while '
+                         f'`config.N_POINTS` = {config.N_POINTS}.')
+
+    phase_scheme = config.PHASE_SCHEME if phase_scheme is None else phase_scheme
+    if 'phase_scheme' not in metadata:
+        # databases created before the introduction of phase schemes contain uniformly sampled curves
+        metadata['phase_scheme'] = 'uniform' if table_exists(cursor, 'curves') else phase_scheme
+        if metadata['phase_scheme'] == 'eclipse':
+            metadata['eclipse_point_fraction'] = config.ECLIPSE_POINT_FRACTION
+            metadata['eclipse_width_margin'] = config.ECLIPSE_WIDTH_MARGIN
+    elif metadata['phase_scheme'] != phase_scheme:
+        raise ValueError(f'Database {db_name} contains light curves sampled with `{metadata["phase_scheme"]}` '
+                         f'phase scheme while `{phase_scheme}` scheme was requested.')
+    if grid_axes is not None:
+        # databases created before the axes were recorded are expected to be calculated on the current axes
+        stored_axes = get_grid_axes(metadata)
+        if stored_axes is None:
+            metadata[GRID_AXES_KEY] = dump_grid_axes(grid_axes)
+        elif not aux.axes_equal(stored_axes, grid_axes):
+            conn.close()
+            raise ValueError(f'Database {db_name} was calculated on different grid axes, use '
+                             f'`eb_grid_generator.extend_grid` to extend the grid of the database.')
+    create_table('metadata', ('key', 'value'), ('TEXT', 'TEXT'), *db_args, **dict(additive='PRIMARY KEY (key)'))
+    set_metadata(metadata, *db_args)
+
     # creating table for each curve
     columns = param_columns[:1] + config.PASSBAND_COLLUMNS
-    types = param_types[:1] + tuple('ARRAY' for _ in config.PASSBAND_COLLUMNS)
+    types = param_types[:1] + tuple(CURVE_TYPES[metadata['curve_dtype']] for _ in config.PASSBAND_COLLUMNS)
+    if metadata['phase_scheme'] != 'uniform':
+        columns, types = columns + (PHASES_COLUMN, ), types + (CURVE_TYPES[PHASES_DTYPE], )
     foreign_key = 'PRIMARY KEY (id), FOREIGN KEY (id) REFERENCES parameters (id)'
     create_table('curves', columns, types, *db_args, **dict(additive=foreign_key))
 
-    # create index database
-    create_table('auxiliary', ('last_index', ), ('INT', ), *db_args)
+    # create table of completed nodes
+    create_table('completion', ('block', 'bits'), ('INTEGER', 'BLOB'), *db_args, **dict(additive='PRIMARY KEY (block)'))
+    for table, (columns, types) in NODE_LEDGERS.items():
+        create_table(table, columns, types, *db_args, **dict(additive='PRIMARY KEY (id)'))
+
+    conn.close()
+    return read_metadata(db_name)
+
+
+def parameter_dtype(columns, types):
+    """
+    Returns numpy structured dtype corresponding to the columns of `parameters` table.
+
+    :param columns: tuple; names of the columns
+    :param types: tuple; SQL types of the columns
+    :return: numpy.dtype;
+    """
+    return np.dtype([(col, SQL_NUMPY_TYPES[tp.split(' ')[0].upper()]) for col, tp in zip(columns, types)])
+
+
+def table_exists(cursor, name):
+    """
+    Checks whether the table exists in the database.
+
+    :param cursor: sqlite3.Cursor;
+    :param name: str; name of the table
+    :return: bool;
+    """
+    sql = "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?"
+    return cursor.execute(sql, (name, )).fetchone()[0] > 0
+
+
+def index_exists(cursor, name):
+    """
+    Checks whether the index exists in the database.
+
+    :param cursor: sqlite3.Cursor;
+    :param name: str; name of the index
+    :return: bool;
+    """
+    sql = "SELECT COUNT(*) FROM sqlite_master WHERE type='index' AND name=?"
+    return cursor.execute(sql, (name, )).fetchone()[0] > 0
+
+
+def get_metadata(cursor):
+    """
+    Returns metadata of the database (eg. `curve_dtype`, `n_points`) stored in `metadata` table.
+
+    :param cursor: sqlite3.Cursor;
+    :return: dict;
+    """
+    if not table_exists(cursor, 'metadata'):
+        return dict()
+    return {key: value for key, value in cursor.execute("SELECT key, value FROM metadata")}
+
+
+def set_metadata(metadata, *args):
+    """
+    Stores (or updates) values in `metadata` table.
+
+    :param metadata: dict; {key: value}
+    :param args: tuple; (database connection, cursor)
+    :return: None
+    """
+    conn, cursor = args
+
+    cursor.executemany("REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                       [(key, str(value)) for key, value in metadata.items()])
+    conn.commit()
+
+
+def dump_grid_axes(axes):
+    """
+    Serializes named grid axes into the JSON string stored in the metadata.
+
+    :param axes: dict; {axis name: numpy.array}
+    :return: str;
+    """
+    return json.dumps({name: np.asarray(axis).tolist() for name, axis in axes.items()})
+
+
+def get_grid_axes(metadata, key=GRID_AXES_KEY):
+    """
+    Returns named axes of the grid recorded in the metadata of the database.
+
+    :param metadata: dict; see `get_metadata`
+    :param key: str; `GRID_AXES_KEY` or `ORIGINAL_GRID_AXES_KEY` for the axes before the last extension
+    :return: Union[None, dict]; {axis name: numpy.array}, None if the axes were not recorded
+    """
+    if key not in metadata:
+        return
+    return {name: np.array(axis) for name, axis in json.loads(metadata[key]).items()}
+
+
+def read_metadata(db_name):
+    """
+    Returns metadata of the database stored in `metadata` table.
+
+    :param db_name: str; path to db location
+    :return: dict;
+    """
+    conn = sqlite3.connect(db_name)
+    metadata = get_metadata(conn.cursor())
+    conn.close()
+    return metadata
+
 
+def write_metadata(db_name, metadata):
+    """
+    Stores (or updates) values in `metadata` table of the database.
+
+    :param db_name: str; path to db location
+    :param metadata: dict; {key: value}
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+    set_metadata(metadata, conn, conn.cursor())
     conn.close()
 
 
@@ -80,144 +270,824 @@ def insert_to_table(table, columns, values, *args):
     conn.commit()
 
 
-def update_last_id(last_id, *args):
+def observation_record(observer, iden, param_columns, param_types, phases=None):
+    """
+    Prepares rows of `parameters` and `curves` tables for the synthetic observation of given grid node. Light curves
+    are already serialized in `config.CURVE_DTYPE` format to make the record cheap to transfer from the worker to the
+    database writer.
+
+    :param observer: elisa.Observer; observer instance with calculated light curves
+    :param iden: str; node ID
+    :param param_columns: Tuple; names of model parameters
+    :param param_types: Tuple; SQL types of model parameters
+    :param phases: numpy.array; phases of the light curves stored along the curves, omitted for uniform phases
+    :return: tuple; (parameters row, curves row)
+    """
+    bs = getattr(observer, '_system')
+
+    params = [iden, ] + [aux.getattr_from_collumn_name(bs, item) for item in param_columns[1:]]
+    params = aux.typing(params, param_types)
+    curves = [int(iden), ] + [encode_curve(observer.fluxes[p], config.CURVE_DTYPE) for p in config.PASSBANDS]
+    if phases is not None:
+        curves.append(encode_curve(phases, PHASES_DTYPE))
+
+    return tuple(params), tuple(curves)
+
+
+def connect_writer(db_name):
+    """
+    Opens connection to the database tuned for bulk inserts from a single writer.
+
+    :param db_name: str; path to db location
+    :return: sqlite3.Connection
+    """
+    conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute(f'PRAGMA cache_size=-{config.WRITER_CACHE_SIZE}')
+    return conn
+
+
+def insert_records(records, param_columns, *args):
     """
-    Updates a value of the last calculated node ID.
+    Inserts batch of observation records using a single statement per table (without commit).
 
-    :param last_id: int; node id
+    :param records: list; [(parameters row, curves row), ...] produced by `observation_record`
+    :param param_columns: Tuple; names of model parameters
     :param args: tuple; (database connection, cursor)
     :return: None
     """
     conn, cursor = args
 
-    sql = f"REPLACE INTO auxiliary (_rowid_, last_index) VALUES (?, ?)"
-    cursor.execute(sql, (0, int(last_id)))
+    curve_columns = tuple(param_columns[:1]) + config.PASSBAND_COLLUMNS
+    if len(records) > 0 and len(records[0][1]) > len(curve_columns):
+        curve_columns += (PHASES_COLUMN, )
+    param_sql = f"INSERT INTO parameters ({', '.join(param_columns)}) " \
+                f"VALUES ({', '.join('?' for _ in param_columns)})"
+    curve_sql = f"INSERT INTO curves ({', '.join(curve_columns)}) VALUES ({', '.join('?' for _ in curve_columns)})"
 
-    conn.commit()
+    cursor.executemany(param_sql, [record[0] for record in records])
+    cursor.executemany(curve_sql, [record[1] for record in records])
 
 
-def insert_observation(db_name, observer, iden, param_columns, param_types):
+class CompletionBitmap(object):
     """
-    Create entry for the synthetic observation of given grid node with ID `iden` which will store system parameters in
-    `parameters` table and normalized lightcurves in `curves` table.
+    Record of finished (computed, rejected or failed) nodes in form of the bitmap indexed by node IDs. The bitmap is
+    persisted in the `completion` table in blocks of `config.COMPLETION_BLOCK_SIZE` bits, only the blocks altered since
+    the last save are written.
+    """
+    def __init__(self, size=0):
+        self.bits = np.zeros(int(size), dtype=bool)
+        self.dirty = set()
 
-    :param db_name: str;
-    :param observer: elisa.Observer; observer instance with calculated light curves
-    :param iden: str; node ID
-    :param param_columns: Tuple; names of smodel parameters
-    :return:
+    def __contains__(self, iden):
+        return iden < self.bits.size and bool(self.bits[iden])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def resize(self, size):
+        """
+        Extends the bitmap to accommodate (at least) IDs < `size`.
+
+        :param size: int;
+        :return: None
+        """
+        if size > self.bits.size:
+            size = max(int(size), 2 * self.bits.size)
+            self.bits = np.concatenate((self.bits, np.zeros(size - self.bits.size, dtype=bool)))
+
+    def mark(self, ids):
+        """
+        Marks nodes as finished.
+
+        :param ids: Union[int, numpy.array]; node IDs
+        :return: None
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if ids.size == 0:
+            return
+        self.resize(ids.max() + 1)
+        self.bits[ids] = True
+        self.dirty.update(np.unique(ids // config.COMPLETION_BLOCK_SIZE).tolist())
+
+    def unmark(self, ids):
+        """
+        Marks nodes as not finished, so they are evaluated again.
+
+        :param ids: Union[int, numpy.array]; node IDs
+        :return: None
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        ids = ids[ids < self.bits.size]
+        self.bits[ids] = False
+        self.dirty.update(np.unique(ids // config.COMPLETION_BLOCK_SIZE).tolist())
+
+    def pending(self, ids):
+        """
+        Returns subset of `ids` which were not finished yet while preserving their order.
+
+        :param ids: numpy.array; node IDs
+        :return: numpy.array;
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        self.resize(ids.max() + 1 if ids.size > 0 else 0)
+        return ids[~self.bits[ids]]
+
+    def save(self, cursor):
+        """
+        Writes altered blocks of the bitmap to the `completion` table (without commit).
+
+        :param cursor: sqlite3.Cursor;
+        :return: None
+        """
+        block_size = config.COMPLETION_BLOCK_SIZE
+        rows = [(block, np.packbits(self.bits[block * block_size: (block + 1) * block_size]).tobytes())
+                for block in sorted(self.dirty)]
+        cursor.executemany("REPLACE INTO completion (block, bits) VALUES (?, ?)", rows)
+        self.dirty = set()
+
+    @classmethod
+    def load(cls, cursor, size=0):
+        """
+        Loads bitmap from `completion` table. Databases created before the introduction of the `completion` table are
+        supported by marking all nodes already present in `parameters` table.
+
+        :param cursor: sqlite3.Cursor;
+        :param size: int; minimal size of the bitmap
+        :return: CompletionBitmap;
+        """
+        block_size = config.COMPLETION_BLOCK_SIZE
+        blocks = cursor.execute("SELECT block, bits FROM completion").fetchall() \
+            if table_exists(cursor, 'completion') else []
+
+        bitmap = cls(size)
+        if len(blocks) == 0:
+            ids = np.array(cursor.execute("SELECT id FROM parameters").fetchall(), dtype=np.int64).ravel()
+            bitmap.mark(ids)
+            return bitmap
+
+        bitmap.resize((max(block for block, _ in blocks) + 1) * block_size)
+        for block, bits in blocks:
+            bits = np.unpackbits(np.frombuffer(bits, dtype=np.uint8))[:block_size].astype(bool)
+            bitmap.bits[block * block_size: block * block_size + bits.size] = bits
+        return bitmap
+
+
+def reset_failures(db_name, reasons=None):
     """
-    bs = getattr(observer, '_system')
+    Removes nodes from the failure ledger of the database and marks them as not finished, so they are evaluated again
+    by the next run (eg. after the increase of `config.NODE_TIMEOUT` or a fix of the underlying issue). Nodes which
+    failed with unexpected exceptions are evaluated again by the next run even without the reset.
 
-    conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+    :param db_name: str; path to the database
+    :param reasons: list; reasons of the failures to reset (eg. `timeout`, `LimbDarkeningError`), unexpected exceptions
+                          are selected by `error`, all failures are reset by default
+    :return: int; number of reset nodes
+    """
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
-    db_args = (conn, cursor)
+    if not table_exists(cursor, 'failures'):
+        conn.close()
+        return 0
 
-    # insert to parameters table
-    values = [iden, ] + [aux.getattr_from_collumn_name(bs, item) for item in param_columns[1:]]
-    values = aux.typing(values, param_types)
-    insert_to_table('parameters', param_columns, values, *db_args)
+    rows = cursor.execute("SELECT id, reason FROM failures").fetchall()
+    ids = np.array([iden for iden, reason in rows if reasons is None or reason.split(':')[0] in reasons],
+                   dtype=np.int64)
+    bitmap = CompletionBitmap.load(cursor)
+    bitmap.unmark(ids)
+    with conn:
+        bitmap.save(cursor)
+        cursor.executemany("DELETE FROM failures WHERE id = ?", [(int(iden), ) for iden in ids])
+    conn.close()
+    print(f'Failures of {ids.size} nodes were reset.')
+    return int(ids.size)
 
-    # insert to curves table
-    columns = tuple(param_columns[:1]) + config.PASSBAND_COLLUMNS
-    values = [int(iden), ] + [observer.fluxes[p] for p in config.PASSBANDS]
-    insert_to_table('curves', columns, values, *db_args)
 
-    # alter last_index
-    update_last_id(iden, *db_args)
+def load_completion(db_name, size=0):
+    """
+    Returns record of already finished nodes in the database.
 
+    :param db_name: str;
+    :param size: int; minimal size of the bitmap
+    :return: CompletionBitmap;
+    """
+    conn = sqlite3.connect(db_name)
+    bitmap = CompletionBitmap.load(conn.cursor(), size)
     conn.close()
+    return bitmap
+
+
+class ObservationWriter(object):
+    """
+    Single database writer collecting observation records finished by the pool workers. Records are inserted in
+    batches, flush is performed once the `batch_size` records were collected or `flush_interval` seconds have passed
+    since the last flush. Finished nodes are marked in completion bitmap stored within the same transaction together
+    with their evaluation times (if provided) and failures. Rejected and timed out nodes are marked as well, therefore
+    they are skipped by the later runs (see `reset_failures`). Nodes which failed with unexpected exceptions are only
+    recorded in the failure ledger and they are evaluated again by the next run, their failures are removed once they
+    succeed.
+    """
+    def __init__(self, db_name, param_columns, completion=None, batch_size=None, flush_interval=None):
+        self.conn = connect_writer(db_name)
+        self.cursor = self.conn.cursor()
+        self.param_columns = param_columns
+        self.completion = CompletionBitmap.load(self.cursor) if completion is None else completion
+        self.batch_size = config.WRITER_BATCH_SIZE if batch_size is None else batch_size
+        self.flush_interval = config.WRITER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+
+        self.records = []
+        self.timings = []
+        self.failures = []
+        self.recovered = []
+        self.last_flush = time()
+
+        self.retried = set()
+        if table_exists(self.cursor, 'failures'):
+            self.retried = {iden for iden, reason in self.cursor.execute("SELECT id, reason FROM failures")
+                            if not multiproc.is_final(reason)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, result):
+        """
+        Marks the node as finished (unless it failed with an unexpected exception) and adds its record to the buffer.
+
+        :param result: tuple; (node ID, record), (node ID, record, evaluation time in seconds) or (node ID, record,
+                              evaluation time in seconds, failure), where record is (parameters row, curves row) or
+                              None for rejected and failed nodes and failure is None or (reason, number of attempts)
+        :return: None
+        """
+        iden, record = result[:2]
+        failure = result[3] if len(result) > 3 else None
+        if failure is None or multiproc.is_final(failure[0]):
+            self.completion.mark(iden)
+        if failure is None and iden in self.retried:
+            self.recovered.append((int(iden), ))
+        if failure is not None:
+            # evaluation times of the failed nodes would distort the cost model
+            self.failures.append((int(iden), failure[0], float(result[2]), int(failure[1])))
+            metrics.METRICS.count('nodes_failed')
+        elif len(result) > 2:
+            self.timings.append((int(iden), float(result[2])))
+        metrics.METRICS.count('nodes_finished')
+        if record is not None:
+            self.records.append(record)
+            metrics.METRICS.count('nodes_stored')
+
+        if len(self.records) >= self.batch_size or time() - self.last_flush > self.flush_interval:
+            self.flush()
 
+    def flush(self):
+        """
+        Writes buffered records to the database.
 
-def search_for_breakpoint(db_name, ids):
+        :return: None
+        """
+        with metrics.METRICS.timer('db_insert'), self.conn:
+            if len(self.records) > 0:
+                insert_records(self.records, self.param_columns, self.conn, self.cursor)
+            if len(self.timings) > 0:
+                self.cursor.executemany("REPLACE INTO timings (id, seconds) VALUES (?, ?)", self.timings)
+            if len(self.failures) > 0:
+                self.cursor.executemany("REPLACE INTO failures (id, reason, seconds, attempts) VALUES (?, ?, ?, ?)",
+                                        self.failures)
+            if len(self.recovered) > 0:
+                self.cursor.executemany("DELETE FROM failures WHERE id = ?", self.recovered)
+            self.completion.save(self.cursor)
+        self.records = []
+        self.timings = []
+        self.failures = []
+        self.recovered = []
+        self.last_flush = time()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def insert_observation(db_name, observer, iden, param_columns, param_types):
     """
-    Function will retrieve ID of last caluclated grid node to continue interrupted grid caclulation.
+    Create entry for the synthetic observation of given grid node with ID `iden` which will store system parameters in
+    `parameters` table and normalized lightcurves in `curves` table.
 
     :param db_name: str;
-    :param ids: numpy.array; list of grid node ids to calculate in this batch
-    :return: int; grid node from which start the calculation
+    :param observer: elisa.Observer; observer instance with calculated light curves
+    :param iden: str; node ID
+    :param param_columns: Tuple; names of smodel parameters
+    :return:
     """
-    conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = lambda cursor, row: row[0]
-    cursor = conn.cursor()
+    with ObservationWriter(db_name, param_columns) as writer:
+        writer.add((iden, observation_record(observer, iden, param_columns, param_types)))
 
-    sql = f"SELECT last_index FROM auxiliary"
-    last_idx = np.array(cursor.execute(sql).fetchall())
 
-    if last_idx.size == 0:
-        return 0
-    elif last_idx[0] in ids:
-        return np.where(last_idx[0] == ids)[0][0]
-    else:
-        raise ValueError('IDs of already calculated objects do not correspond to the generated ID. Breakpoint cannot '
-                         'be generated.')
+def table_columns(cursor, table, schema='main'):
+    """
+    Returns names and declared SQL types of the columns of given table.
 
-    conn.close()
+    :param cursor: sqlite3.Cursor;
+    :param table: str; name of the table
+    :param schema: str; name of the (attached) database
+    :return: tuple; (tuple of column names, tuple of column types)
+    """
+    info = cursor.execute(f"PRAGMA {schema}.table_info({table})").fetchall()
+    return tuple(row[1] for row in info), tuple(row[2] for row in info)
 
 
-def merge_databases(db_list, result_db, param_columns=config.PARAMETER_COLUMNS_BINARY):
+def merge_databases(db_list, result_db, on_duplicate='raise', batch_size=None):
     """
-    Merges contents of databases calculated from different batches into a single database.
+    Merges contents of databases calculated from different batches into a single database. Schema of the tables
+    (binary, single or eccentric parameters) is taken over from the first database, model IDs are preserved. All rows
+    are loaded within a single transaction and indices (including the R-tree of `build_parameter_indices`) are built
+    after the load.
 
-    :param db_list: list;
-    :param result_db: str;
-    :param param_columns: Tuple; columns of model parameters
+    :param db_list: list; paths to databases to merge
+    :param result_db: str; path to the resulting database
+    :param on_duplicate: str; `raise` - raise ValueError if the same ID is found in multiple databases,
+                              `skip` - keep the first occurrence of the model
+    :param batch_size: int; number of rows copied at once
     :return: None
     """
     if type(db_list) not in [list, tuple]:
         raise ValueError('Function requires list of filenames of databases to merge')
     elif len(db_list) <= 1:
         raise ValueError('You need at least two databases to merge.')
+    if on_duplicate not in ['raise', 'skip']:
+        raise ValueError(f'Invalid value of `on_duplicate`: {on_duplicate}. Use `raise` or `skip`.')
 
     if os.path.isfile(result_db):
         raise IOError('Output file already exists.')
+    missing = [fl for fl in db_list if not os.path.isfile(fl)]
+    if len(missing) > 0:
+        raise IOError(f'Databases {missing} do not exist.')
 
-    create_ceb_db(result_db)
-    conn = sqlite3.connect(result_db, detect_types=sqlite3.PARSE_DECLTYPES)
+    batch_size = config.READ_BATCH_SIZE if batch_size is None else batch_size
+
+    # schema of the merged database is taken over from the first database
+    src = sqlite3.connect(db_list[0])
+    metadata = get_metadata(src.cursor())
+    tables = dict(src.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name IN "
+                              "('parameters', 'curves')").fetchall())
+    indices = [row[0] for row in src.execute("SELECT sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL "
+                                             "AND tbl_name IN ('parameters', 'curves')")]
+    columns = {table: table_columns(src.cursor(), table)[0] for table in ('parameters', 'curves')}
+    with_rtree = table_exists(src.cursor(), RTREE_TABLE)
+    src.close()
+
+    conn = sqlite3.connect(result_db, isolation_level=None)
     cursor = conn.cursor()
-    cursor.execute('DROP TABLE auxiliary')
-    conn.commit()
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.execute(f'PRAGMA cache_size=-{config.WRITER_CACHE_SIZE}')
+    for table in ('parameters', 'curves'):
+        cursor.execute(tables[table])
+    create_table('completion', ('block', 'bits'), ('INTEGER', 'BLOB'), conn, cursor,
+                 **dict(additive='PRIMARY KEY (block)'))
+    for table, (ledger_columns, types) in NODE_LEDGERS.items():
+        create_table(table, ledger_columns, types, conn, cursor, **dict(additive='PRIMARY KEY (id)'))
 
-    string1 = ', '.join(param_columns[1:])
-    string2 = ', '.join(config.PASSBAND_COLLUMNS)
-    for fl in db_list:
-        cursor.execute('ATTACH DATABASE ? AS db2', (fl,))
-        cursor.execute(f'INSERT INTO parameters({string1}) SELECT {string1} FROM db2.parameters')
-        cursor.execute(f'INSERT INTO curves({string2}) SELECT {string2} FROM db2.curves')
-        conn.commit()
-        cursor.execute('DETACH DATABASE db2')
+    start_time, n_rows, n_models, n_duplicates = time(), 0, 0, 0
+    completion = CompletionBitmap()
+    insert = 'INSERT OR IGNORE' if on_duplicate == 'skip' else 'INSERT'
+    try:
+        cursor.execute('BEGIN')
+        for fl in db_list:
+            src = sqlite3.connect(fl)
+            try:
+                src_cursor = src.cursor()
+                src_metadata = get_metadata(src_cursor)
+                if src_metadata.get('curve_dtype') != metadata.get('curve_dtype'):
+                    raise ValueError(f'Database {fl} stores light curves in different format than {db_list[0]}.')
+                src_axes, axes = get_grid_axes(src_metadata), get_grid_axes(metadata)
+                if src_axes is not None and axes is not None and not aux.axes_equal(src_axes, axes):
+                    raise ValueError(f'Database {fl} was calculated on different grid axes than {db_list[0]}, extend '
+                                     f'the grids of the databases to the same axes before merging.')
 
-    conn.commit()
+                for table in ('parameters', 'curves'):
+                    if table_columns(src_cursor, table)[0] != columns[table]:
+                        raise ValueError(f'Columns of table `{table}` in {fl} do not match {db_list[0]}.')
+
+                    col_str = ', '.join(columns[table])
+                    sql = f"{insert} INTO {table} ({col_str}) VALUES ({', '.join('?' for _ in columns[table])})"
+                    src_cursor.execute(f"SELECT {col_str} FROM {table} ORDER BY id")
+                    while True:
+                        rows = src_cursor.fetchmany(batch_size)
+                        if len(rows) == 0:
+                            break
+                        changes = conn.total_changes
+                        try:
+                            cursor.executemany(sql, rows)
+                        except sqlite3.IntegrityError:
+                            raise ValueError(f'Database {fl} contains models with IDs already present in merged '
+                                             f'databases. Use `on_duplicate=\'skip\'` to ignore them.')
+                        n_rows += conn.total_changes - changes
+                        if table == 'parameters':
+                            n_models += conn.total_changes - changes
+                            n_duplicates += len(rows) - (conn.total_changes - changes)
+
+                for table, (ledger_columns, _) in NODE_LEDGERS.items():
+                    if not table_exists(src_cursor, table):
+                        continue
+                    col_str = ', '.join(ledger_columns)
+                    src_cursor.execute(f"SELECT {col_str} FROM {table}")
+                    while True:
+                        rows = src_cursor.fetchmany(batch_size)
+                        if len(rows) == 0:
+                            break
+                        cursor.executemany(f"INSERT OR IGNORE INTO {table} ({col_str}) "
+                                           f"VALUES ({', '.join('?' for _ in ledger_columns)})", rows)
+
+                src_bitmap = CompletionBitmap.load(src_cursor)
+                completion.resize(src_bitmap.bits.size)
+                completion.bits[:src_bitmap.bits.size] |= src_bitmap.bits
+            finally:
+                src.close()
+
+            elapsed = time() - start_time
+            print(f'Merged {fl}: {n_models} models in {elapsed:.1f} s ({n_rows / max(elapsed, 1e-9):.0f} rows/s), '
+                  f'{n_duplicates} duplicate models skipped.')
+
+        completion.dirty = set(range(int(np.ceil(completion.bits.size / config.COMPLETION_BLOCK_SIZE))))
+        completion.save(cursor)
+        cursor.execute('COMMIT')
+    except Exception:
+        conn.close()
+        os.remove(result_db)
+        raise
+
+    # metadata and indices are created after the bulk load
+    create_table('metadata', ('key', 'value'), ('TEXT', 'TEXT'), conn, cursor, **dict(additive='PRIMARY KEY (key)'))
+    set_metadata(metadata, conn, cursor)
+    for sql in indices:
+        cursor.execute(sql)
+    if with_rtree:
+        create_parameter_indices(cursor)
+        cursor.execute('ANALYZE')
     conn.close()
 
+    elapsed = time() - start_time
+    print(f'Merging finished: {n_models} models in {elapsed:.1f} s ({n_rows / max(elapsed, 1e-9):.0f} rows/s).')
 
-def get_observations(db_name, ids, passbands):
+
+def remap_grid_ids(db_name, new_axes, old_axes=None, valid_mask=None, batch_size=None):
     """
-    Returns observations with ids and in given passbands.
+    Converts IDs of the models, evaluation times, failures and completion bitmap of the grid database into IDs of the
+    same nodes within the grid with new axes and records the new axes in the metadata. Tables keyed by node ID are
+    rewritten in order of the new IDs within a single transaction, nodes introduced by the new axes stay unfinished.
+    Stored nodes which are not valid within the new grid (validity rules of overcontacts depend on the smallest radius
+    and on the neighbouring temperatures of the axes) are removed within the same transaction. Original axes are kept
+    in the metadata as well.
 
-    :param db_name:
-    :param ids:
-    :param passbands:
-    :return:
+    :param db_name: str; path to the database
+    :param new_axes: dict; named axes of the new grid (see `aux.grid_axes`), all values of the original axes have to
+                           be preserved
+    :param old_axes: dict; named axes of the original grid, required only for databases without recorded axes
+    :param valid_mask: numpy.array; flattened validity mask of the (q, r1, r2, t1, t2) cube of the new grid (see
+                                    `eb_grid_generator.valid_node_mask`), all stored nodes are kept if None
+    :param batch_size: int; number of IDs inserted into the mapping at once
+    :return: int; number of remapped nodes
+    """
+    batch_size = config.READ_BATCH_SIZE if batch_size is None else batch_size
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+
+    stored_axes = get_grid_axes(get_metadata(cursor))
+    if stored_axes is None and old_axes is None:
+        conn.close()
+        raise ValueError(f'Grid axes are not recorded in {db_name}, provide the axes of the original grid.')
+    if stored_axes is not None and old_axes is not None and not aux.axes_equal(stored_axes, old_axes):
+        conn.close()
+        raise ValueError(f'Provided axes of the original grid differ from the axes recorded in {db_name}.')
+    old_axes = stored_axes if old_axes is None else old_axes
+    if aux.axes_equal(old_axes, new_axes):
+        conn.close()
+        return 0
+
+    tables = [table for table in ('parameters', 'curves') + tuple(NODE_LEDGERS) if table_exists(cursor, table)]
+    indices = [row[0] for row in cursor.execute(
+        f"SELECT sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL AND tbl_name IN "
+        f"({', '.join('?' for _ in tables)})", tables)]
+
+    n_incl = len(new_axes['I_ARRAY'])
+
+    def add_mapping(ids):
+        # invalidated nodes are mapped to NULL and they are left out of the rewritten tables
+        new_ids = aux.remap_ids(ids, old_axes, new_axes)
+        valid = np.ones(ids.size, dtype=bool) if valid_mask is None else valid_mask[new_ids // n_incl]
+        mapped = [new_id if keep else None for new_id, keep in zip(new_ids.tolist(), valid.tolist())]
+        for start in range(0, ids.size, batch_size):
+            batch = slice(start, start + batch_size)
+            cursor.executemany("INSERT INTO temp.id_map (old_id, new_id) VALUES (?, ?)",
+                               zip(ids[batch].tolist(), mapped[batch]))
+        return new_ids[valid]
+
+    completion = CompletionBitmap.load(cursor)
+    old_ids = np.flatnonzero(completion.bits)
+    # databases created before the introduction of the completion bitmap and metadata
+    create_table('completion', ('block', 'bits'), ('INTEGER', 'BLOB'), conn, cursor,
+                 **dict(additive='PRIMARY KEY (block)'))
+    create_table('metadata', ('key', 'value'), ('TEXT', 'TEXT'), conn, cursor, **dict(additive='PRIMARY KEY (key)'))
+    try:
+        cursor.execute('BEGIN')
+        cursor.execute("CREATE TEMP TABLE id_map (old_id INTEGER, new_id INTEGER, PRIMARY KEY (old_id))")
+        new_ids = add_mapping(old_ids)
+        n_kept = new_ids.size
+        # nodes stored without being marked as finished (should not occur)
+        for table in tables:
+            extra = np.array(cursor.execute(f"SELECT id FROM {table} WHERE id NOT IN (SELECT old_id FROM temp.id_map)")
+                             .fetchall(), dtype=np.int64).ravel()
+            n_kept += add_mapping(np.setdiff1d(extra, old_ids)).size
+            old_ids = np.union1d(old_ids, extra)
+
+        # original tables are renamed without altering the foreign keys referencing them and replaced by the remapped
+        # copies created with the original schema
+        cursor.execute('PRAGMA legacy_alter_table=ON')
+        for table in tables:
+            sql = cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table, )).fetchone()[0]
+            columns = table_columns(cursor, table)[0]
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_original")
+            cursor.execute(sql)
+            col_str = ', '.join(f'o.{column}' if column != 'id' else 'm.new_id' for column in columns)
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {col_str} FROM {table}_original AS o "
+                           f"JOIN temp.id_map AS m ON m.old_id = o.id WHERE m.new_id IS NOT NULL ORDER BY m.new_id")
+            cursor.execute(f"DROP TABLE {table}_original")
+        for sql in indices:
+            cursor.execute(sql)
+        if table_exists(cursor, RTREE_TABLE):
+            # triggers of the original `parameters` table were dropped together with the table
+            create_parameter_indices(cursor, rebuild=True)
+
+        remapped = CompletionBitmap()
+        remapped.mark(new_ids)
+        remapped.dirty = set(range(int(np.ceil(remapped.bits.size / config.COMPLETION_BLOCK_SIZE))))
+        cursor.execute("DELETE FROM completion")
+        remapped.save(cursor)
+        cursor.executemany("REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                           [(GRID_AXES_KEY, dump_grid_axes(new_axes)),
+                            (ORIGINAL_GRID_AXES_KEY, dump_grid_axes(old_axes))])
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        conn.close()
+        raise
+    conn.close()
+    print(f'IDs of {n_kept} nodes of {db_name} were remapped to the new grid, {old_ids.size - n_kept} nodes invalid '
+          f'within the new grid were removed.')
+    return int(n_kept)
+
+
+def get_observations(db_name, ids, passbands, batch_size=None):
+    """
+    Returns observations with ids and in given passbands. Selection is performed by SQLite using temporary table of
+    requested IDs joined on the primary key of `curves` table and the light curves are read in batches. Phases of the
+    light curves are returned as well if the database uses non-uniform phase scheme.
+
+    :param db_name: str; path to the database
+    :param ids: numpy.array; IDs of requested models
+    :param passbands: list; names of the passband columns (eg. `Bessell_V`)
+    :param batch_size: int; number of models read from the database at once
+    :return: dict; {'id': IDs of found models in requested order, passband: (n_found, n_points) array of light curves,
+                    `phases`: (n_found, n_points) array of phases if stored in the database}
     """
     invalid_passbands = [passband for passband in passbands if passband not in config.PASSBAND_COLLUMN_MAP.values()]
     if len(invalid_passbands) > 0:
         raise ValueError(f'Invalid passbands: {invalid_passbands}.')
 
-    psbnd_str = ', '.join(passbands) + ', id'
+    batch_size = config.READ_BATCH_SIZE if batch_size is None else batch_size
+    ids = np.asarray(ids, dtype=np.int64).ravel()
 
-    conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
-    # sql = f"SELECT {psbnd_str} FROM curves where id in ({clmns})"
-    sql = f"SELECT {psbnd_str} FROM curves"
-    # cursor.execute(sql, ids)
-    cursor.execute(sql)
 
-    resfile = {passband: [] for passband in passbands}
-    for ii, row in enumerate(cursor):
-        print(ii)
-        if row[-1] in ids:
-            for ii, passband in enumerate(passbands):
-                resfile[passband].append(row[ii])
+    metadata = get_metadata(cursor)
+    curve_dtype = metadata.get('curve_dtype', 'npy')
+    n_points = int(metadata.get('n_points', config.N_POINTS))
+    flux_dtype = np.float64 if curve_dtype == 'npy' else np.dtype(curve_dtype)
+    dtypes = {passband: curve_dtype for passband in passbands}
+    if PHASES_COLUMN in table_columns(cursor, 'curves')[0]:
+        dtypes[PHASES_COLUMN] = PHASES_DTYPE
+
+    cursor.execute("CREATE TEMP TABLE selected_ids (position INTEGER PRIMARY KEY, id INTEGER)")
+    cursor.executemany("INSERT INTO selected_ids (position, id) VALUES (?, ?)", enumerate(ids.tolist()))
 
+    psbnd_str = ', '.join(f'curves.{column}' for column in dtypes)
+    cursor.execute(f"SELECT selected_ids.position, {psbnd_str} FROM selected_ids "
+                   f"JOIN curves ON curves.id = selected_ids.id")
+
+    found = np.zeros(ids.size, dtype=bool)
+    resfile = {column: np.empty((ids.size, n_points), dtype=flux_dtype if dtype == curve_dtype else dtype)
+               for column, dtype in dtypes.items()}
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+
+        positions = np.array([row[0] for row in rows], dtype=np.int64)
+        found[positions] = True
+        for ii, (column, dtype) in enumerate(dtypes.items()):
+            resfile[column][positions] = decode_curves([row[ii + 1] for row in rows], dtype, n_points)
+
+    conn.close()
+
+    resfile = {passband: curves[found] for passband, curves in resfile.items()}
+    resfile['id'] = ids[found]
     return resfile
+
+
+def create_parameter_indices(cursor, rebuild=False):
+    """
+    Creates composite index, index of inclinations and R-tree over the parameters of the binary models (without
+    commit). R-tree is kept up to date by triggers of `parameters` table, so the indices are maintained by all later
+    inserts.
+
+    :param cursor: sqlite3.Cursor;
+    :param rebuild: bool; refill existing R-tree (eg. after the bulk load with disabled triggers)
+    :return: None
+    """
+    columns = table_columns(cursor, 'parameters')[0]
+    missing = [column for column in RANGE_COLUMNS + ('overcontact', ) if column not in columns]
+    if len(missing) > 0:
+        raise ValueError(f'Parameters {missing} required by the range queries are missing in the database.')
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {COMPOSITE_INDEX} ON parameters "
+                   f"(overcontact, {', '.join(RANGE_COLUMNS)})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {INCLINATION_INDEX} ON parameters (inclination)")
+
+    # R-tree stores points as boxes with equal lower and upper bounds
+    bounds = ', '.join(f'{column}_min, {column}_max' for column in RTREE_COLUMNS)
+    values = ', '.join(f'{{row}}.{column}, {{row}}.{column}' for column in RTREE_COLUMNS)
+    if rebuild or not table_exists(cursor, RTREE_TABLE):
+        cursor.execute(f"DROP TABLE IF EXISTS {RTREE_TABLE}")
+        cursor.execute(f"CREATE VIRTUAL TABLE {RTREE_TABLE} USING rtree(id, {bounds})")
+        cursor.execute(f"INSERT INTO {RTREE_TABLE} SELECT id, {values.format(row='parameters')} FROM parameters")
+    # REPLACE into `parameters` does not fire the delete trigger, the R-tree entry is replaced by the insert trigger
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_insert AFTER INSERT ON parameters BEGIN "
+                   f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (new.id, {values.format(row='new')}); END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_delete AFTER DELETE ON parameters BEGIN "
+                   f"DELETE FROM {RTREE_TABLE} WHERE id = old.id; END")
+
+
+def build_parameter_indices(db_name):
+    """
+    Builds indices used by `query_models` over mass ratio, equivalent radii, effective temperatures and inclination
+    of the binary models. Indices are maintained during the later calculations and rebuilt by `merge_databases`.
+
+    :param db_name: str; path to the database
+    :return: None
+    """
+    start_time = time()
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN')
+        create_parameter_indices(cursor)
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        conn.close()
+        raise
+    # statistics enable the query planner to skip-scan the low cardinality leading column of the composite index
+    cursor.execute('ANALYZE')
+    conn.close()
+    print(f'Parameter indices of {db_name} built in {time() - start_time:.1f} s.')
+
+
+def range_query(ranges=None, morphology=None, index='auto'):
+    """
+    Composes SQL query selecting the parameters of the models within given ranges.
+
+    :param ranges: dict; {column: (lower bound, upper bound)}, see `query_models`
+    :param morphology: str; None, `detached` or `overcontact`
+    :param index: str; `auto`, `rtree`, `composite` or `inclination`
+    :return: tuple; (SQL string, list of arguments), query without arguments selects all models
+    """
+    ranges = dict() if ranges is None else ranges
+    invalid = [column for column in ranges if column not in RANGE_COLUMNS]
+    if len(invalid) > 0:
+        raise ValueError(f'Range queries are not supported for parameters {invalid}, use {RANGE_COLUMNS}.')
+    if morphology is not None and morphology not in MORPHOLOGIES:
+        raise ValueError(f'Invalid value of `morphology`: {morphology}. Use `detached` or `overcontact`.')
+    if index not in ['auto', 'rtree', 'composite', 'inclination']:
+        raise ValueError(f'Invalid value of `index`: {index}. Use `auto`, `rtree`, `composite` or `inclination`.')
+
+    # bounds are checked on the exact values, R-tree stores the coordinates in single precision rounded outwards
+    conditions, args, rtree_conditions, rtree_args = [], [], [], []
+    for column, (lower, upper) in ranges.items():
+        if lower is not None:
+            conditions.append(f'p.{column} >= ?')
+            args.append(lower)
+            if column in RTREE_COLUMNS:
+                rtree_conditions.append(f'r.{column}_max >= ?')
+                rtree_args.append(lower)
+        if upper is not None:
+            conditions.append(f'p.{column} <= ?')
+            args.append(upper)
+            if column in RTREE_COLUMNS:
+                rtree_conditions.append(f'r.{column}_min <= ?')
+                rtree_args.append(upper)
+    if morphology is not None:
+        conditions.insert(0, 'p.overcontact = ?')
+        args.insert(0, MORPHOLOGIES[morphology])
+
+    if index == 'rtree' or (index == 'auto' and len(rtree_conditions) > 0):
+        source = f'{RTREE_TABLE} AS r JOIN parameters AS p ON p.id = r.id'
+        conditions, args = rtree_conditions + conditions, rtree_args + args
+    elif index == 'composite' or (index == 'auto' and morphology is not None):
+        source = f'parameters AS p INDEXED BY {COMPOSITE_INDEX}'
+    elif index == 'inclination' or (index == 'auto' and len(conditions) > 0):
+        # only the inclination is constrained, the composite index would be scanned whole
+        source = f'parameters AS p INDEXED BY {INCLINATION_INDEX}'
+    else:
+        source = 'parameters AS p'
+    where = f" WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ''
+    return f"SELECT p.* FROM {source}{where} ORDER BY p.id", args
+
+
+def query_plan(cursor, sql, args):
+    """
+    Returns query plan of given query and verifies that the parameters are searched by the indices built by
+    `build_parameter_indices`. Full scans of `parameters` table or of its indices and R-tree scans without spatial
+    constraints are refused.
+
+    :param cursor: sqlite3.Cursor;
+    :param sql: str;
+    :param args: list;
+    :return: list; details of the query plan
+    """
+    plan = [row[-1].strip() for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", args)]
+    # R-tree strategy 2 followed by the constraints is the spatial search, strategy 1 is a lookup by ID
+    searched = any(re.match(r'SEARCH p USING (COVERING )?INDEX ', detail) or
+                   re.match(r'SCAN r VIRTUAL TABLE INDEX 2:\S', detail) for detail in plan)
+    if not searched or any(detail.startswith('SCAN p') for detail in plan):
+        raise RuntimeError(f'Query does not search the parameter indices: {plan}')
+    return plan
+
+
+def query_models(db_name, ranges=None, morphology=None, passbands=None, index='auto', batch_size=None):
+    """
+    Returns parameters and light curves of the binary models within given ranges of parameters, eg. detached systems
+    with 0.2 <= q <= 0.4, r1 <= 0.1 and 5000 <= T1 <= 7000::
+
+        models = query_models('path/to/grid.db', ranges={'mass_ratio': (0.2, 0.4),
+                                                         'primary__equivalent_radius': (None, 0.1),
+                                                         'primary__t_eff': (5000, 7000)},
+                              morphology='detached', passbands=['Bessell_V'])
+
+    Models are searched by R-tree over mass ratio, radii and temperatures if any of them is constrained, otherwise by
+    the composite index led by the morphology or by the index of inclinations. Indices are built on the first query if
+    they are missing (see `build_parameter_indices`). Query without any constraints reads all models.
+
+    :param db_name: str; path to the database
+    :param ranges: dict; {column: (lower bound, upper bound)} for columns in `RANGE_COLUMNS`, bounds are inclusive,
+                         None stands for unbounded interval
+    :param morphology: str; None (all), `detached` or `overcontact`
+    :param passbands: list; names of the passband columns (eg. `Bessell_V`), all passbands by default, empty list
+                            returns only parameters
+    :param index: str; `auto`, `rtree`, `composite` or `inclination` forcing the index used to search the
+                       parameters
+    :param batch_size: int; number of models read from the database at once
+    :return: dict; {'id': IDs of found models in ascending order, 'parameters': structured array of parameters,
+                    passband: (n_found, n_points) array of light curves, `phases`: (n_found, n_points) array of phases
+                    if stored in the database}
+    """
+    batch_size = config.READ_BATCH_SIZE if batch_size is None else batch_size
+    sql, args = range_query(ranges, morphology, index)
+
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    if not table_exists(cursor, RTREE_TABLE) or not index_exists(cursor, INCLINATION_INDEX):
+        conn.close()
+        build_parameter_indices(db_name)
+        conn = sqlite3.connect(db_name)
+        cursor = conn.cursor()
+    if len(args) > 0:
+        query_plan(cursor, sql, args)
+    else:
+        print(f'No constraints were given, all models of {db_name} are read by the full scan.')
+
+    param_columns, param_types = table_columns(cursor, 'parameters')
+    if passbands is None:
+        passbands = [column for column in table_columns(cursor, 'curves')[0][1:] if column != PHASES_COLUMN]
+
+    parameters = []
+    cursor.execute(sql, args)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        parameters.append(np.array(rows, dtype=parameter_dtype(param_columns, param_types)))
+    conn.close()
+    parameters = np.concatenate(parameters) if len(parameters) > 0 else \
+        np.empty(0, dtype=parameter_dtype(param_columns, param_types))
+
+    if len(passbands) == 0:
+        return dict(id=parameters['id'], parameters=parameters)
+    result = get_observations(db_name, parameters['id'], passbands, batch_size)
+    # models without light curves are not returned
+    result['parameters'] = parameters[np.isin(parameters['id'], result['id'])]
+    return result
@@ -1,8 +1,9 @@
+import os
 import numpy as np
 
-from eb_gridmaker.utils import aux, physics, multiproc
+from eb_gridmaker.utils import aux, physics, multiproc, cache, precalc, phase_schemes, metrics
 from eb_gridmaker import dtb, config
-from elisa import BinarySystem, settings, Observer
+from elisa import settings
 from elisa.base.error import LimbDarkeningError, AtmosphereError
 
 
@@ -26,46 +27,120 @@ def basic_param_eval(params, crit_potentials=None, omega1=None, omega2=None):
     r2 = params[2]
     t1, t2 = params[3], params[4]
     if omega1 <= crit_potentials[2]:  # check for system overflow through L2
+        metrics.METRICS.reject('l2_overflow')
         return False, None
 
     if omega1 < crit_potentials[1]:  # treating overcontact
         if r2 != config.R_ARRAY[0]:  # this removes duplicity of overcontacts due to fixed radius of secondary
+            metrics.METRICS.reject('overcontact_duplicity')
             return False, None
         elif t2 > config.T_MAX_OVERCONTACT or t1 > config.T_MAX_OVERCONTACT:
+            metrics.METRICS.reject('hot_overcontact')
             return False, None  # do not sample too hot overcontacts
 
         elif np.abs(t2-t1) > config.MAX_DIFF_T_OVERCONTACT:
             idx_t1 = np.where(t1 == config.T_ARRAY)[0]
             idx_t2 = np.where(t2 == config.T_ARRAY)[0]
             if np.abs(idx_t1-idx_t2) > 1:  # not allowing too different temperatures in overcontacts
+                metrics.METRICS.reject('overcontact_t_diff')
                 return False, None
 
         overcontact = True
     else:  # treating detached
         if omega2 < crit_potentials[1]:
+            metrics.METRICS.reject('roche_lobe_overflow')
             return False, None
         overcontact = False
 
     return True, overcontact
 
 
-def eval_binary_grid_node(iden, counter, crit_potentials, omega1_grid, omega2_grid, i_crits, phases, maxiter,
-                          start_index, desired_morphology):
+def basic_param_eval_grid(crit_potentials, omega1_grid, omega2_grid):
     """
-    Evaluating binary system located on grid node defined by its unique ID.
+    Vectorized version of `basic_param_eval` evaluated over the whole (q, r1, r2, t1, t2) cube of grid nodes. Validity
+    of the node does not depend on the inclination.
 
-    :param desired_morphology: string; `all`, `detached`, `overcontact`
-    :param iden: str; node ID
-    :param counter: int; current number of already calculeted nodes
-    :param crit_potentials: float; critical potential of the system
+    :param crit_potentials: numpy.array; critical potentials [L3, L1, L2] for each mass ratio
     :param omega1_grid: numpy.array; pre-calculated grid of primary surface potentials
     :param omega2_grid: numpy.array; pre-calculated grid of secondary surface potentials
-    :param i_crits: numpy.array; pre-calculated grid of critical inclinations
-    :param phases: numpy.array; desired phases of observations
-    :param maxiter: int; total number of nodes in this batch
-    :param start_index: int; number of iterations already calculated before interruption
-    :return: None
+    :return: tuple; (numpy.array, numpy.array, dict) validity and overcontact masks of the (q, r1, r2, t1, t2) cube,
+                    masks of rejected nodes for each rejection reason
     """
+    shape = (config.Q_ARRAY.size, config.R_ARRAY.size, config.R_ARRAY.size, config.T_ARRAY.size, config.T_ARRAY.size)
+    crit_potentials = np.asarray(crit_potentials)
+    l1_potentials = crit_potentials[:, 1, None, None, None, None]
+    l2_potentials = crit_potentials[:, 2, None, None, None, None]
+
+    omega1 = omega1_grid[:, :, None, None, None]
+    omega2 = omega2_grid[:, None, :, None, None]
+    t1, t2 = config.T_ARRAY[:, None], config.T_ARRAY[None, :]
+    t_idx = np.arange(config.T_ARRAY.size)
+    t_idx_diff = np.abs(t_idx[:, None] - t_idx[None, :])
+    r2_idx = np.arange(config.R_ARRAY.size)[None, None, :, None, None]
+
+    l2_overflow = np.broadcast_to(omega1 <= l2_potentials, shape)
+    overcontact = np.broadcast_to(omega1 < l1_potentials, shape) & ~l2_overflow
+    detached = ~(l2_overflow | overcontact)
+
+    rejections = dict()
+    rejections['l2_overflow'] = l2_overflow
+    rejections['overcontact_duplicity'] = overcontact & (r2_idx != 0)
+    valid_oc = overcontact & ~rejections['overcontact_duplicity']
+    rejections['hot_overcontact'] = valid_oc & ((t1 > config.T_MAX_OVERCONTACT) | (t2 > config.T_MAX_OVERCONTACT))
+    valid_oc &= ~rejections['hot_overcontact']
+    rejections['overcontact_t_diff'] = valid_oc & (np.abs(t2 - t1) > config.MAX_DIFF_T_OVERCONTACT) & (t_idx_diff > 1)
+    valid_oc &= ~rejections['overcontact_t_diff']
+    rejections['roche_lobe_overflow'] = detached & (omega2 < l1_potentials)
+
+    valid = valid_oc | (detached & ~rejections['roche_lobe_overflow'])
+    return valid, overcontact, rejections
+
+
+def valid_node_mask(crit_potentials, omega1_grid, omega2_grid, desired_morphology='all', ids=None):
+    """
+    Returns validity of the grid nodes with given morphology in the form of the mask applicable on grid node IDs as
+    `mask[ids // config.I_ARRAY.size]`.
+
+    :param crit_potentials: numpy.array; critical potentials [L3, L1, L2] for each mass ratio
+    :param omega1_grid: numpy.array; pre-calculated grid of primary surface potentials
+    :param omega2_grid: numpy.array; pre-calculated grid of secondary surface potentials
+    :param desired_morphology: str; `all`, `detached`, `overcontact`
+    :param ids: numpy.array; node IDs where the rejected nodes are counted, the whole grid is used by default
+    :return: tuple; (numpy.array, numpy.array, dict) flattened validity and overcontact masks of the
+                    (q, r1, r2, t1, t2) cube, number of rejected nodes for each rejection reason
+    """
+    valid, overcontact, rejections = basic_param_eval_grid(crit_potentials, omega1_grid, omega2_grid)
+    if desired_morphology == 'detached':
+        rejections['morphology'] = valid & overcontact
+        valid = valid & ~overcontact
+    elif desired_morphology == 'overcontact':
+        rejections['morphology'] = valid & ~overcontact
+        valid = valid & overcontact
+
+    if ids is None:
+        rejections = {reason: config.I_ARRAY.size * int(mask.sum()) for reason, mask in rejections.items()}
+    else:
+        cube_idxs = ids // config.I_ARRAY.size
+        rejections = {reason: int(np.count_nonzero(mask.ravel()[cube_idxs])) for reason, mask in rejections.items()}
+
+    return valid.ravel(), overcontact.ravel(), rejections
+
+
+def prepare_binary_grid_node(iden, desired_morphology):
+    """
+    Returns parameters of the binary system located on grid node defined by its unique ID in the form suitable for
+    `physics.initialize_system`. Pre-calculated grids are read from the worker context.
+
+    :param iden: int; node ID
+    :param desired_morphology: string; `all`, `detached`, `overcontact`
+    :return: Union[None, tuple]; (params, keyword arguments of `physics.initialize_system`), None if node was
+                                 rejected
+    """
+    crit_potentials = multiproc.WORKER_CONTEXT['crit_potentials']
+    omega1_grid = multiproc.WORKER_CONTEXT['omega1_grid']
+    omega2_grid = multiproc.WORKER_CONTEXT['omega2_grid']
+    i_crits = multiproc.WORKER_CONTEXT['i_crits']
+
     params, idxs = aux.get_params_from_id(iden)
     valid, overcontact = basic_param_eval(params,
                                           crit_potentials=crit_potentials[idxs[0]],
@@ -74,37 +149,270 @@ def eval_binary_grid_node(iden, counter, crit_potentials, omega1_grid, omega2_gr
 
     if not valid:
         return
-    if desired_morphology == 'detached' and overcontact:
-        return
-    elif desired_morphology == 'overcontact' and not overcontact:
+    if (desired_morphology == 'detached' and overcontact) or (desired_morphology == 'overcontact' and not overcontact):
+        metrics.METRICS.reject('morphology')
         return
 
     omega1 = omega1_grid[idxs[0], idxs[1]]
     omega2 = omega1 if overcontact else omega2_grid[idxs[0], idxs[2]]
 
     # if secondary component t_eff is bigger, switch primary and secondary components
+    suffix = '_switched' if params[4] >= params[3] else ''
     params, omega1, omega2 = physics.switch_components(*params, omega1=omega1, omega2=omega2)
 
     params[-1] = aux.generate_i(i_crits[idxs[1], idxs[2]], params[-1])
+    sma = multiproc.WORKER_CONTEXT['sma' + suffix][idxs[0], idxs[1], idxs[2]]
+    period = multiproc.WORKER_CONTEXT['period' + suffix][idxs[0], idxs[1], idxs[2]]
+    return params, dict(omega1=omega1, omega2=omega2, overcontact=overcontact, sma=sma, period=period)
+
+
+def grid_node_phases(params, overcontact):
+    """
+    Returns phases of the light curve of the grid node according to the phase scheme of the database read from the
+    worker context. Light curves of overcontact systems vary along the whole orbit, therefore they are always sampled
+    uniformly.
+
+    :param params: list; [q, r1, r2, t1, t2, i] parameters of the node with inclination in degrees
+    :param overcontact: bool;
+    :return: tuple; (phases of the observation, phases stored in the database or None for uniform phase scheme)
+    """
+    scheme = multiproc.WORKER_CONTEXT['phase_scheme']
+    if scheme == 'uniform':
+        return multiproc.WORKER_CONTEXT['phases'], None
+    phases = multiproc.WORKER_CONTEXT['phases'] if overcontact else \
+        phase_schemes.node_phases(params[1], params[2], params[-1], scheme)
+    return phases, phases
 
-    bs = physics.initialize_system(*params, omega1=omega1, omega2=omega2, overcontact=overcontact)
-    o = Observer(passband=config.PASSBANDS, system=bs)
+
+def observe_circular(observer, phases):
+    """
+    Calculates normalized light curves of the circular binary without spots. Light curve of such system is symmetric
+    around phases 0 and 0.5, therefore with `config.SYMMETRIC_EVALUATION` only the phases from <0, 0.5> interval are
+    evaluated and the light curves are mirrored onto the remaining phases.
+
+    :param observer: elisa.Observer;
+    :param phases: numpy.array; requested phases
+    :return: None
+    """
+    system = getattr(observer, '_system')
+    if not config.SYMMETRIC_EVALUATION or system.has_spots() or system.has_pulsations() or \
+            system.additional_light != 0:
+        observer.lc(phases=phases, normalize=True)
+        return
+
+    unique_phases, reverse_map = phase_schemes.fold_phases(phases)
+    observer.lc(phases=unique_phases, normalize=True)
+    observer.phases = phases
+    observer.fluxes = {band: flux[reverse_map] for band, flux in observer.fluxes.items()}
+
+
+def symmetry_check(iden, binary, initial_system, observer, phases):
+    """
+    Validates mirrored light curves of randomly selected `config.SYMMETRY_CHECK_FRACTION` of grid nodes against the
+    evaluation of all phases. Nodes whose light curves differ by more than `config.SYMMETRY_CHECK_TOLERANCE` are
+    reported.
+
+    :param iden: int; node ID
+    :param binary: elisa.BinarySystem;
+    :param initial_system: elisa.binary_system.container.OrbitalPositionContainer; built surface of the system,
+                           built from scratch if None
+    :param observer: elisa.Observer; observer with mirrored light curves
+    :param phases: numpy.array; phases of the light curves
+    :return: Union[None, float]; maximum difference of the light curves, None if the node was not selected
+    """
+    if not config.SYMMETRIC_EVALUATION or config.SYMMETRY_CHECK_FRACTION <= 0 or \
+            np.random.default_rng(int(iden)).random() >= config.SYMMETRY_CHECK_FRACTION:
+        return
+
+    initial_system = physics.build_initial_system(binary) if initial_system is None else initial_system
+    full = cache.get_observer(physics.attach_prebuilt_system(binary, initial_system, symmetric=False))
+    full.lc(phases=phases, normalize=True)
+    difference = max(np.max(np.abs(full.fluxes[band] - observer.fluxes[band])) for band in config.PASSBANDS)
+    if difference > config.SYMMETRY_CHECK_TOLERANCE:
+        print(f'Mirrored light curves of node {iden} differ from the full evaluation by {difference:.3e}.')
+    return difference
+
+
+def eval_binary_grid_node(iden, counter, maxiter, start_index, desired_morphology):
+    """
+    Evaluating binary system located on grid node defined by its unique ID. Pre-calculated grids `crit_potentials`,
+    `omega1_grid`, `omega2_grid`, `i_crits`, `phases` and `phase_scheme` are read from the worker context installed
+    by `multiproc.multiprocess_eval`.
+
+    :param desired_morphology: string; `all`, `detached`, `overcontact`
+    :param iden: str; node ID
+    :param counter: int; current number of already calculeted nodes
+    :param maxiter: int; total number of nodes in this batch
+    :param start_index: int; number of iterations already calculated before interruption
+    :return: Union[None, tuple]; observation record for database writer, None if node was rejected
+    """
+    node = prepare_binary_grid_node(iden, desired_morphology)
+    if node is None:
+        return
+    params, kwargs = node
+
+    with metrics.METRICS.timer('initialization'):
+        bs = physics.initialize_system(*params, **kwargs)
+        o = cache.get_observer(bs)
+    phases, stored_phases = grid_node_phases(params, kwargs['overcontact'])
 
     try:
-        o.lc(phases=phases, normalize=True)
+        with metrics.METRICS.timer('lc'):
+            observe_circular(o, phases)
         # o.plot.lc()
+        with metrics.METRICS.timer('symmetry_check'):
+            symmetry_check(iden, bs, None, o, phases)
     except (LimbDarkeningError, AtmosphereError) as e:
         # print(f'Parameters: {params} produced system outside grid coverage.')
-        return
+        raise multiproc.Rejected(type(e).__name__)
 
-    dtb.insert_observation(
-        config.DATABASE_NAME, o, iden, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY
-    )
-    aug_counter = counter + start_index
-    print(f'Node processed: {aug_counter}/{maxiter}, {100.0*aug_counter/maxiter:.2f}%')
+    if config.PRINT_NODE_PROGRESS:
+        aug_counter = counter + start_index
+        print(f'Node processed: {aug_counter}/{maxiter}, {100.0*aug_counter/maxiter:.2f}%')
+    return dtb.observation_record(o, iden, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY,
+                                  phases=stored_phases)
 
 
-def evaluate_binary_on_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_morphology='all'):
+def eval_binary_grid_block(block, counter, n_blocks, desired_morphology):
+    """
+    Evaluating all requested nodes of the (q, r1, r2) block of the grid. Surface mesh is built only once for each
+    orientation of the system (see `physics.switch_components`) and pair of discretization factors, surface
+    temperature distribution once for each pair of effective temperatures and only the light curve is calculated for
+    each inclination.
+
+    :param block: tuple; (block index, numpy.array of node IDs within the block)
+    :param counter: int; current number of already calculated blocks
+    :param n_blocks: int; total number of blocks in this batch
+    :param desired_morphology: string; `all`, `detached`, `overcontact`
+    :return: list; [(node ID, observation record or None if node was rejected, evaluation time in seconds,
+                     failure), ...], see `multiproc.evaluate_item`
+    """
+    block_idx, idens = block
+    geometries = dict()
+    # surface of the last evaluated temperature pair, or the reason of its deterministic failure
+    surface = dict(key=None, initial_system=None, error=None)
+
+    def eval_node(iden):
+        node = prepare_binary_grid_node(iden, desired_morphology)
+        if node is None:
+            return
+        params, kwargs = node
+
+        with metrics.METRICS.timer('initialization'):
+            bs = physics.initialize_system(*params, **kwargs)
+        # ELISA adjusts discretization factor of the smaller component according to the ratio of temperatures
+        geometry_key = (params[0], kwargs['omega1'], kwargs['omega2'], bs.primary.discretization_factor,
+                        bs.secondary.discretization_factor)
+        if geometry_key not in geometries:
+            with metrics.METRICS.timer('geometry'):
+                geometries[geometry_key] = physics.build_geometry(bs)
+
+        # IDs are sorted, therefore all inclinations of the given temperature pair are evaluated consecutively
+        key = geometry_key + (bs.primary.t_eff, bs.secondary.t_eff)
+        if key != surface['key']:
+            # the key is stored only after the build finished, timed out or crashed builds are repeated
+            surface.update(key=None, initial_system=None, error=None)
+            with metrics.METRICS.timer('surface'):
+                try:
+                    surface['initial_system'] = physics.build_surface(geometries[geometry_key], bs)
+                except (LimbDarkeningError, AtmosphereError) as e:
+                    surface['error'] = type(e).__name__
+            surface['key'] = key
+        if surface['error'] is not None:
+            # failure of the surface build rejects all inclinations of the temperature pair
+            raise multiproc.Rejected(surface['error'])
+
+        o = cache.get_observer(physics.attach_prebuilt_system(bs, surface['initial_system']))
+        phases, stored_phases = grid_node_phases(params, kwargs['overcontact'])
+        try:
+            with metrics.METRICS.timer('lc'):
+                observe_circular(o, phases)
+            with metrics.METRICS.timer('symmetry_check'):
+                symmetry_check(iden, bs, surface['initial_system'], o, phases)
+        except (LimbDarkeningError, AtmosphereError) as e:
+            raise multiproc.Rejected(type(e).__name__)
+        return dtb.observation_record(o, iden, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY,
+                                      phases=stored_phases)
+
+    # each node has its own time limit and retries, so a single pathological node does not discard the whole block
+    results = []
+    for iden in np.sort(idens):
+        results.append((iden, ) + multiproc.evaluate_item(eval_node, (iden, ), config.NODE_TIMEOUT))
+
+    if config.PRINT_NODE_PROGRESS:
+        print(f'Block {block_idx} processed ({len(idens)} nodes): {counter + 1}/{n_blocks}, '
+              f'{100.0 * (counter + 1) / n_blocks:.2f}%')
+    return results
+
+
+def shuffled_range(n_items):
+    """
+    Returns random permutation of range(n_items) used as the order in which grid nodes (or blocks) are evaluated and
+    split by the batch boundaries.
+
+    :param n_items: int;
+    :return: numpy.array;
+    """
+    items = np.arange(0, n_items, dtype=np.int64)
+    # randomizing calculation to fill the grid homogenously
+    np.random.seed(42)
+    np.random.shuffle(items)
+    return items
+
+
+def boundary_positions(n_items, bottom_boundary=0.0, top_boundary=1.0, positions=None):
+    """
+    Converts batch boundaries into the positions within the order of evaluation of `n_items` nodes (or blocks).
+
+    :param n_items: int;
+    :param bottom_boundary: float;
+    :param top_boundary: float;
+    :param positions: tuple; (start, stop) positions overriding the boundaries
+    :return: tuple; (start, stop)
+    """
+    if positions is not None:
+        return int(positions[0]), int(positions[1])
+    return int(bottom_boundary * n_items), int(top_boundary * n_items)
+
+
+def grid_blocks(bottom_boundary=0.0, top_boundary=1.0, positions=None):
+    """
+    Returns node IDs of randomly ordered (q, r1, r2) blocks of the grid within given sub-interval of blocks.
+
+    :param bottom_boundary: float;
+    :param top_boundary: float;
+    :param positions: tuple; (start, stop) positions of the blocks in the order of evaluation overriding the
+                             boundaries
+    :return: numpy.array; node IDs grouped by blocks
+    """
+    n_blocks = config.Q_ARRAY.size * config.R_ARRAY.size ** 2
+    block_size = config.T_ARRAY.size ** 2 * config.I_ARRAY.size
+
+    # randomizing calculation of whole blocks to fill the grid homogenously
+    start, stop = boundary_positions(n_blocks, bottom_boundary, top_boundary, positions)
+    blocks = shuffled_range(n_blocks)[start: stop]
+
+    return (blocks[:, None] * block_size + np.arange(block_size, dtype=np.int64)[None, :]).ravel()
+
+
+def grid_node_ids(bottom_boundary=0.0, top_boundary=1.0, positions=None):
+    """
+    Returns randomly ordered node IDs of the grid within given sub-interval of nodes.
+
+    :param bottom_boundary: float;
+    :param top_boundary: float;
+    :param positions: tuple; (start, stop) positions of the nodes in the order of evaluation overriding the
+                             boundaries
+    :return: numpy.array;
+    """
+    maxid = int(np.prod(aux.grid_shape()))
+    # selecting subset to calculate (if you use multiple machines to spread the task
+    start, stop = boundary_positions(maxid, bottom_boundary, top_boundary, positions)
+    return shuffled_range(maxid)[start: stop]
+
+
+def evaluate_binary_on_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_morphology='all',
+                            block_evaluation=None, positions=None, original_axes=None):
     """
     Producing sample of binary system models generated on grid of model parameter.
 
@@ -112,43 +420,81 @@ def evaluate_binary_on_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0,
     :param bottom_boundary: float;
     :param top_boundary: float;
     :param desired_morphology: str;
+    :param block_evaluation: bool; evaluate whole (q, r1, r2) blocks within a single task sharing the surface mesh,
+                                   `config.BLOCK_EVALUATION` is used by default
+    :param positions: tuple; (start, stop) positions of the nodes (or blocks) in the order of evaluation overriding
+                             the boundaries (see `coordinator`)
+    :param original_axes: dict; named axes of the original grid (see `aux.grid_axes`), if provided, only the nodes
+                                introduced by the extension of the grid are evaluated (see `extend_grid`)
     :return: None;
     """
+    block_evaluation = config.BLOCK_EVALUATION if block_evaluation is None else block_evaluation
     config.CUMULATIVE_PRODUCT = np.cumprod([o.size for o in reversed(config.sampling_order())])
     maxid = config.CUMULATIVE_PRODUCT[-1]
 
     if db_name is not None:
         config.DATABASE_NAME = db_name
-    phases = np.linspace(0, 1.0, num=config.N_POINTS, endpoint=False)
+    phases = phase_schemes.uniform_phases()
 
-    # generating IDs of each possible combination
-    ids = np.arange(0, maxid, dtype=np.int)
-    # randomizing calculation to fill the grid homogenously
-    np.random.seed(42)
-    np.random.shuffle(ids)
+    # pre-calculating critical potentials, surface potentials, critical inclinations and orbits in grid
+    grid = precalc.precalc_binary_grid()
 
-    # selecting subset to calculate (if you use multiple machines to spread the task
-    ids = ids[int(bottom_boundary * maxid): int(top_boundary * maxid)]
+    if block_evaluation:
+        # selecting subset of blocks to calculate (if you use multiple machines to spread the task)
+        ids = grid_blocks(bottom_boundary, top_boundary, positions)
+    else:
+        ids = grid_node_ids(bottom_boundary, top_boundary, positions)
+    if original_axes is not None:
+        ids = ids[aux.new_node_mask(ids, original_axes, aux.grid_axes())]
+
+    # removing invalid nodes before they are dispatched to workers
+    valid_mask, overcontact_mask, rejections = \
+        valid_node_mask(grid['crit_potentials'], grid['omega1_grid'], grid['omega2_grid'], desired_morphology, ids)
+    batch_size = len(ids)
+    cube_idxs = ids // config.I_ARRAY.size
+    n_overcontact = int(np.count_nonzero(valid_mask[cube_idxs] & overcontact_mask[cube_idxs]))
+    ids = ids[valid_mask[cube_idxs]]
     maxiter = len(ids)
-
-    dtb.create_ceb_db(config.DATABASE_NAME, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY)
-    brkpoint = dtb.search_for_breakpoint(config.DATABASE_NAME, ids) + 1
-    print(f'Breakpoint found {100.0 * brkpoint / maxiter:.2f}%: {brkpoint}/{maxiter}')
-    ids = ids[brkpoint:]
-
-    crit_potentials = [BinarySystem.libration_potentials_static(1.0, q) for q in config.Q_ARRAY]
-
-    # pre-calculating potentials in grid
-    omega1_grid = aux.precalc_grid(config.Q_ARRAY, config.R_ARRAY, physics.back_radius_potential_primary)
-    omega2_grid = aux.precalc_grid(config.Q_ARRAY, config.R_ARRAY, physics.back_radius_potential_secondary)
-    # grid of critical inclinations
-    i_crits = aux.precalc_grid(config.R_ARRAY, config.R_ARRAY, physics.critical_inclination)
-
-    args = (crit_potentials, omega1_grid, omega2_grid, i_crits, phases, maxiter, brkpoint, desired_morphology)
-    multiproc.multiprocess_eval(ids, eval_binary_grid_node, args)
-
-
-def evaluate_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_morphology='all'):
+    print(f'Valid nodes in this batch: {maxiter}/{batch_size}, detached: {maxiter - n_overcontact}, '
+          f'overcontact: {n_overcontact}')
+    print('Rejected nodes in this batch: ' + ', '.join(f'{key}: {val}' for key, val in rejections.items()))
+
+    metadata = dtb.create_ceb_db(config.DATABASE_NAME, config.PARAMETER_COLUMNS_BINARY, config.PARAMETER_TYPES_BINARY,
+                                 grid_axes=aux.grid_axes())
+    config.CURVE_DTYPE = metadata['curve_dtype']
+    completion = dtb.load_completion(config.DATABASE_NAME, maxid)
+    ids = completion.pending(ids)
+    n_finished = maxiter - len(ids)
+    print(f'Already finished nodes {100.0 * n_finished / max(maxiter, 1):.2f}%: {n_finished}/{maxiter}')
+
+    reporter = metrics.start_run(len(ids))
+    for reason, value in rejections.items():
+        metrics.METRICS.reject(reason, value)
+
+    # read-only grids are shipped to each worker only once, tasks carry only the node IDs
+    context = dict(grid, phases=phases, phase_scheme=metadata['phase_scheme'])
+    with dtb.ObservationWriter(config.DATABASE_NAME, config.PARAMETER_COLUMNS_BINARY, completion) as writer:
+        if block_evaluation:
+            # IDs are still grouped by blocks in random order of blocks
+            block_size = config.T_ARRAY.size ** 2 * config.I_ARRAY.size
+            splits = np.flatnonzero(np.diff(ids // block_size)) + 1
+            blocks = [(int(group[0] // block_size), group) for group in np.split(ids, splits) if len(group) > 0]
+
+            def add_block(result):
+                for record in result[1] if result[1] is not None else []:
+                    writer.add(record)
+
+            args = (len(blocks), desired_morphology)
+            multiproc.multiprocess_eval(blocks, eval_binary_grid_block, args, callback=add_block, context=context,
+                                        batch_size=1, reporter=reporter)
+        else:
+            args = (maxiter, n_finished, desired_morphology)
+            multiproc.multiprocess_eval(ids, eval_binary_grid_node, args, callback=writer.add, context=context,
+                                        reporter=reporter, timeout=config.NODE_TIMEOUT)
+
+
+def evaluate_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_morphology='all',
+                  block_evaluation=None):
     """
     This will evaluate the part of/whole grid using Pool of workers. Calculation can be split to bathes by defining a
     sub-interval of (0, 1) to downsize the grid calculated in this loop which is helpful if you want to split the
@@ -161,7 +507,9 @@ def evaluate_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_m
                                    once
     :param top_boundary: float; defines upper boundary of given batch, select 1 for calculation of the whole grid at
                                 once
-    :param number_of_samples: int; number of samples for random sampling
+    :param block_evaluation: bool; evaluate whole (q, r1, r2) blocks within a single task sharing the surface mesh,
+                                   `config.BLOCK_EVALUATION` is used by default, batches defined by `bottom_boundary`
+                                   and `top_boundary` are not interchangeable between block and node evaluation
     :return: None;
     """
 
@@ -171,8 +519,8 @@ def evaluate_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_m
 
     settings.configure(LOG_CONFIG='fit', MAX_DISCRETIZATION_FACTOR=8)
 
-    if desired_morphology in ['detached', 'overcontact', 'circular']:
-        evaluate_binary_on_grid(db_name, bottom_boundary, top_boundary, desired_morphology)
+    if desired_morphology in ['all', 'detached', 'overcontact', 'circular']:
+        evaluate_binary_on_grid(db_name, bottom_boundary, top_boundary, desired_morphology, block_evaluation)
     elif desired_morphology in ['single_spotty']:
         raise NotImplementedError('Grid sampling is not implemented for single systems. Try random sampling')
     elif desired_morphology in ['eccentric']:
@@ -183,6 +531,65 @@ def evaluate_grid(db_name=None, bottom_boundary=0.0, top_boundary=1.0, desired_m
                          f'`overcontact`, `single_spotty`, `eccentric`')
 
 
+def extend_grid(db_name, old_axes=None, bottom_boundary=0.0, top_boundary=1.0, desired_morphology='all',
+                block_evaluation=None):
+    """
+    Extends the grid of the database calculated on the original axes to the current axes in `config`. New values can
+    be added anywhere within the axes, IDs of the stored nodes are remapped in bulk (see `dtb.remap_grid_ids`) and only
+    the nodes introduced by the new values are evaluated. Validity of the overcontacts depends on the axes (only the
+    smallest secondary radius is sampled and temperatures of the components have to be neighbouring values of
+    `config.T_ARRAY`), therefore stored overcontacts which are not valid within the new grid are removed, eg. new
+    smallest radius replaces the stored overcontacts by the overcontacts with the new radius. Cached grid-invariant
+    quantities of the original (q, r) pairs are reused, therefore extension of `config.T_ARRAY` or `config.I_ARRAY`
+    costs only the new nodes::
+
+        config.T_ARRAY = np.append(config.T_ARRAY, 60000)
+        extend_grid('path/to/grid.db')
+
+    Batch boundaries select the portion of the new nodes, so each machine can extend its own part of the grid, missing
+    database is created with the new nodes only. Interrupted extension is resumed by the same command.
+
+    :param db_name: str; path to the database
+    :param old_axes: dict; named axes of the original grid (see `aux.grid_axes`), required only for databases without
+                           recorded axes and for new databases
+    :param bottom_boundary: float; defines lower boundary of given batch of new nodes
+    :param top_boundary: float; defines upper boundary of given batch of new nodes
+    :param desired_morphology: string; `all`, `detached`, `overcontact`
+    :param block_evaluation: bool; evaluation mode, `config.BLOCK_EVALUATION` by default
+    :return: None;
+    """
+    if desired_morphology not in ['detached', 'overcontact', 'all']:
+        raise ValueError(f'Invalid value of `desired_morphology`: {desired_morphology} argument. Use `detached`, '
+                         f'`overcontact` or `all`.')
+
+    new_axes = aux.grid_axes()
+    if os.path.isfile(db_name):
+        metadata = dtb.read_metadata(db_name)
+        stored_axes = dtb.get_grid_axes(metadata)
+        if stored_axes is not None and aux.axes_equal(stored_axes, new_axes):
+            # resuming interrupted extension
+            original_axes = dtb.get_grid_axes(metadata, dtb.ORIGINAL_GRID_AXES_KEY) if old_axes is None else old_axes
+            if original_axes is None:
+                raise ValueError(f'Database {db_name} was already calculated on the current grid axes.')
+        else:
+            grid = precalc.precalc_binary_grid()
+            valid_mask, _, _ = valid_node_mask(grid['crit_potentials'], grid['omega1_grid'], grid['omega2_grid'])
+            dtb.remap_grid_ids(db_name, new_axes, old_axes, valid_mask)
+            original_axes = stored_axes if old_axes is None else old_axes
+    elif old_axes is None:
+        raise ValueError(f'Database {db_name} does not exist, provide the axes of the original grid.')
+    else:
+        original_axes = old_axes
+
+    n_new = int(np.prod(aux.grid_shape())) - int(np.prod(aux.grid_shape(aux.sampling_axes(original_axes))))
+    print(f'Extending grid by {n_new} nodes: ' +
+          ', '.join(f'{name}: {len(original_axes[name])} -> {len(axis)}' for name, axis in new_axes.items()))
+
+    settings.configure(LOG_CONFIG='fit', MAX_DISCRETIZATION_FACTOR=8)
+    evaluate_binary_on_grid(db_name, bottom_boundary, top_boundary, desired_morphology, block_evaluation,
+                            original_axes=original_axes)
+
+
 if __name__ == "__main__":
     evaluate_grid('../../ceb_atlas1.db', 0.0, 0.5, desired_morphology='detached')
 
@@ -1,140 +1,237 @@
 import numpy as np
 
 from eb_gridmaker import dtb, config
-from eb_gridmaker.utils import aux, multiproc
-from elisa import SingleSystem, BinarySystem, Observer, settings
+from eb_gridmaker.utils import aux, multiproc, cache, sampling, metrics
+from elisa import SingleSystem, BinarySystem, settings
 from elisa.base.error import LimbDarkeningError, AtmosphereError, MorphologyError
 
 
-def spotty_single_system_random_sampling(db_name=None, number_of_samples=1e4):
+def resolve_seed(db_name, metadata, seed=None):
+    """
+    Returns seed of the random sampling stored in the database metadata. Seed of a new database is given by `seed`,
+    `config.RANDOM_SEED` or it is generated randomly, and it is stored in the metadata, so the interrupted calculation
+    continues with the same random streams.
+
+    :param db_name: str; path to the database
+    :param metadata: dict; metadata of the database
+    :param seed: int; requested seed
+    :return: int;
+    """
+    seed = config.RANDOM_SEED if seed is None else seed
+    if 'random_seed' in metadata:
+        if seed is not None and int(seed) != int(metadata['random_seed']):
+            raise ValueError(f'Database {db_name} was sampled with seed {metadata["random_seed"]} while seed {seed} '
+                             f'was requested.')
+        return int(metadata['random_seed'])
+
+    seed = int(np.random.SeedSequence().generate_state(1, dtype=np.uint64)[0]) if seed is None else int(seed)
+    dtb.write_metadata(db_name, dict(random_seed=seed))
+    return seed
+
+
+def sample_ids(number_of_samples, bottom_boundary=0.0, top_boundary=1.0):
+    """
+    Returns IDs of the samples within the given portion of the sample.
+
+    :param number_of_samples: int; total number of samples
+    :param bottom_boundary: float; (0, 1) portion of the sample where to start
+    :param top_boundary: float; (0, 1) portion of the sample where to stop
+    :return: numpy.array;
+    """
+    number_of_samples = int(number_of_samples)
+    return np.arange(int(bottom_boundary * number_of_samples), int(top_boundary * number_of_samples),
+                     dtype=np.int64)
+
+
+def spotty_single_system_random_sampling(db_name=None, number_of_samples=1e4, seed=None, bottom_boundary=0.0,
+                                         top_boundary=1.0):
     """
     Producing sample of spotty single system models generated randomly in given parameter space.
 
     :param db_name: str;
     :param number_of_samples: int;
+    :param seed: int; seed of the random streams, see `resolve_seed`
+    :param bottom_boundary: float; (0, 1) portion of the sample IDs where to start
+    :param top_boundary: float; (0, 1) portion of the sample IDs where to stop
     :return: None;
     """
     if db_name is not None:
         config.DATABASE_NAME = db_name
     phases = np.linspace(0, 1.0, num=config.N_POINTS, endpoint=False)
 
-    # generating IDs of each possible combination
-    ids = np.arange(0, number_of_samples, dtype=np.int)
-
-    dtb.create_ceb_db(config.DATABASE_NAME, config.PARAMETER_COLUMNS_SINGLE, config.PARAMETER_TYPES_SINGLE)
-    brkpoint = dtb.search_for_breakpoint(config.DATABASE_NAME, ids)
-    print(f'Breakpoint found {100.0 * brkpoint / number_of_samples:.2f}%: {brkpoint}/{number_of_samples}')
-    ids = ids[brkpoint:]
-
-    args = (phases, number_of_samples, brkpoint, )
-    multiproc.multiprocess_eval(ids, eval_single_grid_node, args)
-
-
-def eval_single_grid_node(iden, counter, phases, maxiter, start_index):
+    # generating IDs of each sample within the requested range
+    ids = sample_ids(number_of_samples, bottom_boundary, top_boundary)
+    maxiter = len(ids)
+
+    # spotted single stars do not have eclipses to concentrate the phases in
+    metadata = dtb.create_ceb_db(config.DATABASE_NAME, config.PARAMETER_COLUMNS_SINGLE, config.PARAMETER_TYPES_SINGLE,
+                                 phase_scheme='uniform')
+    config.CURVE_DTYPE = metadata['curve_dtype']
+    seed = resolve_seed(config.DATABASE_NAME, metadata, seed)
+    completion = dtb.load_completion(config.DATABASE_NAME, int(number_of_samples))
+    ids = completion.pending(ids)
+    brkpoint = maxiter - len(ids)
+    print(f'Already finished samples {100.0 * brkpoint / max(maxiter, 1):.2f}%: {brkpoint}/{maxiter}')
+
+    # only parameter sets passing analytic validity checks are sent to workers
+    samples, stats = sampling.presample('single_spotty', ids, seed)
+    print(f'Random seed: {seed}')
+    print(sampling.stats_summary('single_spotty', stats))
+
+    reporter = metrics.start_run(len(ids))
+    for reason, value in stats['rejections'].items():
+        metrics.METRICS.reject(reason, value)
+
+    args = (maxiter, brkpoint, )
+    with dtb.ObservationWriter(config.DATABASE_NAME, config.PARAMETER_COLUMNS_SINGLE, completion) as writer:
+        multiproc.multiprocess_eval(ids, eval_single_grid_node, args, callback=writer.add,
+                                    context=dict(phases=phases, samples=samples, seed=seed), reporter=reporter,
+                                    timeout=config.NODE_TIMEOUT)
+
+
+def eval_single_grid_node(iden, counter, maxiter, start_index):
     """
-    Evaluating randomly generated spotty single system model.
+    Evaluating randomly generated spotty single system model. Phases of observations, pre-sampled parameters and seed
+    are read from the worker context, parameters are redrawn from the random stream of the sample if the pre-sampled
+    ones fail.
 
     :param iden: str; node ID
     :param counter: int; current number of already calculeted nodes
-    :param phases: numpy.array; desired phases of observations
     :param maxiter: int; total number of nodes in this batch
     :param start_index: int; number of iterations already calculated before interruption
-    :return: None
+    :return: tuple; observation record for database writer
     """
-    aug_counter = counter + start_index
-    print(f'Processing node: {aug_counter}/{maxiter}, {100.0 * aug_counter / maxiter:.2f}%')
+    if config.PRINT_NODE_PROGRESS:
+        aug_counter = counter + start_index
+        print(f'Processing node: {aug_counter}/{maxiter}, {100.0 * aug_counter / maxiter:.2f}%')
+    phases, seed = multiproc.WORKER_CONTEXT['phases'], multiproc.WORKER_CONTEXT['seed']
+    row = sampling.sample_row(multiproc.WORKER_CONTEXT['samples'], iden)
     while True:
-        params = aux.draw_single_star_params()
-
+        params = sampling.sample_params('single_spotty', row)
         try:
-            s = SingleSystem.from_json(params)
+            with metrics.METRICS.timer('initialization'):
+                s = SingleSystem.from_json(params)
         except ValueError as e:
+            metrics.METRICS.reject(type(e).__name__)
+            row = sampling.next_sample('single_spotty', seed, row)
             continue
 
-        o = Observer(passband=config.PASSBANDS, system=s)
+        o = cache.get_observer(s)
 
         try:
-            o.lc(phases=phases, normalize=True)
+            with metrics.METRICS.timer('lc'):
+                o.lc(phases=phases, normalize=True)
             # o.plot.lc()
         except (LimbDarkeningError, AtmosphereError) as e:
             # print(f'Parameters: {params} produced system outside grid coverage.')
+            metrics.METRICS.reject(type(e).__name__)
+            row = sampling.next_sample('single_spotty', seed, row)
             continue
 
-        dtb.insert_observation(
-            config.DATABASE_NAME, o, iden, config.PARAMETER_COLUMNS_SINGLE, config.PARAMETER_TYPES_SINGLE
-        )
-        break
+        return dtb.observation_record(o, iden, config.PARAMETER_COLUMNS_SINGLE, config.PARAMETER_TYPES_SINGLE)
 
 
-def eval_eccentric_random_sample(iden, counter, phases, maxiter, start_index):
-    np.random.seed()
+def eval_eccentric_random_sample(iden, counter, maxiter, start_index):
+    phases, seed = multiproc.WORKER_CONTEXT['phases'], multiproc.WORKER_CONTEXT['seed']
+    row = sampling.sample_row(multiproc.WORKER_CONTEXT['samples'], iden)
     while True:
-        args = aux.draw_eccentric_system_params()
-        params = aux.assign_eccentric_system_params(*args)
-
+        params = sampling.sample_params('eccentric', row)
         try:
-            bs = BinarySystem.from_json(params)
+            with metrics.METRICS.timer('initialization'):
+                bs = BinarySystem.from_json(params)
         except MorphologyError as e:
             # print(e)
+            metrics.METRICS.reject(type(e).__name__)
+            row = sampling.next_sample('eccentric', seed, row)
             continue
 
         try:
-            setattr(bs, 'inclination', np.radians(aux.draw_inclination(binary=bs)))
-            bs.init()
+            with metrics.METRICS.timer('initialization'):
+                setattr(bs, 'inclination', np.radians(aux.draw_inclination(binary=bs, step=row['inclination_step'])))
+                bs.init()
 
-            o = Observer(passband=config.PASSBANDS, system=bs)
+            o = cache.get_observer(bs)
         except Exception as e:
             raise ValueError(e)
 
         try:
-            o.lc(phases=phases, normalize=True)
+            with metrics.METRICS.timer('lc'):
+                o.lc(phases=phases, normalize=True)
             # o.plot.lc()
         except (LimbDarkeningError, AtmosphereError) as e:
             # print(f'Parameters: {params} produced system outside grid coverage.')
+            metrics.METRICS.reject(type(e).__name__)
+            row = sampling.next_sample('eccentric', seed, row)
             continue
 
-        dtb.insert_observation(
-            config.DATABASE_NAME, o, iden, config.PARAMETER_COLUMNS_ECCENTRIC, config.PARAMETER_TYPES_ECCENTRIC
-        )
+        if config.PRINT_NODE_PROGRESS:
+            aug_counter = counter + start_index + 1
+            print(f'Node processed: {aug_counter}/{maxiter}, {100.0 * aug_counter / maxiter:.2f}%')
+        return dtb.observation_record(o, iden, config.PARAMETER_COLUMNS_ECCENTRIC, config.PARAMETER_TYPES_ECCENTRIC)
 
-        aug_counter = counter + start_index + 1
-        print(f'Node processed: {aug_counter}/{maxiter}, {100.0 * aug_counter / maxiter:.2f}%')
-        break
 
-
-def eccentric_system_random_sampling(db_name=None, number_of_samples=1e4):
+def eccentric_system_random_sampling(db_name=None, number_of_samples=1e4, seed=None, bottom_boundary=0.0,
+                                     top_boundary=1.0):
     if db_name is not None:
         config.DATABASE_NAME = db_name
     phases = np.linspace(0, 1.0, num=config.N_POINTS, endpoint=False)
 
-    # generating IDs of each possible combination
-    ids = np.arange(0, number_of_samples, dtype=np.int)
-
-    dtb.create_ceb_db(config.DATABASE_NAME, config.PARAMETER_COLUMNS_ECCENTRIC, config.PARAMETER_TYPES_ECCENTRIC)
-    brkpoint = dtb.search_for_breakpoint(config.DATABASE_NAME, ids)
-    print(f'Breakpoint found {100.0 * brkpoint / number_of_samples:.2f}%: {brkpoint}/{number_of_samples}')
-    ids = ids[brkpoint:]
-
-    args = (phases, number_of_samples, brkpoint,)
-    multiproc.multiprocess_eval(ids, eval_eccentric_random_sample, args)
-
-
-def random_sampling(db_name=None, desired_morphology='all', number_of_samples=1e4):
+    # generating IDs of each sample within the requested range
+    ids = sample_ids(number_of_samples, bottom_boundary, top_boundary)
+    maxiter = len(ids)
+
+    # eclipse phases of eccentric orbits are not fixed, phase schemes apply only to the circular grid
+    metadata = dtb.create_ceb_db(
+        config.DATABASE_NAME, config.PARAMETER_COLUMNS_ECCENTRIC, config.PARAMETER_TYPES_ECCENTRIC,
+        phase_scheme='uniform'
+    )
+    config.CURVE_DTYPE = metadata['curve_dtype']
+    seed = resolve_seed(config.DATABASE_NAME, metadata, seed)
+    completion = dtb.load_completion(config.DATABASE_NAME, int(number_of_samples))
+    ids = completion.pending(ids)
+    brkpoint = maxiter - len(ids)
+    print(f'Already finished samples {100.0 * brkpoint / max(maxiter, 1):.2f}%: {brkpoint}/{maxiter}')
+
+    # only parameter sets passing analytic validity checks are sent to workers
+    samples, stats = sampling.presample('eccentric', ids, seed)
+    print(f'Random seed: {seed}')
+    print(sampling.stats_summary('eccentric', stats))
+
+    reporter = metrics.start_run(len(ids))
+    for reason, value in stats['rejections'].items():
+        metrics.METRICS.reject(reason, value)
+
+    args = (maxiter, brkpoint, )
+    with dtb.ObservationWriter(config.DATABASE_NAME, config.PARAMETER_COLUMNS_ECCENTRIC, completion) as writer:
+        multiproc.multiprocess_eval(ids, eval_eccentric_random_sample, args, callback=writer.add,
+                                    context=dict(phases=phases, samples=samples, seed=seed), reporter=reporter,
+                                    timeout=config.NODE_TIMEOUT)
+
+
+def random_sampling(db_name=None, desired_morphology='all', number_of_samples=1e4, seed=None, bottom_boundary=0.0,
+                    top_boundary=1.0):
     """
+    Random sampling of the parameter space. Parameters of each sample are derived from (`seed`, sample ID), therefore
+    the sample can be split to multiple machines by the boundaries (using the same seed) without overlaps.
 
     :param db_name: str; path to the database
     :param desired_morphology: string; `all`, `detached` - detached binaries on circular orbit, `overcontact`,
                                        `single_spotty`, `eccentric`
     :param number_of_samples: int; number of samples for random sampling
+    :param seed: int; seed of the random sampling, `config.RANDOM_SEED` or seed stored in the database by default
+    :param bottom_boundary: float; (0, 1) portion of the sample IDs where to start
+    :param top_boundary: float; (0, 1) portion of the sample IDs where to stop
     :return:
     """
+    kwargs = dict(number_of_samples=number_of_samples, seed=seed, bottom_boundary=bottom_boundary,
+                  top_boundary=top_boundary)
     if desired_morphology in ['detached', 'overcontact', 'circular']:
         raise NotImplementedError('Random sampling on circular binaries is not yet implemented. '
                                   'Try grid sampling method.')
     elif desired_morphology in ['single_spotty']:
-        spotty_single_system_random_sampling(db_name, number_of_samples=number_of_samples)
+        spotty_single_system_random_sampling(db_name, **kwargs)
     elif desired_morphology in ['eccentric']:
-        eccentric_system_random_sampling(db_name, number_of_samples=number_of_samples)
+        eccentric_system_random_sampling(db_name, **kwargs)
     else:
         raise ValueError(f'Unknown morphology: {desired_morphology}. '
                          f'List of available morphologies: `all`, `detached` - detached binaries on circular orbit, '
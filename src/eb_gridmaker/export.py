@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+
+import numpy as np
+
+from eb_gridmaker import dtb, config
+from eb_gridmaker.utils.sqlite_data_adapters import decode_curves
+
+
+def export_atlas(db_name, output_dir, passbands=None, batch_size=None):
+    """
+    Exports the database into memory-mappable `.npy` files suitable for fast random access during ML training:
+
+        - `fluxes.npy`: (N, n_passbands, n_points) array of light curves in the storage dtype of the database,
+        - `parameters.npy`: structured array of model parameters aligned with `fluxes.npy`,
+        - `ids.npy`: model IDs aligned with `fluxes.npy`,
+        - `phases.npy`: (N, n_points) array of phases of the light curves aligned with `fluxes.npy`, only for
+          databases with non-uniform phase scheme,
+        - `metadata.json`: passbands, number of points, phase scheme and dtype of the light curves.
+
+    Models are processed in batches of `batch_size` rows, therefore the memory footprint does not depend on the size of
+    the database. Exported files can be opened with `load_export`.
+
+    :param db_name: str; path to the database
+    :param output_dir: str; directory where the export will be stored
+    :param passbands: list; names of the passband columns to export (eg. `Bessell_V`), all by default
+    :param batch_size: int; number of models read from the database at once
+    :return: dict; metadata of the export
+    """
+    batch_size = config.READ_BATCH_SIZE if batch_size is None else batch_size
+    os.makedirs(output_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+
+    metadata = dtb.get_metadata(cursor)
+    curve_dtype = metadata.get('curve_dtype', 'npy')
+    n_points = int(metadata.get('n_points', config.N_POINTS))
+
+    curve_columns = dtb.table_columns(cursor, 'curves')[0][1:]
+    with_phases = dtb.PHASES_COLUMN in curve_columns
+    curve_columns = tuple(column for column in curve_columns if column != dtb.PHASES_COLUMN)
+    passbands = curve_columns if passbands is None else tuple(passbands)
+    invalid_passbands = [passband for passband in passbands if passband not in curve_columns]
+    if len(invalid_passbands) > 0:
+        raise ValueError(f'Invalid passbands: {invalid_passbands}.')
+
+    param_columns, param_types = dtb.table_columns(cursor, 'parameters')
+    n_models = cursor.execute("SELECT COUNT(*) FROM parameters JOIN curves ON parameters.id = curves.id").fetchone()[0]
+
+    flux_dtype = np.float64 if curve_dtype == 'npy' else np.dtype(curve_dtype)
+    fluxes = np.lib.format.open_memmap(os.path.join(output_dir, 'fluxes.npy'), mode='w+', dtype=flux_dtype,
+                                       shape=(n_models, len(passbands), n_points))
+    params = np.lib.format.open_memmap(os.path.join(output_dir, 'parameters.npy'), mode='w+',
+                                       dtype=dtb.parameter_dtype(param_columns, param_types), shape=(n_models, ))
+    ids = np.lib.format.open_memmap(os.path.join(output_dir, 'ids.npy'), mode='w+', dtype=np.int64,
+                                    shape=(n_models, ))
+    arrays = [fluxes, params, ids]
+    if with_phases:
+        phases = np.lib.format.open_memmap(os.path.join(output_dir, 'phases.npy'), mode='w+',
+                                           dtype=dtb.PHASES_DTYPE, shape=(n_models, n_points))
+        arrays.append(phases)
+
+    p_str = ', '.join(f'parameters.{col}' for col in param_columns)
+    c_str = ', '.join(f'curves.{passband}' for passband in passbands + ((dtb.PHASES_COLUMN, ) if with_phases else ()))
+    cursor.execute(f"SELECT {p_str}, {c_str} FROM parameters JOIN curves ON parameters.id = curves.id "
+                   f"ORDER BY parameters.id")
+
+    n_params, start = len(param_columns), 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+
+        stop = start + len(rows)
+        params[start: stop] = [row[:n_params] for row in rows]
+        ids[start: stop] = params['id'][start: stop]
+        blobs = [blob for row in rows for blob in row[n_params: n_params + len(passbands)]]
+        fluxes[start: stop] = decode_curves(blobs, curve_dtype, n_points).reshape(len(rows), len(passbands), n_points)
+        if with_phases:
+            phases[start: stop] = decode_curves([row[-1] for row in rows], dtb.PHASES_DTYPE, n_points)
+        start = stop
+        print(f'Exported models: {stop}/{n_models}')
+
+    conn.close()
+    for arr in arrays:
+        arr.flush()
+
+    export_metadata = {
+        'passbands': list(passbands),
+        'n_points': n_points,
+        'phase_scheme': metadata.get('phase_scheme', 'uniform'),
+        'curve_dtype': np.dtype(flux_dtype).name,
+        'n_models': n_models,
+        'parameters': list(param_columns),
+    }
+    with open(os.path.join(output_dir, 'metadata.json'), 'w') as fl:
+        json.dump(export_metadata, fl, indent=4)
+
+    return export_metadata
+
+
+def load_export(output_dir, mmap_mode='r'):
+    """
+    Opens atlas exported by `export_atlas` as memory-mapped arrays.
+
+    :param output_dir: str; directory containing the export
+    :param mmap_mode: str; mode of `numpy.load` memory mapping
+    :return: dict; {'fluxes': numpy.memmap, 'parameters': numpy.memmap, 'ids': numpy.memmap, 'metadata': dict},
+                   `phases`: numpy.memmap is included for non-uniform phase schemes
+    """
+    with open(os.path.join(output_dir, 'metadata.json'), 'r') as fl:
+        metadata = json.load(fl)
+
+    names = ('fluxes', 'parameters', 'ids', 'phases') if metadata.get('phase_scheme', 'uniform') != 'uniform' \
+        else ('fluxes', 'parameters', 'ids')
+    result = {name: np.load(os.path.join(output_dir, f'{name}.npy'), mmap_mode=mmap_mode) for name in names}
+    result['metadata'] = metadata
+    return result
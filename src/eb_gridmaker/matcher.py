@@ -0,0 +1,330 @@
+import os
+import json
+
+import numpy as np
+
+from eb_gridmaker import config
+from eb_gridmaker.export import load_export
+from eb_gridmaker.utils import phase_schemes
+
+# files of the pre-filter stored within the export directory
+PREFILTER_BASIS = 'prefilter_basis.npy'
+PREFILTER_PROJECTIONS = 'prefilter.npy'
+PREFILTER_NORMS = 'norms.npy'
+PREFILTER_METADATA = 'prefilter.json'
+
+
+def check_uniform(metadata):
+    """
+    Matcher compares the curves point by point, therefore the atlas has to be sampled on the common phases.
+
+    :param metadata: dict; metadata of the export
+    :return: None
+    """
+    if metadata.get('phase_scheme', 'uniform') != 'uniform':
+        raise ValueError(f'Matcher requires atlas with uniform phase scheme, the export uses '
+                         f'`{metadata["phase_scheme"]}` scheme.')
+
+
+def batch_bounds(n_models, batch_size):
+    """
+    Yields (start, stop) bounds of the consecutive batches of the exported models.
+
+    :param n_models: int;
+    :param batch_size: int;
+    """
+    for start in range(0, n_models, batch_size):
+        yield start, min(start + batch_size, n_models)
+
+
+def build_prefilter(export_dir, n_components=None, sample_size=None, batch_size=None):
+    """
+    Builds compressed pre-filter of the exported atlas used by `Matcher`. Light curves of each passband are projected
+    onto the first `n_components` principal components of a random sample of the curves. The mean curve is not
+    subtracted, therefore scalar products of the projections approximate the scalar products of the curves needed for
+    the optimal flux scaling. Following files are stored in the export directory:
+
+        - `prefilter_basis.npy`: (n_passbands, n_points, n_components) orthonormal bases,
+        - `prefilter.npy`: (n_passbands, N, n_components) projections of the light curves,
+        - `norms.npy`: (n_passbands, N) squared norms of the light curves,
+        - `prefilter.json`: number of components and fractions of the energy of the sampled curves captured by them.
+
+    :param export_dir: str; directory of the atlas exported by `export.export_atlas`
+    :param n_components: int; number of components, `config.PREFILTER_COMPONENTS` by default
+    :param sample_size: int; number of curves used to determine the components, `config.PREFILTER_SAMPLE_SIZE` by
+                             default
+    :param batch_size: int; number of models projected at once, `config.MATCHER_BATCH_SIZE` by default
+    :return: dict; metadata of the pre-filter
+    """
+    n_components = config.PREFILTER_COMPONENTS if n_components is None else n_components
+    sample_size = config.PREFILTER_SAMPLE_SIZE if sample_size is None else sample_size
+    batch_size = config.MATCHER_BATCH_SIZE if batch_size is None else batch_size
+
+    atlas = load_export(export_dir)
+    check_uniform(atlas['metadata'])
+    fluxes = atlas['fluxes']
+    n_models, n_passbands, n_points = fluxes.shape
+    n_components = min(n_components, n_points)
+
+    # fixed seed makes the pre-filter reproducible, sorted sample is read sequentially from the memory-mapped file
+    rng = np.random.default_rng(42)
+    sample = np.sort(rng.choice(n_models, min(sample_size, n_models), replace=False))
+    sample = np.asarray(fluxes[sample], dtype=np.float64)
+
+    basis = np.empty((n_passbands, n_points, n_components), dtype=np.float32)
+    captured_energy = []
+    for ii in range(n_passbands):
+        _, singular_values, vt = np.linalg.svd(sample[:, ii, :], full_matrices=False)
+        basis[ii] = vt[:n_components].T
+        energy = singular_values ** 2
+        captured_energy.append(float(np.sum(energy[:n_components]) / np.sum(energy)))
+    del sample
+
+    # projections of each passband are contiguous, so the matcher reads only the selected passbands
+    projections = np.lib.format.open_memmap(os.path.join(export_dir, PREFILTER_PROJECTIONS), mode='w+',
+                                            dtype=np.float32, shape=(n_passbands, n_models, n_components))
+    norms = np.lib.format.open_memmap(os.path.join(export_dir, PREFILTER_NORMS), mode='w+', dtype=np.float32,
+                                      shape=(n_passbands, n_models))
+    for start, stop in batch_bounds(n_models, batch_size):
+        curves = np.asarray(fluxes[start: stop], dtype=np.float32)
+        for ii in range(n_passbands):
+            projections[ii, start: stop] = curves[:, ii, :] @ basis[ii]
+        norms[:, start: stop] = np.einsum('npt,npt->pn', curves, curves)
+        print(f'Projected models: {stop}/{n_models}')
+
+    projections.flush()
+    norms.flush()
+    np.save(os.path.join(export_dir, PREFILTER_BASIS), basis)
+
+    prefilter_metadata = {
+        'passbands': atlas['metadata']['passbands'],
+        'n_components': n_components,
+        'n_models': n_models,
+        'sample_size': min(sample_size, n_models),
+        'captured_energy': captured_energy,
+    }
+    with open(os.path.join(export_dir, PREFILTER_METADATA), 'w') as fl:
+        json.dump(prefilter_metadata, fl, indent=4)
+
+    print('Captured energy of the light curves: ' +
+          ', '.join(f'{passband}: {energy:.8f}'
+                    for passband, energy in zip(prefilter_metadata['passbands'], captured_energy)))
+    return prefilter_metadata
+
+
+def scaled_residuals(dots, norms, obs_norms):
+    """
+    Returns sums of squared residuals of the observations and the models scaled by the optimal (least squares,
+    non-negative) flux factors in each passband.
+
+    :param dots: numpy.array; (n_passbands, n_observations, n_models) scalar products of the observations and models
+    :param norms: numpy.array; (n_passbands, n_models) squared norms of the models
+    :param obs_norms: numpy.array; (n_passbands, n_observations) squared norms of the observations
+    :return: tuple; (numpy.array, numpy.array) residuals (n_observations, n_models) and scaling factors
+                    (n_passbands, n_observations, n_models)
+    """
+    dots = np.maximum(dots, 0.0)
+    scales = dots / np.maximum(norms, np.finfo(np.float32).tiny)[:, None, :]
+    residuals = np.sum(obs_norms[:, :, None] - dots * scales, axis=0)
+    return np.maximum(residuals, 0.0), scales
+
+
+def keep_best(best, residuals, start, n_best):
+    """
+    Updates running selection of the models with the lowest residuals for each observation. Once the selection is
+    full, only the models better than the worst selected model of any observation are merged into it.
+
+    :param best: tuple; (numpy.array, numpy.array) residuals and positions (n_observations, n_selected) of the
+                        selected models
+    :param residuals: numpy.array; (n_observations, n_models) residuals of the batch
+    :param start: int; position of the first model of the batch
+    :param n_best: int; number of models kept for each observation
+    :return: tuple; updated `best`
+    """
+    positions = np.arange(start, start + residuals.shape[1])
+    if best[0].shape[1] >= n_best:
+        columns = np.flatnonzero(np.any(residuals < best[0].max(axis=1, keepdims=True), axis=0))
+        residuals, positions = residuals[:, columns], positions[columns]
+
+    positions = np.concatenate((best[1], np.broadcast_to(positions, residuals.shape)), axis=1)
+    residuals = np.concatenate((best[0], residuals), axis=1)
+    if residuals.shape[1] > n_best:
+        selection = np.argpartition(residuals, n_best - 1, axis=1)[:, :n_best]
+        residuals = np.take_along_axis(residuals, selection, axis=1)
+        positions = np.take_along_axis(positions, selection, axis=1)
+    return residuals, positions
+
+
+class Matcher(object):
+    """
+    Nearest-neighbour search of the observed light curves in the atlas exported by `export.export_atlas`. Distance
+    of the model is the sum of squared residuals of the observation and the model light curve multiplied by its
+    optimal flux factor, summed over the selected passbands. Flux factors are determined independently in each
+    passband, therefore the observations do not have to be normalized.
+
+    The atlas is scanned in batches of `config.MATCHER_BATCH_SIZE` models and the distances to all observations
+    are evaluated by matrix products. If the pre-filter built by `build_prefilter` is available, approximate distances
+    are evaluated on the compressed projections first and only the best candidates are compared with the observations
+    in full resolution::
+
+        matcher = Matcher('atlas', passbands=['Bessell_V', 'Bessell_B'])
+        result = matcher.match({'Bessell_V': flux_v, 'Bessell_B': flux_b}, k=10)
+    """
+    def __init__(self, export_dir, passbands=None, prefilter=True):
+        """
+        :param export_dir: str; directory of the atlas exported by `export.export_atlas`
+        :param passbands: list; passbands compared with the observations, all exported passbands by default
+        :param prefilter: bool; if False, pre-filter is not used even if it was built
+        """
+        self.atlas = load_export(export_dir)
+        metadata = self.atlas['metadata']
+        check_uniform(metadata)
+
+        self.passbands = tuple(metadata['passbands']) if passbands is None else tuple(passbands)
+        invalid_passbands = [passband for passband in self.passbands if passband not in metadata['passbands']]
+        if len(invalid_passbands) > 0:
+            raise ValueError(f'Invalid passbands: {invalid_passbands}.')
+        self.passband_indices = [metadata['passbands'].index(passband) for passband in self.passbands]
+        self.n_models = self.atlas['fluxes'].shape[0]
+        self.phases = phase_schemes.uniform_phases(metadata['n_points'])
+
+        self.norms, self.basis, self.projections = None, None, None
+        norms_path = os.path.join(export_dir, PREFILTER_NORMS)
+        if os.path.isfile(norms_path):
+            self.norms = np.load(norms_path, mmap_mode='r')
+            if self.norms.shape[1] != self.n_models:
+                raise ValueError(f'Pre-filter of {export_dir} does not correspond to the export, rebuild it with '
+                                 f'`build_prefilter`.')
+        if prefilter and self.norms is not None:
+            self.basis = np.load(os.path.join(export_dir, PREFILTER_BASIS))[self.passband_indices]
+            self.projections = np.load(os.path.join(export_dir, PREFILTER_PROJECTIONS), mmap_mode='r')
+
+    def observation_matrix(self, observations, phases=None):
+        """
+        Arranges the observed light curves into the array compatible with the atlas. Observations sampled in other
+        phases are linearly interpolated (periodically) onto the phases of the atlas.
+
+        :param observations: dict; {passband: numpy.array} flux of a single observation (n_points, ) or multiple
+                                   observations (n_observations, n_points) in each passband
+        :param phases: Union[None, numpy.array, dict]; phases of the observations, common or for each passband,
+                                                       phases of the atlas are assumed if None
+        :return: numpy.array; (n_observations, n_passbands, n_points)
+        """
+        missing = [passband for passband in self.passbands if passband not in observations]
+        if len(missing) > 0:
+            raise ValueError(f'Observations in passbands {missing} are missing.')
+
+        curves = []
+        for passband in self.passbands:
+            flux = np.atleast_2d(np.asarray(observations[passband], dtype=np.float64))
+            if phases is not None:
+                obs_phases = np.asarray(phases[passband] if isinstance(phases, dict) else phases, dtype=np.float64)
+                flux = np.array([np.interp(self.phases, obs_phases, row, period=1.0) for row in flux])
+            elif flux.shape[1] != self.phases.size:
+                raise ValueError(f'Observations in passband {passband} have {flux.shape[1]} points instead of '
+                                 f'{self.phases.size}, provide their phases.')
+            curves.append(flux)
+
+        if len(set(flux.shape[0] for flux in curves)) > 1:
+            raise ValueError('Numbers of observations differ among the passbands.')
+        return np.stack(curves, axis=1)
+
+    def exact_residuals(self, start, stop, observations, obs_norms, positions=None):
+        """
+        Compares the observations with the models in full resolution, in precision of the observations.
+
+        :param start: int; position of the first model of the batch
+        :param stop: int; position after the last model of the batch
+        :param observations: numpy.array; (n_observations, n_passbands, n_points)
+        :param obs_norms: numpy.array; (n_passbands, n_observations) squared norms of the observations
+        :param positions: numpy.array; sorted positions of the compared models, overrides the batch bounds
+        :return: tuple; see `scaled_residuals`
+        """
+        fluxes = self.atlas['fluxes'][start: stop] if positions is None else self.atlas['fluxes'][positions]
+        curves = np.asarray(fluxes[:, self.passband_indices], dtype=observations.dtype)
+        dots = np.stack([observations[:, jj] @ curves[:, jj].T for jj in range(len(self.passbands))])
+        norms = np.einsum('npt,npt->pn', curves, curves)
+        return scaled_residuals(dots, norms, obs_norms)
+
+    def prefilter_residuals(self, start, stop, coefficients, obs_norms):
+        """
+        Approximate residuals of the batch of models evaluated on the pre-filter projections.
+
+        :param start: int; position of the first model of the batch
+        :param stop: int; position after the last model of the batch
+        :param coefficients: numpy.array; (n_passbands, n_observations, n_components) projections of the observations
+        :param obs_norms: numpy.array; (n_passbands, n_observations) squared norms of the observations
+        :return: numpy.array; (n_observations, n_models)
+        """
+        residuals = np.zeros((coefficients.shape[1], stop - start), dtype=np.float32)
+        for jj, ii in enumerate(self.passband_indices):
+            dots = np.maximum(coefficients[jj] @ self.projections[ii, start: stop].T, 0.0)
+            norms = np.maximum(self.norms[ii, start: stop], np.finfo(np.float32).tiny)
+            residuals += obs_norms[jj][:, None] - dots ** 2 / norms
+        return residuals
+
+    def match(self, observations, k=10, phases=None, n_candidates=None, batch_size=None):
+        """
+        Finds `k` models closest to each observation. Observations should be matched in batches (2D arrays) where
+        possible, since the atlas is scanned once for all of them.
+
+        :param observations: dict; {passband: numpy.array} flux of a single observation (n_points, ) or multiple
+                                   observations (n_observations, n_points) in each selected passband
+        :param k: int; number of returned models
+        :param phases: Union[None, numpy.array, dict]; phases of the observations (see `observation_matrix`)
+        :param n_candidates: int; number of the best models of each observation found by the scan in single precision
+                                  (on the pre-filter projections if available), which are compared with the observation
+                                  in full resolution and double precision, max(`config.PREFILTER_CANDIDATES`, 10 * k)
+                                  by default
+        :param batch_size: int; number of models compared at once, `config.MATCHER_BATCH_SIZE` by default
+        :return: dict; {'id': (n_observations, k) model IDs,
+                        'distance': (n_observations, k) sums of squared residuals,
+                        'scale': (n_observations, k, n_passbands) flux factors of the models,
+                        'parameters': (n_observations, k) structured array of model parameters,
+                        'passbands': tuple}, ordered from the closest model, the leading axis is omitted if a single
+                       observation was given as 1D arrays
+        """
+        batch_size = config.MATCHER_BATCH_SIZE if batch_size is None else batch_size
+        n_candidates = max(config.PREFILTER_CANDIDATES, 10 * k) if n_candidates is None else n_candidates
+        single = all(np.ndim(observations[passband]) == 1 for passband in self.passbands)
+
+        observations = self.observation_matrix(observations, phases)
+        obs_norms = np.einsum('opt,opt->po', observations, observations)
+        n_obs, k = observations.shape[0], min(k, self.n_models)
+        n_candidates = min(max(n_candidates, k), self.n_models)
+
+        # residuals in single precision are affected by cancellation, they only select the candidates
+        scan_observations, scan_norms = observations.astype(np.float32), obs_norms.astype(np.float32)
+        best = (np.empty((n_obs, 0), dtype=np.float32), np.empty((n_obs, 0), dtype=np.int64))
+        if self.projections is not None:
+            coefficients = np.einsum('opt,ptc->poc', scan_observations, self.basis)
+            for start, stop in batch_bounds(self.n_models, batch_size):
+                best = keep_best(best, self.prefilter_residuals(start, stop, coefficients, scan_norms), start,
+                                 n_candidates)
+        else:
+            for start, stop in batch_bounds(self.n_models, batch_size):
+                best = keep_best(best, self.exact_residuals(start, stop, scan_observations, scan_norms)[0], start,
+                                 n_candidates)
+
+        # selected candidates are compared with the observations in full resolution and double precision
+        positions, distances, scales = [], [], []
+        for ii in range(n_obs):
+            candidates = np.sort(best[1][ii])
+            residuals, scale = self.exact_residuals(None, None, observations[ii: ii + 1], obs_norms[:, ii: ii + 1],
+                                                    positions=candidates)
+            selection = np.argsort(residuals[0], kind='stable')[:k]
+            positions.append(candidates[selection])
+            distances.append(residuals[0, selection])
+            scales.append(scale[:, 0, selection].T)
+        positions = np.array(positions)
+
+        result = {
+            'id': np.asarray(self.atlas['ids'][positions.ravel()]).reshape(positions.shape),
+            'distance': np.array(distances),
+            'scale': np.array(scales),
+            'parameters': np.asarray(self.atlas['parameters'][positions.ravel()]).reshape(positions.shape),
+        }
+        if single:
+            result = {key: value[0] for key, value in result.items()}
+        result['passbands'] = self.passbands
+        return result
@@ -0,0 +1,260 @@
+import json
+import sqlite3
+
+import numpy as np
+from scipy import optimize
+
+from eb_gridmaker import dtb, config
+from eb_gridmaker.eb_grid_generator import valid_node_mask, shuffled_range
+from eb_gridmaker.utils import aux, precalc
+
+# features of the per-node cost model, see `config.COST_MODEL`
+COST_FEATURES = ('constant', 'overcontact', 'radii_area')
+
+
+def cube_features(overcontact_mask):
+    """
+    Returns features of the cost model for each (q, r1, r2, t1, t2) node of the grid, nodes with different
+    inclinations share the features.
+
+    :param overcontact_mask: numpy.array; flattened overcontact mask of the (q, r1, r2, t1, t2) cube
+                                          (see `eb_grid_generator.valid_node_mask`)
+    :return: numpy.array; (n_cube_nodes, len(COST_FEATURES))
+    """
+    shape = aux.grid_shape()[:-1]
+    r1 = config.R_ARRAY[None, :, None, None, None]
+    r2 = config.R_ARRAY[None, None, :, None, None]
+
+    features = np.empty((int(np.prod(shape)), len(COST_FEATURES)))
+    features[:, 0] = 1.0
+    features[:, 1] = overcontact_mask.ravel()
+    features[:, 2] = np.broadcast_to(r1 ** 2 + r2 ** 2, shape).ravel()
+    return features
+
+
+def cube_costs(valid_mask, overcontact_mask, cost_model=None):
+    """
+    Returns predicted evaluation time of a single node (with any inclination) for each (q, r1, r2, t1, t2) node of the
+    grid. Nodes rejected before the dispatch cost nothing.
+
+    :param valid_mask: numpy.array; flattened validity mask of the (q, r1, r2, t1, t2) cube
+    :param overcontact_mask: numpy.array; flattened overcontact mask of the (q, r1, r2, t1, t2) cube
+    :param cost_model: dict; {feature: coefficient in core-seconds}, `config.COST_MODEL` by default
+    :return: numpy.array; costs in core-seconds
+    """
+    cost_model = config.COST_MODEL if cost_model is None else cost_model
+    coefficients = np.array([cost_model.get(feature, 0.0) for feature in COST_FEATURES])
+    return cube_features(overcontact_mask) @ coefficients * valid_mask.ravel()
+
+
+def binary_grid_masks(desired_morphology='all'):
+    """
+    Returns validity and overcontact masks of the (q, r1, r2, t1, t2) cube of the current grid.
+
+    :param desired_morphology: str; `all`, `detached`, `overcontact`
+    :return: tuple; (numpy.array, numpy.array) flattened masks
+    """
+    grid = precalc.precalc_binary_grid()
+    valid_mask, overcontact_mask, _ = \
+        valid_node_mask(grid['crit_potentials'], grid['omega1_grid'], grid['omega2_grid'], desired_morphology)
+    return valid_mask.ravel(), overcontact_mask.ravel()
+
+
+def calibrate_cost_model(db_names):
+    """
+    Fits coefficients of the cost model to the evaluation times of the nodes stored in `timings` table of the
+    databases calculated on the current grid. Coefficients are constrained to be non-negative. Timings of nodes
+    evaluated in blocks include the shared surface builds, therefore the model should be calibrated on the runs
+    using the same evaluation mode as the planned one.
+
+    :param db_names: Union[str, list]; paths to the databases
+    :return: dict; {feature: coefficient in core-seconds} suitable for `config.COST_MODEL`
+    """
+    db_names = [db_names] if isinstance(db_names, str) else db_names
+    maxid = int(np.prod(aux.grid_shape()))
+
+    ids, seconds = [], []
+    for db_name in db_names:
+        conn = sqlite3.connect(db_name)
+        cursor = conn.cursor()
+        if not dtb.table_exists(cursor, 'timings'):
+            conn.close()
+            raise ValueError(f'Database {db_name} does not contain evaluation times of the nodes.')
+        rows = np.array(cursor.execute("SELECT id, seconds FROM timings").fetchall(), dtype=np.float64)
+        conn.close()
+        if rows.size > 0:
+            ids.append(rows[:, 0].astype(np.int64))
+            seconds.append(rows[:, 1])
+
+    if len(ids) == 0:
+        raise ValueError('No timings were found in given databases.')
+    ids, seconds = np.concatenate(ids), np.concatenate(seconds)
+    if ids.max() >= maxid:
+        raise ValueError('Timings contain nodes outside of the current grid, the cost model has to be calibrated with '
+                         'the same grid axes as used for the calculation.')
+
+    _, overcontact_mask = binary_grid_masks()
+    features = cube_features(overcontact_mask)[ids // config.I_ARRAY.size]
+    coefficients, _ = optimize.nnls(features, seconds)
+    rms = np.sqrt(np.mean((features @ coefficients - seconds) ** 2))
+
+    cost_model = dict(zip(COST_FEATURES, coefficients.tolist()))
+    print(f'Cost model calibrated on {ids.size} nodes (RMS residual {rms:.3f} s): ' +
+          ', '.join(f'{feature}: {value:.4f}' for feature, value in cost_model.items()))
+    return cost_model
+
+
+def dispatch_costs(valid_mask, overcontact_mask, block_evaluation, cost_model=None):
+    """
+    Returns predicted costs and numbers of valid nodes of the units split by batch boundaries (nodes or blocks) in the
+    order used by `eb_grid_generator.evaluate_binary_on_grid`.
+
+    :param valid_mask: numpy.array; flattened validity mask of the (q, r1, r2, t1, t2) cube
+    :param overcontact_mask: numpy.array; flattened overcontact mask of the (q, r1, r2, t1, t2) cube
+    :param block_evaluation: bool;
+    :param cost_model: dict; see `cube_costs`
+    :return: tuple; (numpy.array, numpy.array) costs in core-seconds and numbers of valid nodes of the units
+    """
+    n_incl = config.I_ARRAY.size
+    costs = cube_costs(valid_mask, overcontact_mask, cost_model)
+    if block_evaluation:
+        block_size = config.T_ARRAY.size ** 2
+        order = shuffled_range(costs.size // block_size)
+        return n_incl * costs.reshape(-1, block_size).sum(axis=1)[order], \
+            n_incl * valid_mask.reshape(-1, block_size).sum(axis=1)[order]
+
+    order = shuffled_range(costs.size * n_incl)
+    order //= n_incl
+    return costs[order], valid_mask[order].astype(np.int64)
+
+
+def split_units(costs, weights):
+    """
+    Splits sequence of units into contiguous shards with costs proportional to given weights.
+
+    :param costs: numpy.array; costs of the units
+    :param weights: numpy.array; relative capacity of each shard
+    :return: numpy.array; positions of the shard boundaries within the sequence, including 0 and `costs.size`
+    """
+    cumulative = np.cumsum(costs)
+    targets = cumulative[-1] * np.cumsum(weights)[:-1] / np.sum(weights)
+    cuts = np.clip(np.searchsorted(cumulative, targets) + 1, 0, costs.size)
+    return np.concatenate(([0], np.maximum.accumulate(cuts), [costs.size]))
+
+
+def boundary_fraction(position, n_units):
+    """
+    Converts position within the sequence of units into the batch boundary selecting exactly this position in
+    `eb_grid_generator.evaluate_binary_on_grid`.
+
+    :param position: int;
+    :param n_units: int;
+    :return: float;
+    """
+    if position <= 0:
+        return 0.0
+    if position >= n_units:
+        return 1.0
+    return (position + 0.5) / n_units
+
+
+def plan_shards(n_machines, cores=None, desired_morphology='all', block_evaluation=None, cost_model=None, path=None):
+    """
+    Plans the split of the grid calculation among machines. Each valid node is assigned a predicted evaluation time
+    by the cost model and the sequence of nodes (or blocks) in the order of evaluation is split into shards with
+    predicted costs proportional to the number of cores of each machine. Shards are defined by the batch boundaries
+    accepted by `evaluate_grid` (see `shard_kwargs`)::
+
+        plan = plan_shards(4, cores=32, path='plan.json')
+        evaluate_grid('grid_part2.db', **shard_kwargs(plan, 1))
+
+    :param n_machines: int; number of machines
+    :param cores: Union[int, list]; number of cores of each machine, `config.NUMBER_OF_PROCESSES` by default
+    :param desired_morphology: str; `all`, `detached`, `overcontact`
+    :param block_evaluation: bool; evaluation mode, `config.BLOCK_EVALUATION` by default
+    :param cost_model: dict; {feature: coefficient in core-seconds}, `config.COST_MODEL` by default (see
+                             `calibrate_cost_model`)
+    :param path: str; if provided, the plan is stored in this JSON file
+    :return: dict; plan containing list of `shards` with predicted wall times (seconds) and database sizes (bytes)
+    """
+    block_evaluation = config.BLOCK_EVALUATION if block_evaluation is None else block_evaluation
+    cost_model = config.COST_MODEL if cost_model is None else cost_model
+    cores = config.NUMBER_OF_PROCESSES if cores is None else cores
+    cores = np.full(n_machines, cores, dtype=np.int64) if np.isscalar(cores) else np.asarray(cores, dtype=np.int64)
+    if cores.size != n_machines:
+        raise ValueError(f'Number of cores has to be specified for each of the {n_machines} machines.')
+
+    valid_mask, overcontact_mask = binary_grid_masks(desired_morphology)
+    costs, n_valid = dispatch_costs(valid_mask, overcontact_mask, block_evaluation, cost_model)
+    record_size = aux.record_size()
+
+    def describe(positions):
+        shards = []
+        for machine, (start, stop) in enumerate(zip(positions[:-1], positions[1:])):
+            cost = float(np.sum(costs[start: stop]))
+            # the largest task can not be split among the cores
+            largest_task = float(np.max(costs[start: stop])) if stop > start else 0.0
+            nodes = int(np.sum(n_valid[start: stop]))
+            shards.append(dict(
+                machine=machine,
+                cores=int(cores[machine]),
+                bottom_boundary=boundary_fraction(start, costs.size),
+                top_boundary=boundary_fraction(stop, costs.size),
+                valid_nodes=nodes,
+                predicted_cost=cost,
+                predicted_wall_time=max(cost / cores[machine], largest_task),
+                predicted_size=nodes * record_size,
+            ))
+        return shards
+
+    shards = describe(split_units(costs, cores))
+    equal_split = describe(np.round(np.linspace(0, costs.size, n_machines + 1)).astype(np.int64))
+
+    plan = dict(
+        desired_morphology=desired_morphology,
+        block_evaluation=bool(block_evaluation),
+        cost_model=dict(cost_model),
+        grid_shape=aux.grid_shape(),
+        valid_nodes=int(np.sum(n_valid)),
+        predicted_cost=float(np.sum(costs)),
+        predicted_wall_time=max(shard['predicted_wall_time'] for shard in shards),
+        predicted_size=float(np.sum(n_valid)) * record_size,
+        equal_split_wall_time=max(shard['predicted_wall_time'] for shard in equal_split),
+        shards=shards,
+    )
+
+    for shard in shards:
+        print(f'Machine {shard["machine"]} ({shard["cores"]} cores): boundaries ({shard["bottom_boundary"]:.10f}, '
+              f'{shard["top_boundary"]:.10f}), {shard["valid_nodes"]} nodes, '
+              f'{shard["predicted_wall_time"] / 3600:.2f} h, {shard["predicted_size"] / 1024**3:.2f} GB')
+    print(f'Predicted wall time: {plan["predicted_wall_time"] / 3600:.2f} h (equal split of the grid: '
+          f'{plan["equal_split_wall_time"] / 3600:.2f} h), total size: {plan["predicted_size"] / 1024**3:.2f} GB')
+
+    if path is not None:
+        with open(path, 'w') as fl:
+            json.dump(plan, fl, indent=4)
+    return plan
+
+
+def load_plan(path):
+    """
+    Loads plan stored by `plan_shards`.
+
+    :param path: str;
+    :return: dict;
+    """
+    with open(path) as fl:
+        return json.load(fl)
+
+
+def shard_kwargs(plan, machine):
+    """
+    Returns keyword arguments of `evaluate_grid` calculating the shard of the given machine.
+
+    :param plan: dict; result of `plan_shards` or `load_plan`
+    :param machine: int; index of the machine
+    :return: dict;
+    """
+    shard = plan['shards'][machine]
+    return dict(bottom_boundary=shard['bottom_boundary'], top_boundary=shard['top_boundary'],
+                desired_morphology=plan['desired_morphology'], block_evaluation=plan['block_evaluation'])
@@ -14,14 +14,40 @@ from . physics import (
 from .. import config
 
 
+def record_size(curve_dtype=None, phase_scheme=None, n_parameters=None):
+    """
+    Estimation of the number of bytes occupied by a single stored model in the database: light curves, phases (for
+    non-uniform phase schemes), row of `parameters` table, record headers and overhead of B-tree pages.
+
+    :param curve_dtype: str; storage format of light curves, `config.CURVE_DTYPE` by default
+    :param phase_scheme: str; phase scheme of the database, `config.PHASE_SCHEME` by default
+    :param n_parameters: int; number of columns of `parameters` table, circular binary parameters by default
+    :return: float; size in bytes
+    """
+    curve_dtype = config.CURVE_DTYPE if curve_dtype is None else curve_dtype
+    phase_scheme = config.PHASE_SCHEME if phase_scheme is None else phase_scheme
+    n_parameters = len(config.PARAMETER_COLUMNS_BINARY) if n_parameters is None else n_parameters
+
+    if curve_dtype == 'npy':
+        curve_size = 8 * config.N_POINTS + 128  # float64 array with `npy` header
+    else:
+        curve_size = np.dtype(curve_dtype).itemsize * config.N_POINTS
+    curves = len(config.PASSBAND_COLLUMNS) * (curve_size + 3)
+    phases = 8 * config.N_POINTS + 3 if phase_scheme != 'uniform' else 0
+    # 8 bytes per value in the parameters row, row headers and the primary keys of both tables
+    parameters = 9 * n_parameters + 20
+    # B-tree pages are not completely filled
+    return 1.1 * (curves + phases + parameters + 20)
+
+
 def estimate_size(grid_size):
     """
     Estimation of the physical size of the database based on the grid size.
 
-    :param grid_size: int;
+    :param grid_size: int; number of stored models
     :return: float; size in Gb
     """
-    return grid_size * len(config.PASSBAND_COLLUMNS) * (config.N_POINTS + 7 + 10) * 64 / (8 * 1024**3)
+    return grid_size * record_size() / 1024**3
 
 
 def generate_i(i_crit, step):
@@ -37,17 +63,18 @@ def generate_i(i_crit, step):
     return incl
 
 
-def draw_inclination(binary):
+def draw_inclination(binary, step=None):
     """
     Generate random inclinations below or above critical inclinations.
 
     :param binary: BinarySystem;
+    :param step: float; (0.0, 1.0) pre-drawn inclination iteration parameter, drawn randomly if None
     :return:
     """
     conj_distance = return_closest_distance(binary)
     i_crit = critical_inclination(binary.primary.polar_radius, binary.secondary.polar_radius, distance=conj_distance)
 
-    step = np.random.uniform(0.0, 1.0)
+    step = np.random.uniform(0.0, 1.0) if step is None else step
     return generate_i(i_crit, step)
 
 
@@ -69,6 +96,207 @@ def get_params_from_id(id):
     return result, indices
 
 
+def grid_shape(axes=None):
+    """
+    Returns number of nodes along each axis of the grid in the order in which they are used to generate node IDs.
+
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: tuple;
+    """
+    axes = config.sampling_order() if axes is None else axes
+    return tuple(len(axis) for axis in axes)
+
+
+def get_indices_from_ids(ids, axes=None):
+    """
+    Vectorized decoding of grid node IDs into indices of the node along each grid axis.
+
+    :param ids: numpy.array; node IDs
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: numpy.array; (N, 6) array of axis indices
+    """
+    shape = grid_shape(axes)
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.size > 0 and (ids.min() < 0 or ids.max() >= np.prod(shape)):
+        raise ValueError('ID is outside of the grid.')
+
+    return np.stack(np.unravel_index(ids, shape), axis=-1)
+
+
+def get_params_from_ids(ids, axes=None):
+    """
+    Vectorized version of `get_params_from_id` decoding whole array of node IDs at once.
+
+    :param ids: numpy.array; node IDs
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: tuple; (N, 6) array of parameter values, (N, 6) array of axis indices
+    """
+    axes = config.sampling_order() if axes is None else axes
+    indices = get_indices_from_ids(ids, axes)
+
+    values = np.empty(indices.shape, dtype=float)
+    for ii, axis in enumerate(axes):
+        values[..., ii] = np.asarray(axis)[indices[..., ii]]
+
+    return values, indices
+
+
+def get_ids_from_indices(indices, axes=None):
+    """
+    Vectorized encoding of axis indices into grid node IDs.
+
+    :param indices: numpy.array; (N, 6) array of axis indices
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: numpy.array; node IDs
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    return np.ravel_multi_index(tuple(np.moveaxis(indices, -1, 0)), grid_shape(axes))
+
+
+def get_ids_from_params(params, axes=None):
+    """
+    Vectorized encoding of parameter tuples into grid node IDs.
+
+    :param params: numpy.array; (N, 6) array of parameters [q, r1, r2, t1, t2, i]
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: numpy.array; node IDs
+    """
+    axes = config.sampling_order() if axes is None else axes
+    params = np.asarray(params, dtype=float)
+
+    indices = np.empty(params.shape, dtype=np.int64)
+    for ii, axis in enumerate(axes):
+        axis = np.asarray(axis, dtype=float)
+        order = np.argsort(axis)
+        pos = np.clip(np.searchsorted(axis[order], params[..., ii]), 0, axis.size - 1)
+        # choosing the closer of the two neighbouring nodes to avoid issues with floating point representation
+        pos_left = np.clip(pos - 1, 0, axis.size - 1)
+        closer_left = np.abs(axis[order][pos_left] - params[..., ii]) < np.abs(axis[order][pos] - params[..., ii])
+        pos = np.where(closer_left, pos_left, pos)
+
+        if not np.allclose(axis[order][pos], params[..., ii]):
+            raise ValueError(f'Parameters on position {ii} in sampling order are not located on the grid nodes.')
+        indices[..., ii] = order[pos]
+
+    return get_ids_from_indices(indices, axes)
+
+
+def get_ids_from_index_ranges(index_ranges, axes=None):
+    """
+    Returns IDs of all grid nodes within the Cartesian product of given per-axis selections, eg. all nodes with q=0.3
+    and T1 >= 8000::
+
+        get_ids_from_index_ranges([np.where(config.Q_ARRAY == 0.3)[0], None, None,
+                                   np.where(config.T_ARRAY >= 8000)[0], None, None])
+
+    :param index_ranges: list; selection for each axis in sampling order, each item can be None (whole axis), int,
+                               slice or iterable of axis indices
+    :param axes: list; grid axes in sampling order, `config.sampling_order()` is used by default
+    :return: numpy.array; sorted node IDs
+    """
+    shape = grid_shape(axes)
+    if len(index_ranges) != len(shape):
+        raise ValueError(f'Selection has to be defined for each of the {len(shape)} axes.')
+
+    selections = []
+    for selection, size in zip(index_ranges, shape):
+        if selection is None:
+            selection = np.arange(size)
+        elif isinstance(selection, slice):
+            selection = np.arange(size)[selection]
+        selections.append(np.unique(np.atleast_1d(np.asarray(selection, dtype=np.int64))))
+
+    return np.ravel_multi_index(np.ix_(*selections), shape).ravel()
+
+
+def grid_axes():
+    """
+    Returns current axes of the circular grid by their names in `config`.
+
+    :return: dict; {`Q_ARRAY`: numpy.array, `R_ARRAY`: ..., `T_ARRAY`: ..., `I_ARRAY`: ...}
+    """
+    return dict(Q_ARRAY=np.asarray(config.Q_ARRAY), R_ARRAY=np.asarray(config.R_ARRAY),
+                T_ARRAY=np.asarray(config.T_ARRAY), I_ARRAY=np.asarray(config.I_ARRAY))
+
+
+def sampling_axes(axes):
+    """
+    Arranges named grid axes (see `grid_axes`) into the sampling order used to generate node IDs.
+
+    :param axes: dict; {`Q_ARRAY`: numpy.array, `R_ARRAY`: ..., `T_ARRAY`: ..., `I_ARRAY`: ...}
+    :return: list;
+    """
+    return [axes['Q_ARRAY'], axes['R_ARRAY'], axes['R_ARRAY'], axes['T_ARRAY'], axes['T_ARRAY'], axes['I_ARRAY']]
+
+
+def axes_equal(axes1, axes2):
+    """
+    Checks whether two sets of named grid axes contain the same values in the same order.
+
+    :param axes1: dict;
+    :param axes2: dict;
+    :return: bool;
+    """
+    return set(axes1) == set(axes2) and \
+        all(np.array_equal(np.asarray(axes1[name], dtype=float), np.asarray(axes2[name], dtype=float))
+            for name in axes1)
+
+
+def axis_index_map(old_axis, new_axis):
+    """
+    Returns positions of the values of the old grid axis within the new axis. New values can be placed anywhere
+    within the new axis, but all old values have to be preserved.
+
+    :param old_axis: numpy.array;
+    :param new_axis: numpy.array;
+    :return: numpy.array; index in `new_axis` for each value of `old_axis`
+    """
+    old_axis, new_axis = np.asarray(old_axis, dtype=float), np.asarray(new_axis, dtype=float)
+    matches = np.isclose(old_axis[:, None], new_axis[None, :], rtol=1e-9, atol=0.0)
+    missing = old_axis[~matches.any(axis=1)]
+    if missing.size > 0:
+        raise ValueError(f'Values {missing} of the original grid axis are missing in the new axis, grid nodes can '
+                         f'not be removed.')
+    if np.unique(new_axis).size != new_axis.size:
+        raise ValueError('Grid axis contains duplicate values.')
+    return np.argmax(matches, axis=1)
+
+
+def remap_ids(ids, old_axes, new_axes):
+    """
+    Converts IDs of the grid nodes to the IDs of the same nodes within the extended grid.
+
+    :param ids: numpy.array; node IDs within the original grid
+    :param old_axes: dict; named axes of the original grid (see `grid_axes`)
+    :param new_axes: dict; named axes of the extended grid
+    :return: numpy.array; node IDs within the extended grid
+    """
+    old_sampling, new_sampling = sampling_axes(old_axes), sampling_axes(new_axes)
+    indices = get_indices_from_ids(ids, old_sampling)
+    for ii, (old_axis, new_axis) in enumerate(zip(old_sampling, new_sampling)):
+        indices[..., ii] = axis_index_map(old_axis, new_axis)[indices[..., ii]]
+    return get_ids_from_indices(indices, new_sampling)
+
+
+def new_node_mask(ids, old_axes, new_axes):
+    """
+    Returns mask of the nodes of the grid with new axes which are not present in the original grid.
+
+    :param ids: numpy.array; node IDs within the grid with new axes
+    :param old_axes: dict; named axes of the original grid (see `grid_axes`)
+    :param new_axes: dict; named axes of the grid with new axes
+    :return: numpy.array; bool mask
+    """
+    old_sampling, new_sampling = sampling_axes(old_axes), sampling_axes(new_axes)
+    indices = get_indices_from_ids(ids, new_sampling)
+    is_old = np.ones(np.shape(ids), dtype=bool)
+    for ii, (old_axis, new_axis) in enumerate(zip(old_sampling, new_sampling)):
+        old_values = np.zeros(len(new_axis), dtype=bool)
+        old_values[axis_index_map(old_axis, new_axis)] = True
+        is_old &= old_values[indices[..., ii]]
+    return ~is_old
+
+
 def draw_single_star_params():
     """
     Drawing parameters for single star system with spots. In case of rotational period,
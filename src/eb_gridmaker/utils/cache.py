@@ -0,0 +1,159 @@
+import sys
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from elisa import Observer
+from elisa.buffer import Buffer
+from .. import config
+
+
+def estimate_nbytes(obj, depth=3):
+    """
+    Rough estimate of the memory occupied by the cached object (numpy arrays, pandas objects and containers of them).
+
+    :param obj: object;
+    :param depth: int; maximum depth of the inspection of nested containers
+    :return: int; size in bytes
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, 'memory_usage'):  # pandas objects
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if depth > 0:
+        if isinstance(obj, dict):
+            return sys.getsizeof(obj) + sum(estimate_nbytes(val, depth - 1) for val in obj.values())
+        if isinstance(obj, (list, tuple)):
+            return sys.getsizeof(obj) + sum(estimate_nbytes(val, depth - 1) for val in obj)
+        if hasattr(obj, '__dict__'):
+            return sys.getsizeof(obj) + sum(estimate_nbytes(val, depth - 1) for val in vars(obj).values())
+    return sys.getsizeof(obj)
+
+
+class LRUCache(MutableMapping):
+    """
+    Dictionary with least-recently-used eviction limited by the estimated memory footprint of the stored values and/or
+    number of items. Iteration goes from the least recently used item, therefore it can replace FIFO buffers which
+    trim the storage from the beginning.
+    """
+    def __init__(self, max_bytes=None, max_items=None):
+        """
+        :param max_bytes: int; memory cap of the cache in bytes, unlimited if None
+        :param max_items: int; maximum number of items in the cache, unlimited if None
+        """
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.data = OrderedDict()
+        self.sizes = dict()
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def __contains__(self, key):
+        present = key in self.data
+        if not present:
+            self.misses += 1
+        return present
+
+    def __getitem__(self, key):
+        if key not in self.data:
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key in self.data:
+            self.__delitem__(key)
+        self.data[key] = value
+        self.sizes[key] = estimate_nbytes(value)
+        self.nbytes += self.sizes[key]
+
+        # the most recently inserted item is never evicted
+        while len(self.data) > 1 and ((self.max_bytes is not None and self.nbytes > self.max_bytes) or
+                                      (self.max_items is not None and len(self.data) > self.max_items)):
+            self.__delitem__(next(iter(self.data)))
+            self.evictions += 1
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.nbytes -= self.sizes.pop(key)
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        """
+        Returns usage statistics of the cache.
+
+        :return: dict; {'hits': int, 'misses': int, 'evictions': int, 'items': int, 'nbytes': int}
+        """
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, items=len(self.data),
+                    nbytes=self.nbytes)
+
+
+# worker-local cache of the loaded passbands {passband: (PassbandContainer, left bandwidth, right bandwidth)}
+PASSBANDS = LRUCache(max_items=64)
+
+
+def install_elisa_buffers(max_bytes=None):
+    """
+    Replaces FIFO buffers of the atmosphere and limb darkening tables in ELISa with the LRU caches with memory cap.
+    Function has no effect if the caches were already installed in the current process.
+
+    :param max_bytes: int; memory cap of each buffer in bytes, `config.WORKER_CACHE_SIZE` is used by default
+    :return: None
+    """
+    max_bytes = int(config.WORKER_CACHE_SIZE * 1024**2) if max_bytes is None else max_bytes
+    for name in ['LD_CFS_TABLES', 'ATMOSPHERE_TABLES']:
+        buffer = getattr(Buffer, name)
+        if isinstance(buffer, LRUCache):
+            continue
+        cache = LRUCache(max_bytes=max_bytes)
+        cache.update(buffer)
+        setattr(Buffer, name, cache)
+
+
+def get_observer(system, passbands=None):
+    """
+    Returns Observer of the given system using passbands loaded only once per worker process. The first call also
+    installs LRU caches of atmosphere and limb darkening tables (see `install_elisa_buffers`).
+
+    :param system: Union[elisa.BinarySystem, elisa.SingleSystem];
+    :param passbands: list; names of ELISa passbands, `config.PASSBANDS` is used by default
+    :return: elisa.Observer;
+    """
+    install_elisa_buffers()
+    passbands = config.PASSBANDS if passbands is None else passbands
+
+    observer = Observer(passband=None, system=system)
+    for band in passbands:
+        if band in PASSBANDS:
+            passband, left_bandwidth, right_bandwidth = PASSBANDS[band]
+        else:
+            loader = Observer(passband=[band])
+            passband, left_bandwidth, right_bandwidth = \
+                loader.passband[band], loader.left_bandwidth, loader.right_bandwidth
+            PASSBANDS[band] = (passband, left_bandwidth, right_bandwidth)
+
+        observer.setup_bandwidth(left_bandwidth=left_bandwidth, right_bandwidth=right_bandwidth)
+        observer.passband[band] = passband
+    return observer
+
+
+def cache_stats():
+    """
+    Returns usage statistics of the worker-local caches.
+
+    :return: dict; {cache name: {'hits': int, 'misses': int, 'evictions': int, 'items': int, 'nbytes': int}}
+    """
+    stats = dict(passbands=PASSBANDS.stats())
+    for name, label in [('LD_CFS_TABLES', 'ld_tables'), ('ATMOSPHERE_TABLES', 'atmosphere_tables')]:
+        buffer = getattr(Buffer, name)
+        if isinstance(buffer, LRUCache):
+            stats[label] = buffer.stats()
+    return stats
@@ -0,0 +1,204 @@
+import os
+import json
+from time import time, perf_counter
+from contextlib import contextmanager
+
+from .. import config
+
+# prefix of the names of metrics in Prometheus text format
+PROMETHEUS_PREFIX = 'eb_gridmaker'
+
+
+class RunMetrics(object):
+    """
+    Aggregated metrics of the run: number of finished nodes, time spent in each stage of the evaluation and number of
+    rejected nodes (or redrawn samples) for each rejection reason. Each process keeps its own instance `METRICS`,
+    workers periodically send their increments (see `drain`) to the main process where they are merged.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, total=None):
+        """
+        Clears all metrics and starts measuring the new run.
+
+        :param total: int; number of nodes to finish in this run, used for ETA
+        :return: None
+        """
+        self.total = total
+        self.start_time = time()
+        self.counters = dict()
+        self.stages = dict()
+        self.rejections = dict()
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def reject(self, reason, value=1):
+        self.rejections[reason] = self.rejections.get(reason, 0) + value
+
+    def add_time(self, stage, seconds, calls=1):
+        entry = self.stages.setdefault(stage, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Context manager measuring time spent in the given stage of the evaluation.
+
+        :param stage: str; eg. `initialization`, `lc`, `db_insert`
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, perf_counter() - start)
+
+    def drain(self):
+        """
+        Returns increments of the metrics since the last drain and clears them.
+
+        :return: dict; {'counters': dict, 'stages': dict, 'rejections': dict}
+        """
+        increments = dict(counters=self.counters, stages=self.stages, rejections=self.rejections)
+        self.counters, self.stages, self.rejections = dict(), dict(), dict()
+        return increments
+
+    def merge(self, increments):
+        """
+        Adds increments produced by `drain` of the other process.
+
+        :param increments: dict;
+        :return: None
+        """
+        for name, value in increments['counters'].items():
+            self.count(name, value)
+        for reason, value in increments['rejections'].items():
+            self.reject(reason, value)
+        for stage, (calls, seconds) in increments['stages'].items():
+            self.add_time(stage, seconds, calls)
+
+    def snapshot(self):
+        """
+        Returns current state of the metrics together with the derived throughput and ETA.
+
+        :return: dict;
+        """
+        elapsed = time() - self.start_time
+        finished = self.counters.get('nodes_finished', 0)
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - finished) / rate if self.total is not None and rate > 0 else None
+        return dict(
+            timestamp=time(),
+            elapsed=elapsed,
+            total=self.total,
+            nodes_finished=finished,
+            nodes_stored=self.counters.get('nodes_stored', 0),
+            nodes_per_second=rate,
+            eta_seconds=eta,
+            counters=dict(self.counters),
+            stages={stage: dict(calls=calls, seconds=seconds, mean=seconds / max(calls, 1))
+                    for stage, (calls, seconds) in self.stages.items()},
+            rejections=dict(self.rejections),
+        )
+
+
+# metrics of the current process
+METRICS = RunMetrics()
+
+
+def prometheus_text(snapshot):
+    """
+    Formats the snapshot of the metrics in Prometheus text exposition format.
+
+    :param snapshot: dict; result of `RunMetrics.snapshot`
+    :return: str;
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {description}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {kind}')
+        for labels, value in samples:
+            label_str = '{' + ','.join(f'{key}="{val}"' for key, val in labels.items()) + '}' if labels else ''
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{label_str} {float(value)!r}')
+
+    metric('nodes_finished_total', 'counter', 'Finished (stored, rejected or failed) nodes.',
+           [({}, snapshot['nodes_finished'])])
+    metric('nodes_stored_total', 'counter', 'Nodes stored in the database.', [({}, snapshot['nodes_stored'])])
+    metric('nodes_per_second', 'gauge', 'Average throughput of the run.', [({}, snapshot['nodes_per_second'])])
+    if snapshot['eta_seconds'] is not None:
+        metric('eta_seconds', 'gauge', 'Estimated time to finish the run.', [({}, snapshot['eta_seconds'])])
+    metric('elapsed_seconds', 'gauge', 'Duration of the run.', [({}, snapshot['elapsed'])])
+    metric('stage_seconds_total', 'counter', 'Time spent in the stage of evaluation summed over all processes.',
+           [(dict(stage=stage), val['seconds']) for stage, val in snapshot['stages'].items()])
+    metric('stage_calls_total', 'counter', 'Number of executions of the stage of evaluation.',
+           [(dict(stage=stage), val['calls']) for stage, val in snapshot['stages'].items()])
+    metric('rejections_total', 'counter', 'Rejected nodes or redrawn samples by reason.',
+           [(dict(reason=reason), value) for reason, value in snapshot['rejections'].items()])
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, content):
+    """
+    Writes the file through temporary file, so the scraper never reads partially written snapshot.
+
+    :param path: str;
+    :param content: str;
+    :return: None
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as fl:
+        fl.write(content)
+    os.replace(tmp_path, path)
+
+
+class MetricsReporter(object):
+    """
+    Periodically writes snapshots of `METRICS` of the main process into JSON file and file in Prometheus text format
+    (with `.prom` extension instead of `.json`) and prints the progress of the run.
+    """
+    def __init__(self, path=None, interval=None):
+        """
+        :param path: str; path to the JSON snapshot, `config.METRICS_FILE` by default, if both are None, the snapshot
+                          is stored next to `config.DATABASE_NAME` with `.metrics.json` suffix
+        :param interval: float; minimum time between snapshots in seconds, `config.METRICS_INTERVAL` by default
+        """
+        path = config.METRICS_FILE if path is None else path
+        self.path = f'{os.path.splitext(config.DATABASE_NAME)[0]}.metrics.json' if path is None else path
+        self.interval = config.METRICS_INTERVAL if interval is None else interval
+        self.last_report = time()
+
+    def __call__(self, force=False):
+        """
+        Writes the snapshot if the `interval` has passed since the last one.
+
+        :param force: bool; write the snapshot regardless of the interval
+        :return: None
+        """
+        if not force and time() - self.last_report < self.interval:
+            return
+        self.last_report = time()
+
+        snapshot = METRICS.snapshot()
+        eta = f'{snapshot["eta_seconds"]:.0f} s' if snapshot['eta_seconds'] is not None else 'unknown'
+        print(f'Finished nodes: {snapshot["nodes_finished"]}/{snapshot["total"]}, '
+              f'{snapshot["nodes_per_second"]:.2f} nodes/s, ETA: {eta}')
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        write_atomic(self.path, json.dumps(snapshot, indent=4))
+        write_atomic(os.path.splitext(self.path)[0] + '.prom', prometheus_text(snapshot))
+
+
+def start_run(total, path=None):
+    """
+    Resets metrics of the main process and returns reporter writing their snapshots.
+
+    :param total: int; number of nodes to finish in this run
+    :param path: str; path to the JSON snapshot, see `MetricsReporter`
+    :return: MetricsReporter;
+    """
+    METRICS.reset(total)
+    return MetricsReporter(path)
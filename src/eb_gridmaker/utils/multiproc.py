@@ -1,28 +1,195 @@
+import signal
+import threading
+from time import perf_counter
+from functools import partial
+from contextlib import contextmanager
 from multiprocessing import Pool
-import numpy as np
+from threading import BoundedSemaphore
 
+from . import metrics
 from .. import config
 
+# read-only data installed once per worker by the pool initializer, tasks then carry only the item identifiers
+WORKER_CONTEXT = dict()
+# prefix of the failure reasons of the items which failed repeatedly with unexpected exceptions
+ERROR_REASON = 'error'
 
-def multiprocess_eval(items, fn, args):
+
+def install_context(context):
+    """
+    Pool initializer storing data shared by all tasks evaluated by the worker.
+
+    :param context: dict; eg. pre-calculated grids of potentials or phases
+    :return: None
+    """
+    WORKER_CONTEXT.clear()
+    WORKER_CONTEXT.update(context)
+    # forked workers inherit the metrics of the main process
+    metrics.METRICS.reset()
+
+
+class Rejected(Exception):
+    """
+    Deterministic rejection of the item (eg. system outside of the limb darkening or atmosphere tables), the item is
+    recorded in the failure ledger without retries.
+    """
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class NodeTimeout(BaseException):
+    """
+    Raised within the evaluation exceeding its wall-clock limit. Derived from `BaseException`, so it is not caught by
+    the generic exception handlers of the evaluated code.
+    """
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise NodeTimeout()
+
+
+@contextmanager
+def node_timeout(seconds):
+    """
+    Interrupts the evaluation within the context by `NodeTimeout` after given wall-clock time. The timer uses SIGALRM,
+    therefore it is active only in the main thread of the process on the platforms supporting it.
+
+    :param seconds: float; None or non-positive value disables the timeout
+    """
+    if seconds is None or seconds <= 0 or not hasattr(signal, 'SIGALRM') or \
+            threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def is_final(reason):
+    """
+    Decides whether the failure is final. Rejected and timed out items are skipped by the later runs, while items
+    which failed with unexpected exceptions (eg. due to the broken environment) are evaluated again.
+
+    :param reason: str; reason of the failure (see `evaluate_item`)
+    :return: bool;
+    """
+    return not reason.startswith(f'{ERROR_REASON}:')
+
+
+def evaluate_item(fn, args, timeout=None, max_retries=None):
+    """
+    Evaluates `fn(*args)` with the retry policy of the failure ledger. Unexpected exceptions are considered transient
+    and the evaluation is repeated up to `max_retries` times, while timeouts and `Rejected` items are final. Failures
+    are counted in `metrics.METRICS` rejections.
+
+    :param fn: callable;
+    :param args: tuple; arguments of `fn`
+    :param timeout: float; wall-clock limit of a single attempt in seconds, None disables the timeout
+    :param max_retries: int; `config.MAX_RETRIES` by default
+    :return: tuple; (result of `fn` or None, evaluation time in seconds, None or (failure reason, number of attempts))
+    """
+    max_retries = config.MAX_RETRIES if max_retries is None else max_retries
+    start = perf_counter()
+    for attempt in range(1, max_retries + 2):
+        try:
+            with node_timeout(timeout):
+                return fn(*args), perf_counter() - start, None
+        except Rejected as e:
+            metric, reason = e.reason, e.reason
+        except NodeTimeout:
+            metric, reason = 'timeout', 'timeout'
+        except Exception as e:
+            if attempt <= max_retries:
+                continue
+            print(f'Evaluation of item {args[0]} failed after {attempt} attempts: {e!r}')
+            metric, reason = 'evaluation_error', f'{ERROR_REASON}: {e!r}'[:config.FAILURE_REASON_LENGTH]
+        metrics.METRICS.reject(metric)
+        return None, perf_counter() - start, (reason, attempt)
+
+
+def eval_batch(fn, args, timeout, batch):
+    """
+    Evaluates a batch of items within a single task of the pool worker. Failure of the evaluation (see
+    `evaluate_item`) is reported together with the item and its result is `None`, so the rest of the batch is not
+    lost.
+
+    :param fn: callable; curve evaluation function
+    :param args: tuple; arguments of curve evaluation function
+    :param timeout: float; wall-clock limit of the evaluation of a single item in seconds
+    :param batch: list; [(counter, item), ...]
+    :return: tuple; ([(item, result of `fn`, evaluation time in seconds, failure), ...], increments of the worker
+                    metrics since the previous batch), failure is None or (reason, number of attempts)
+    """
+    results = []
+    for counter, item in batch:
+        result, seconds, failure = evaluate_item(fn, (item, counter) + tuple(args), timeout)
+        results.append((item, result, seconds, failure))
+    return results, metrics.METRICS.drain()
+
+
+def bounded_batches(items, batch_size, semaphore):
+    """
+    Generator of task batches which blocks once the number of batches submitted to the pool and not yet consumed
+    reaches the capacity of the `semaphore`.
+
+    :param items: numpy.array; IDs of curves
+    :param batch_size: int; number of items in a single task
+    :param semaphore: threading.BoundedSemaphore; released by the consumer of the results
+    :return: Generator; [(counter, item), ...]
+    """
+    batch = []
+    for counter, item in enumerate(items):
+        batch.append((counter, item))
+        if len(batch) == batch_size:
+            semaphore.acquire()
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        semaphore.acquire()
+        yield batch
+
+
+def multiprocess_eval(items, fn, args, callback=None, context=None, batch_size=None, reporter=None, timeout=None):
     """
-    Function for multiprocess evaluation of curves.
+    Function for multiprocess evaluation of curves. A single pool of workers lives for the whole run and it is fed by
+    batches of items as they are consumed, so the workers are never waiting for the slowest item of the chunk. Large
+    read-only arguments should be passed in `context` which is transferred to each worker only once and it is
+    accessible in `fn` as `WORKER_CONTEXT`.
 
     :param items: numpy.array; IDs of curves
     :param fn: callabe; curve evaluation function
     :param args: tuple; arguments of curve evaluation function
-    :return:
+    :param callback: callable; function called in the main process with tuple (item, result of `fn`, evaluation
+                               time in seconds, failure) for each item in order of completion (see `eval_batch`)
+    :param context: dict; data installed to `WORKER_CONTEXT` of each worker
+    :param batch_size: int; number of items in a single task, `config.TASK_BATCH_SIZE` is used by default
+    :param reporter: callable; called after each finished task, eg. `metrics.MetricsReporter`, metrics of the workers
+                               are merged to `metrics.METRICS` of the main process
+    :param timeout: float; wall-clock limit of the evaluation of a single item in seconds, eg. `config.NODE_TIMEOUT`,
+                           None disables the timeout
+    :return: None
     """
-    chunksize = 10000
-    n_chunks = int(len(items) / chunksize + 1)
-    for jj in range(n_chunks):
-        print(f'Chunk {jj+1}/{n_chunks}.')
+    batch_size = config.TASK_BATCH_SIZE if batch_size is None else batch_size
+    semaphore = BoundedSemaphore(config.TASKS_IN_FLIGHT_PER_PROCESS * config.NUMBER_OF_PROCESSES)
+    batches = bounded_batches(items, batch_size, semaphore)
 
-        idxs = np.arange(jj*chunksize, (jj+1)*chunksize)
-        idxs = idxs[idxs < len(items)]
-        chunk_items = items[idxs]
-        pool = Pool(processes=config.NUMBER_OF_PROCESSES)
-        [pool.apply_async(fn, (iden, ii+jj*chunksize)+args) for ii, iden in enumerate(chunk_items)]
+    context = dict() if context is None else context
+    with Pool(processes=config.NUMBER_OF_PROCESSES, initializer=install_context, initargs=(context, )) as pool:
+        for results, increments in pool.imap_unordered(partial(eval_batch, fn, args, timeout), batches):
+            semaphore.release()
+            metrics.METRICS.merge(increments)
+            if callback is not None:
+                for result in results:
+                    callback(result)
+            if reporter is not None:
+                reporter()
 
-        pool.close()
-        pool.join()
+    if reporter is not None:
+        reporter(force=True)
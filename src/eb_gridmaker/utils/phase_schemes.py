@@ -0,0 +1,104 @@
+import numpy as np
+
+from .. import config
+
+# supported distributions of photometric phases of the light curves
+PHASE_SCHEMES = ('uniform', 'eclipse')
+
+
+def uniform_phases(n_points=None):
+    """
+    Returns equidistant photometric phases on <0, 1) interval.
+
+    :param n_points: int; number of phases, `config.N_POINTS` by default
+    :return: numpy.array;
+    """
+    n_points = config.N_POINTS if n_points is None else n_points
+    return np.linspace(0, 1.0, num=n_points, endpoint=False)
+
+
+def eclipse_half_width(r1, r2, inclination, margin=None):
+    """
+    Returns half-width of the eclipses on circular orbit in phase units. Eclipse occurs while the projected distance
+    of the components sqrt(sin^2(2 pi phase) + cos^2(i) cos^2(2 pi phase)) is smaller than r1 + r2 (the same geometry
+    as in `physics.critical_inclination`).
+
+    :param r1: float; radius of the primary component in SMA units
+    :param r2: float; radius of the secondary component in SMA units
+    :param inclination: float; inclination in degrees
+    :param margin: float; multiplicative factor of the sum of radii accounting for the tidal deformation of the
+                          components, `config.ECLIPSE_WIDTH_MARGIN` by default
+    :return: float; 0 if eclipses do not occur, 0.25 if eclipses cover the whole orbit
+    """
+    margin = config.ECLIPSE_WIDTH_MARGIN if margin is None else margin
+    radii_sum = margin * (r1 + r2)
+    cos2_i = np.cos(np.radians(inclination)) ** 2
+    if cos2_i >= radii_sum ** 2:
+        return 0.0
+
+    sin2_phase = (radii_sum ** 2 - cos2_i) / (1.0 - cos2_i)
+    if sin2_phase >= 1.0:
+        return 0.25
+    return float(np.arcsin(np.sqrt(sin2_phase)) / (2 * np.pi))
+
+
+def eclipse_phases(r1, r2, inclination, n_points=None, fraction=None, margin=None):
+    """
+    Returns photometric phases concentrated within primary and secondary eclipse. Fraction `fraction` of the points is
+    spread uniformly within the eclipses (see `eclipse_half_width`) and the rest uniformly out of eclipses. Phases
+    0 and 0.5 (for even number of points) are always included. Uniform phases are returned if the eclipses do not
+    occur or if they already contain the requested fraction of uniformly spread points.
+
+    :param r1: float; radius of the primary component in SMA units
+    :param r2: float; radius of the secondary component in SMA units
+    :param inclination: float; inclination in degrees
+    :param n_points: int; number of phases, `config.N_POINTS` by default
+    :param fraction: float; fraction of the points within the eclipses, `config.ECLIPSE_POINT_FRACTION` by default
+    :param margin: float; see `eclipse_half_width`
+    :return: numpy.array; sorted phases on <0, 1) interval
+    """
+    fraction = config.ECLIPSE_POINT_FRACTION if fraction is None else fraction
+    uniform = uniform_phases(n_points)
+    half_width = eclipse_half_width(r1, r2, inclination, margin)
+    if half_width <= 0 or 4 * half_width >= fraction:
+        return uniform
+
+    # piecewise constant density of points, inverse of its cumulative distribution maps uniform phases
+    knots = np.array([0, half_width, 0.5 - half_width, 0.5 + half_width, 1 - half_width, 1])
+    in_eclipse = np.array([True, False, True, False, True])
+    density = np.where(in_eclipse, fraction / (4 * half_width), (1 - fraction) / (1 - 4 * half_width))
+    cdf = np.concatenate(([0], np.cumsum(density * np.diff(knots))))
+    return np.interp(uniform, cdf, knots)
+
+
+def node_phases(r1, r2, inclination, scheme=None):
+    """
+    Returns photometric phases of the observation of the circular binary according to given phase scheme.
+
+    :param r1: float; radius of the primary component in SMA units
+    :param r2: float; radius of the secondary component in SMA units
+    :param inclination: float; inclination in degrees
+    :param scheme: str; `uniform` or `eclipse`, `config.PHASE_SCHEME` by default
+    :return: numpy.array;
+    """
+    scheme = config.PHASE_SCHEME if scheme is None else scheme
+    if scheme == 'uniform':
+        return uniform_phases()
+    elif scheme == 'eclipse':
+        return eclipse_phases(r1, r2, inclination)
+    raise ValueError(f'Unknown phase scheme: {scheme}. Available phase schemes: {PHASE_SCHEMES}')
+
+
+def fold_phases(phases, decimals=9):
+    """
+    Folds photometric phases of a symmetric light curve (circular orbit without spots) onto the <0, 0.5> interval.
+    Phases phi and 1 - phi are considered identical if they match to given number of decimals.
+
+    :param phases: numpy.array; phases on <0, 1) interval
+    :param decimals: int; precision of the matching of the symmetrical phases
+    :return: tuple; (numpy.array, numpy.array) unique folded phases, indices reconstructing the original phases from
+                    the unique ones
+    """
+    phases = np.mod(phases, 1.0)
+    folded = np.round(np.where(phases > 0.5, 1.0 - phases, phases), decimals)
+    return np.unique(folded, return_inverse=True)
@@ -1,6 +1,10 @@
 import numpy as np
 from copy import copy
-from elisa import const as c, BinarySystem
+from functools import partial
+from elisa import const as c, BinarySystem, settings
+from elisa.binary_system import dynamic
+from elisa.binary_system.container import OrbitalPositionContainer
+from elisa.binary_system.curves import c_router, lc_point
 from elisa.binary_system.model import (
     potential_value_primary,
     potential_value_secondary,
@@ -98,7 +102,7 @@ def correct_sma(mass_ratio, r1, r2):
     return 1.4374e-9 * sma, period / 86400
 
 
-def initialize_system(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, overcontact):
+def initialize_system(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, overcontact, sma=None, period=None):
     """
     Initializing binary system based on grid params.
 
@@ -111,13 +115,16 @@ def initialize_system(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, o
     :param omega1: float;
     :param omega2: float;
     :param overcontact: bool;
+    :param sma: float; pre-calculated semi-major axis, calculated with `correct_sma` if not provided
+    :param period: float; pre-calculated period, calculated with `correct_sma` if not provided
     :return: elisa.BinarySystem
     """
     dt = t1 - t2
     if overcontact and np.abs(dt) > config.MAX_DIFF_T_OVERCONTACT:
         t2 = t1 - config.MAX_DIFF_T_OVERCONTACT if dt > 0.0 else t1 + config.MAX_DIFF_T_OVERCONTACT
 
-    sma, period = correct_sma(mass_ratio, r1, r2)
+    if sma is None or period is None:
+        sma, period = correct_sma(mass_ratio, r1, r2)
     params = copy(DEFAULT_SYSTEM)
     params["system"].update({
         'inclination': inclination, 'mass_ratio': mass_ratio,
@@ -133,6 +140,90 @@ def initialize_system(mass_ratio, r1, r2, t1, t2, inclination, omega1, omega2, o
     return BinarySystem.from_json(params)
 
 
+def build_geometry(binary):
+    """
+    Builds surface mesh, faces and kinematic quantities of the binary system at phase 0. These depend only on the
+    mass ratio, surface potentials and the size of the orbit, therefore the result can be shared by all systems which
+    differ only in effective temperatures or inclination.
+
+    :param binary: elisa.BinarySystem;
+    :return: elisa.binary_system.container.OrbitalPositionContainer;
+    """
+    geometry = OrbitalPositionContainer.from_binary_system(binary, c.Position(0, 1.0, 0.0, 0.0, 0.0))
+    geometry.build_mesh(components_distance=1.0)
+    geometry.build_faces_and_kinematic_quantities(components_distance=1.0)
+    return geometry
+
+
+def build_surface(geometry, binary):
+    """
+    Completes a copy of the pre-built geometry with properties of the components of given binary (effective
+    temperatures, gravity darkening, albedo) and calculates surface temperature distribution. The result is identical
+    to the initial system built by ELISA during the light curve calculation and it can be reused for all inclinations.
+
+    :param geometry: elisa.binary_system.container.OrbitalPositionContainer; result of `build_geometry`
+    :param binary: elisa.BinarySystem; system with the same geometry as the one used in `build_geometry`
+    :return: elisa.binary_system.container.OrbitalPositionContainer;
+    """
+    initial_system = geometry.copy()
+    for component in settings.BINARY_COUNTERPARTS:
+        properties = getattr(binary, component).to_properties_container().__dict__
+        getattr(initial_system, component).__dict__.update(properties)
+    initial_system.build_temperature_distribution(components_distance=1.0)
+    initial_system.flat_it()
+    return initial_system
+
+
+def build_initial_system(binary):
+    """
+    Builds surface of the binary system at the reference orbital position used by ELISa to compute light curves of
+    circular synchronous systems.
+
+    :param binary: elisa.BinarySystem;
+    :return: elisa.binary_system.container.OrbitalPositionContainer;
+    """
+    return c_router.prep_initial_system(binary)
+
+
+def prebuilt_system_lightcurve(binary, initial_system, symmetric=True, **kwargs):
+    """
+    Replacement of `BinarySystem.compute_lightcurve` for circular synchronous systems which uses the already built
+    initial system instead of building it from scratch. Light curve of the spotless circular system is symmetric
+    around phases 0 and 0.5, therefore only phases from the <0, 0.5> interval are evaluated and the rest is mirrored.
+
+    :param binary: elisa.BinarySystem;
+    :param initial_system: elisa.binary_system.container.OrbitalPositionContainer; result of `build_surface`
+    :param symmetric: bool; if False, all phases are evaluated (used to validate the mirrored curves)
+    :param kwargs: Dict; see `elisa.binary_system.curves.lc.compute_circular_synchronous_lightcurve`
+    :return: Dict[str, numpy.array];
+    """
+    initial_system.inclination = binary.inclination
+
+    band_labels = [*kwargs["passband"].keys()]
+    phases = kwargs.pop("phases")
+    if symmetric:
+        unique_phase_interval, reverse_phase_map = dynamic.phase_crv_symmetry(initial_system, phases)
+    else:
+        unique_phase_interval, reverse_phase_map = phases, np.arange(phases.shape[0])
+
+    _args = (binary, initial_system, unique_phase_interval, lc_point.compute_lc_on_pos, band_labels)
+    band_curves = c_router.produce_circular_sync_curves(*_args, **kwargs)
+    return {band: band_curves[band][reverse_phase_map] for band in band_curves}
+
+
+def attach_prebuilt_system(binary, initial_system, symmetric=True):
+    """
+    Makes the binary system to compute its light curves on the pre-built initial system (see `build_surface`).
+
+    :param binary: elisa.BinarySystem;
+    :param initial_system: elisa.binary_system.container.OrbitalPositionContainer;
+    :param symmetric: bool; evaluate only the independent half of the phases (see `prebuilt_system_lightcurve`)
+    :return: elisa.BinarySystem;
+    """
+    binary.compute_lightcurve = partial(prebuilt_system_lightcurve, binary, initial_system, symmetric=symmetric)
+    return binary
+
+
 def invert_potential(potential, mass_ratio):
     return potential / mass_ratio + 0.5 * (mass_ratio - 1) / mass_ratio
 
@@ -0,0 +1,94 @@
+import os
+import hashlib
+
+import numpy as np
+
+from elisa import BinarySystem
+from . import physics
+from .. import config
+
+# increment if the content or the way of calculation of the cached quantities changes
+PRECALC_VERSION = 1
+
+
+def axes_hash(*axes):
+    """
+    Returns hash identifying the values of given grid axes.
+
+    :param axes: numpy.array; grid axes
+    :return: str;
+    """
+    digest = hashlib.sha1(f'v{PRECALC_VERSION}'.encode())
+    for axis in axes:
+        axis = np.ascontiguousarray(axis, dtype=np.float64)
+        digest.update(str(axis.shape).encode())
+        digest.update(axis.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def calculate_binary_grid(q_array, r_array):
+    """
+    Calculates all grid-invariant quantities of the (q, r1, r2) cube of the grid of circular binaries:
+
+        - `crit_potentials`: (nq, 3) critical potentials [L3, L1, L2] for each mass ratio,
+        - `omega1_grid`, `omega2_grid`: (nq, nr) surface potentials of primary and secondary component,
+        - `i_crits`: (nr, nr) critical inclinations in degrees,
+        - `sma`, `period`: (nq, nr, nr) semi-major axes in solRad and periods in days (see `physics.correct_sma`),
+        - `sma_switched`, `period_switched`: the same for systems with switched components (q -> 1/q, r1 <-> r2).
+
+    :param q_array: numpy.array; grid of mass ratios
+    :param r_array: numpy.array; grid of component radii
+    :return: dict;
+    """
+    q, r1, r2 = q_array[:, None, None], r_array[None, :, None], r_array[None, None, :]
+    # libration potentials are obtained by the root finding of ELISa which does not support arrays
+    crit_potentials = np.array([BinarySystem.libration_potentials_static(1.0, qq) for qq in q_array])
+
+    sma, period = physics.correct_sma(q, r1, r2)
+    sma_switched, period_switched = physics.correct_sma(1.0 / q, r2, r1)
+
+    return dict(
+        crit_potentials=crit_potentials,
+        omega1_grid=physics.back_radius_potential_primary(r_array[None, :], q_array[:, None]),
+        omega2_grid=physics.back_radius_potential_secondary(r_array[None, :], q_array[:, None]),
+        i_crits=physics.critical_inclination(r_array[:, None], r_array[None, :]),
+        sma=sma,
+        period=period,
+        sma_switched=sma_switched,
+        period_switched=period_switched,
+    )
+
+
+def precalc_binary_grid(q_array=None, r_array=None, cache_dir=None):
+    """
+    Returns grid-invariant quantities of the (q, r1, r2) cube (see `calculate_binary_grid`). Results are cached in
+    `cache_dir` in a file identified by the hash of grid axes, therefore reruns and other batches of the same grid
+    only load them.
+
+    :param q_array: numpy.array; grid of mass ratios, `config.Q_ARRAY` is used by default
+    :param r_array: numpy.array; grid of component radii, `config.R_ARRAY` is used by default
+    :param cache_dir: str; directory of the cache files, `config.PRECALC_CACHE_DIR` is used by default, caching is
+                           disabled if both are None
+    :return: dict;
+    """
+    q_array = config.Q_ARRAY if q_array is None else np.asarray(q_array)
+    r_array = config.R_ARRAY if r_array is None else np.asarray(r_array)
+    cache_dir = config.PRECALC_CACHE_DIR if cache_dir is None else cache_dir
+
+    if cache_dir is None:
+        return calculate_binary_grid(q_array, r_array)
+
+    path = os.path.join(cache_dir, f'binary_grid_{axes_hash(q_array, r_array)}.npz')
+    if os.path.isfile(path):
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+    result = calculate_binary_grid(q_array, r_array)
+    os.makedirs(cache_dir, exist_ok=True)
+    # writing into temporary file first since multiple processes can create the same cache file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fl:
+        np.savez(fl, **result)
+    os.replace(tmp_path, path)
+    print(f'Pre-calculated grid stored in {path}')
+    return result
@@ -0,0 +1,369 @@
+import numpy as np
+from copy import deepcopy
+from scipy import optimize
+
+from elisa import const as c
+from elisa.binary_system import model
+from . default_single_model import DEFAULT_SYSTEM as DEFAULT_SINGLE_SYSTEM
+from . default_binary_model import DEFAULT_SYSTEM as DEFAULT_BINARY_SYSTEM
+from . physics import back_radius_potential_primary, back_radius_potential_secondary, correct_sma
+from .. import config
+
+
+# odd constants of splitmix64 generator
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def mix64(x):
+    """
+    Finalizer of splitmix64 generator, bijective avalanche mixing of 64-bit integers.
+
+    :param x: numpy.array; uint64 array
+    :return: numpy.array; uint64 array
+    """
+    x = (x ^ (x >> np.uint64(30))) * _MIX_MULTIPLIERS[0]
+    x = (x ^ (x >> np.uint64(27))) * _MIX_MULTIPLIERS[1]
+    return x ^ (x >> np.uint64(31))
+
+
+def counter_uniform(seed, ids, attempts, draw):
+    """
+    Counter-based random numbers uniformly distributed on [0, 1). Each number is a hash of the counter
+    (seed, sample ID, attempt, draw), therefore it can be reproduced independently of any other number.
+
+    :param seed: int; seed of the run
+    :param ids: numpy.array; sample IDs
+    :param attempts: numpy.array; number of the attempt to draw a valid parameter set for the given sample ID
+    :param draw: int; index of the random number within the attempt
+    :return: numpy.array;
+    """
+    ids = np.asarray(ids).astype(np.uint64)
+    state = mix64(np.full(ids.shape, seed % 2**64, dtype=np.uint64) + _GOLDEN_GAMMA)
+    state = mix64(state ^ ids)
+    state = mix64(state ^ np.asarray(attempts).astype(np.uint64))
+    state = mix64(state ^ np.uint64(draw))
+    return (state >> np.uint64(11)) * 2.0**-53
+
+
+class CounterStreams(object):
+    """
+    Vectorized source of random numbers with the interface of `numpy.random` (`uniform`, `choice`, `randint`,
+    `exponential`) producing one value per sample ID from its own counter-based stream (see `counter_uniform`).
+    Successive calls produce successive draws of each stream, `size` arguments are ignored.
+    """
+    def __init__(self, seed, ids, attempts):
+        """
+        :param seed: int; seed of the run
+        :param ids: numpy.array; sample IDs
+        :param attempts: numpy.array; attempt numbers of each sample ID
+        """
+        self.seed = seed
+        self.ids = ids
+        self.attempts = attempts
+        self.draw = 0
+
+    def random(self):
+        values = counter_uniform(self.seed, self.ids, self.attempts, self.draw)
+        self.draw += 1
+        return values
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return low + (high - low) * self.random()
+
+    def choice(self, a, size=None):
+        a = np.asarray(a)
+        return a[np.minimum((self.random() * a.size).astype(np.int64), a.size - 1)]
+
+    def randint(self, low, high, size=None, dtype=int):
+        return np.floor(low + (high - low) * self.random()).astype(dtype)
+
+    def exponential(self, scale=1.0, size=None):
+        return - scale * np.log1p(- self.random())
+
+
+def draw_single_star_batch(size, rng=np.random):
+    """
+    Vectorized drawing of candidate parameters of single star systems with spots (see `aux.draw_single_star_params`).
+
+    :param size: int; number of candidates
+    :param rng: Union[numpy.random, CounterStreams]; source of random numbers
+    :return: dict; {parameter: numpy.array}
+    """
+    batch = dict(
+        mass=rng.uniform(config.M_RANGE[0], config.M_RANGE[1], size),
+        polar_log_g=rng.uniform(config.LOG_G_RANGE[0], config.LOG_G_RANGE[1], size),
+        t_eff=rng.choice(config.T_CHOICES, size),
+        inclination=rng.uniform(config.I_RANGE[0], config.I_RANGE[1], size),
+        rotation_period=rng.uniform(config.P_RANGE[0], config.P_RANGE[1], size),
+    )
+
+    for ii, _ in enumerate(DEFAULT_SINGLE_SYSTEM["star"].get("spots", [])):
+        batch[f'spot{ii}_longitude'] = rng.uniform(config.LONGITUDE_RANGE[0], config.LONGITUDE_RANGE[1], size)
+        batch[f'spot{ii}_latitude'] = rng.uniform(config.LATITUDE_RANGE[0], config.LATITUDE_RANGE[1], size)
+        batch[f'spot{ii}_angular_radius'] = \
+            rng.uniform(config.SPOT_RADIUS_RANGE[0], config.SPOT_RADIUS_RANGE[1], size)
+        t_diff = rng.uniform(config.T_DIFF_SPOT_RANGE[0], config.T_DIFF_SPOT_RANGE[1], size)
+        batch[f'spot{ii}_temperature_factor'] = (batch['t_eff'] + t_diff) / batch['t_eff']
+
+    return batch
+
+
+def single_star_rejections(batch):
+    """
+    Analytic validity checks of the single star candidates. Star is rejected if its rotation exceeds the critical
+    break-up velocity, ie. the surface potential derived from polar log g is above the critical potential
+    -3/2 (G M omega)^(2/3) of the Roche model of the rotating star.
+
+    :param batch: dict; result of `draw_single_star_batch`
+    :return: dict; {rejection reason: numpy.array mask of rejected candidates}
+    """
+    mass = batch['mass'] * c.SOLAR_MASS
+    gravity_acceleration = np.power(10, batch['polar_log_g'] - 2)  # log g in cgs to g in SI
+    with np.errstate(divide='ignore'):
+        angular_velocity = c.FULL_ARC / (batch['rotation_period'] * 86400.0)
+
+    surface_potential = - np.sqrt(c.G * mass * gravity_acceleration)
+    critical_potential = - 1.5 * np.power(c.G * mass * angular_velocity, 2.0 / 3.0)
+    return dict(break_up_rotation=~(critical_potential >= surface_potential))
+
+
+def single_star_params(row):
+    """
+    Returns parameters of the single star system in form used to initialize a SingleSystem.
+
+    :param row: dict; {parameter: value} of a single candidate from `draw_single_star_batch`
+    :return: dict;
+    """
+    params = deepcopy(DEFAULT_SINGLE_SYSTEM)
+    for param in ['mass', 'polar_log_g', 't_eff']:
+        params["star"][param] = row[param]
+    for param in ['inclination', 'rotation_period']:
+        params["system"][param] = row[param]
+
+    for ii, spot in enumerate(params["star"].get("spots", [])):
+        for param in ['longitude', 'latitude', 'angular_radius', 'temperature_factor']:
+            spot[param] = row[f'spot{ii}_{param}']
+
+    return params
+
+
+def draw_eccentric_batch(size, rng=np.random):
+    """
+    Vectorized drawing of candidate parameters of eccentric binaries (see `aux.draw_eccentric_system_params` and
+    `aux.assign_eccentric_system_params`). Inclination depends on the shape of the components, therefore only its
+    relative position within the allowed interval is drawn (see `aux.draw_inclination`).
+
+    :param size: int; number of candidates
+    :param rng: Union[numpy.random, CounterStreams]; source of random numbers
+    :return: dict; {parameter: numpy.array}
+    """
+    batch = dict(
+        argument_of_periastron=rng.randint(config.ARG0_RANGE[0], config.ARG0_RANGE[1], size, dtype=int),
+        eccentricity=rng.uniform(config.E_RANGE[0], config.E_RANGE[1], size),
+        mass_ratio=rng.choice(config.Q_ARRAY, size),
+        primary__t_eff=rng.choice(config.T_CHOICES, size),
+        secondary__t_eff=rng.choice(config.T_CHOICES, size),
+        primary__radius=np.round(rng.exponential(0.15, size), 2) + config.R_RANGE[0],
+        secondary__radius=np.round(rng.exponential(0.15, size), 2) + config.R_RANGE[0],
+        inclination_step=rng.uniform(config.I_FACTOR_RANGE[0], config.I_FACTOR_RANGE[1], size),
+    )
+
+    eccentricity = batch['eccentricity']
+    synchronicity = (1 + eccentricity)**2 / (1 - eccentricity**2)**1.5
+    batch['synchronicity'] = synchronicity
+    args = (batch['mass_ratio'], synchronicity, 1 - eccentricity)
+    batch['primary__surface_potential'] = back_radius_potential_primary(batch['primary__radius'], *args)
+    batch['secondary__surface_potential'] = back_radius_potential_secondary(batch['secondary__radius'], *args)
+    batch['semi_major_axis'], batch['period'] = \
+        correct_sma(batch['mass_ratio'], batch['primary__radius'], batch['secondary__radius'])
+
+    return batch
+
+
+def critical_potentials(component, components_distance, mass_ratio, synchronicity):
+    """
+    Vectorized version of `BinarySystem.critical_potential_static`.
+
+    :param component: str; `primary` or `secondary`
+    :param components_distance: numpy.array;
+    :param mass_ratio: numpy.array;
+    :param synchronicity: numpy.array;
+    :return: numpy.array; critical potentials, numpy.nan where the solver did not converge
+    """
+    synchronicity, mass_ratio, components_distance = \
+        np.broadcast_arrays(np.atleast_1d(synchronicity), np.atleast_1d(mass_ratio), np.atleast_1d(components_distance))
+    if mass_ratio.size == 1:
+        # scipy switches to the scalar solver for single-element arrays
+        return critical_potentials(component, np.repeat(components_distance, 2), np.repeat(mass_ratio, 2),
+                                   np.repeat(synchronicity, 2))[:1]
+
+    args1 = synchronicity, mass_ratio, components_distance
+    args2 = args1 + (0.0, c.HALF_PI)
+    fn = model.primary_potential_derivative_x if component == 'primary' else model.secondary_potential_derivative_x
+
+    x0 = np.full(mass_ratio.shape, 1e-6)
+    with np.errstate(all='ignore'):
+        solution, converged, _ = optimize.newton(fn, x0=x0, args=args1, tol=1e-12, full_output=True, disp=False)
+        if component == 'primary':
+            precalc_args = model.pre_calculate_for_potential_value_primary(*args2)
+            potential = np.abs(model.potential_value_primary(solution, mass_ratio, *precalc_args))
+        else:
+            precalc_args = model.pre_calculate_for_potential_value_secondary(*args2)
+            potential = np.abs(model.potential_value_secondary(components_distance - solution, mass_ratio,
+                                                               *precalc_args))
+
+    potential[~converged] = np.nan
+    return potential
+
+
+def eccentric_rejections(batch):
+    """
+    Analytic validity checks of the eccentric binary candidates:
+
+        - both equivalent radii have to be below 0.5 (see `aux.draw_radii`),
+        - both components have to be within their Roche lobes at periastron.
+
+    :param batch: dict; result of `draw_eccentric_batch`
+    :return: dict; {rejection reason: numpy.array mask of rejected candidates}
+    """
+    rejections = dict(radii=(batch['primary__radius'] >= 0.5) | (batch['secondary__radius'] >= 0.5))
+
+    distance = 1 - batch['eccentricity']
+    for component in ['primary', 'secondary']:
+        crit = critical_potentials(component, distance, batch['mass_ratio'], batch['synchronicity'])
+        rejections[f'{component}_roche_lobe_overflow'] = ~(batch[f'{component}__surface_potential'] > crit)
+
+    return rejections
+
+
+def eccentric_params(row):
+    """
+    Returns parameters of the eccentric binary in form used to initialize a BinarySystem.
+
+    :param row: dict; {parameter: value} of a single candidate from `draw_eccentric_batch`
+    :return: dict;
+    """
+    params = deepcopy(DEFAULT_BINARY_SYSTEM)
+    params["system"]["inclination"] = 90     # placeholder
+    for param in ['argument_of_periastron', 'eccentricity', 'mass_ratio', 'semi_major_axis', 'period']:
+        params["system"][param] = row[param]
+
+    for component in ['primary', 'secondary']:
+        params[component]['synchronicity'] = row['synchronicity']
+        for param in ['t_eff', 'surface_potential']:
+            params[component][param] = row[f'{component}__{param}']
+
+    return params
+
+
+SAMPLERS = {
+    'single_spotty': (draw_single_star_batch, single_star_rejections, single_star_params),
+    'eccentric': (draw_eccentric_batch, eccentric_rejections, eccentric_params),
+}
+
+
+def presample(morphology, ids, seed, first_attempts=None, batch_size=None):
+    """
+    Draws parameter sets of given morphology which pass the analytic validity checks for each sample ID. Parameters
+    of each sample are derived from the counter-based random stream given by (`seed`, sample ID), rejected candidates
+    are redrawn in the next attempt of the stream. Result for a given ID is therefore independent of the other
+    pre-sampled IDs and any range of IDs can be calculated separately. Candidates are drawn and rejected in vectorized
+    batches.
+
+    :param morphology: str; `single_spotty` or `eccentric`
+    :param ids: numpy.array; sample IDs
+    :param seed: int; seed of the run
+    :param first_attempts: numpy.array; attempt numbers where the search for each ID starts, 0 by default
+    :param batch_size: int; maximum number of IDs processed at once, `config.PRESAMPLING_BATCH_SIZE` by default
+    :return: tuple; (dict, dict) {parameter: numpy.array of valid values, `id`: IDs, `attempt`: accepted attempts},
+                    acceptance statistics
+    """
+    batch_size = config.PRESAMPLING_BATCH_SIZE if batch_size is None else batch_size
+    draw_fn, rejection_fn, _ = SAMPLERS[morphology]
+    ids = np.asarray(ids, dtype=np.int64)
+    attempts = np.zeros(ids.shape, dtype=np.int64) if first_attempts is None \
+        else np.array(first_attempts, dtype=np.int64)
+
+    samples = {param: np.empty(0, dtype=values.dtype)
+               for param, values in draw_fn(0, CounterStreams(seed, ids[:0], attempts[:0])).items()}
+    chunks = [samples]
+    stats = dict(drawn=0, accepted=0, rejections=dict())
+    for start in range(0, ids.size, batch_size):
+        chunk_ids, chunk_attempts = ids[start: start + batch_size], attempts[start: start + batch_size]
+        chunk = None
+        pending = np.arange(chunk_ids.size)
+        while pending.size > 0:
+            batch = draw_fn(pending.size, CounterStreams(seed, chunk_ids[pending], chunk_attempts[pending]))
+            valid = np.ones(pending.size, dtype=bool)
+            for reason, mask in rejection_fn(batch).items():
+                stats['rejections'][reason] = stats['rejections'].get(reason, 0) + int(np.count_nonzero(mask & valid))
+                valid &= ~mask
+
+            if chunk is None:
+                chunk = {param: np.empty(chunk_ids.size, dtype=values.dtype) for param, values in batch.items()}
+            for param, values in batch.items():
+                chunk[param][pending[valid]] = values[valid]
+
+            stats['drawn'] += pending.size
+            stats['accepted'] += int(np.count_nonzero(valid))
+            chunk_attempts[pending[~valid]] += 1
+            pending = pending[~valid]
+        chunks.append(chunk)
+
+    samples = {param: np.concatenate([chunk[param] for chunk in chunks]) for param in samples}
+    samples['id'], samples['attempt'] = ids, attempts
+    stats['acceptance_rate'] = stats['accepted'] / max(stats['drawn'], 1)
+    return samples, stats
+
+
+def sample_row(samples, iden):
+    """
+    Returns pre-sampled parameters of the given sample ID.
+
+    :param samples: dict; result of `presample` sorted by IDs
+    :param iden: int; sample ID
+    :return: dict; {parameter: value}
+    """
+    index = int(np.searchsorted(samples['id'], iden))
+    if index >= samples['id'].size or samples['id'][index] != iden:
+        raise KeyError(f'Sample {iden} was not pre-sampled.')
+    return {param: values[index] for param, values in samples.items()}
+
+
+def next_sample(morphology, seed, row):
+    """
+    Redraws parameters of the sample whose parameters failed during the evaluation from the subsequent attempts of
+    its random stream.
+
+    :param morphology: str; `single_spotty` or `eccentric`
+    :param seed: int; seed of the run
+    :param row: dict; current parameters of the sample (see `sample_row`)
+    :return: dict; {parameter: value}
+    """
+    samples, _ = presample(morphology, [row['id']], seed, first_attempts=[row['attempt'] + 1])
+    return sample_row(samples, row['id'])
+
+
+def sample_params(morphology, row):
+    """
+    Returns parameter set of given morphology in form used to initialize the system.
+
+    :param morphology: str; `single_spotty` or `eccentric`
+    :param row: dict; {parameter: value} of a single sample
+    :return: dict;
+    """
+    return SAMPLERS[morphology][2](row)
+
+
+def stats_summary(morphology, stats):
+    """
+    Human readable summary of acceptance statistics produced by `presample`.
+
+    :param morphology: str;
+    :param stats: dict;
+    :return: str;
+    """
+    rejections = ', '.join(f'{reason}: {count}' for reason, count in stats['rejections'].items())
+    return f'Acceptance rate of {morphology} candidates: {100.0 * stats["acceptance_rate"]:.2f}% ' \
+           f'({stats["accepted"]}/{stats["drawn"]}), rejected: {rejections}'
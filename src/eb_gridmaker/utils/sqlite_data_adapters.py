@@ -1,8 +1,17 @@
 import io
 import sqlite3
+from functools import partial
 
 import numpy as np
 
+# SQL column types of light curves for each supported curve encoding, `npy` is the legacy `np.save` format
+CURVE_TYPES = {
+    'npy': 'ARRAY',
+    'float64': 'CURVE_F64',
+    'float32': 'CURVE_F32',
+    'float16': 'CURVE_F16',
+}
+
 
 def adapt_array(arr):
     out = io.BytesIO()
@@ -17,3 +26,51 @@ def convert_array(text):
     return np.load(out)
 
 
+def encode_curve(arr, dtype):
+    """
+    Serializes light curve into raw little-endian array of given dtype.
+
+    :param arr: numpy.array; light curve
+    :param dtype: str; `float64`, `float32`, `float16` or `npy` for the legacy format
+    :return: bytes;
+    """
+    if dtype == 'npy':
+        return bytes(adapt_array(arr))
+    return np.ascontiguousarray(arr, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+
+
+def decode_curve(blob, dtype):
+    """
+    Zero-copy deserialization of the light curve stored by `encode_curve`, resulting array is read-only.
+
+    :param blob: bytes;
+    :param dtype: str; `float64`, `float32`, `float16` or `npy` for the legacy format
+    :return: numpy.array;
+    """
+    if dtype == 'npy':
+        return convert_array(blob)
+    return np.frombuffer(blob, dtype=np.dtype(dtype).newbyteorder('<'))
+
+
+def decode_curves(blobs, dtype, n_points):
+    """
+    Deserialization of the sequence of light curves stored by `encode_curve` into a single 2D array.
+
+    :param blobs: list; serialized light curves
+    :param dtype: str; `float64`, `float32`, `float16` or `npy` for the legacy format
+    :param n_points: int; number of points in each light curve
+    :return: numpy.array; (len(blobs), n_points)
+    """
+    if dtype == 'npy':
+        return np.array([convert_array(blob) for blob in blobs]).reshape(len(blobs), n_points)
+    return decode_curve(b''.join(blobs), dtype).reshape(len(blobs), n_points)
+
+
+def register_curve_converters():
+    """
+    Registers sqlite3 converters for all supported curve column types.
+
+    :return: None
+    """
+    for dtype, column_type in CURVE_TYPES.items():
+        sqlite3.register_converter(column_type, partial(decode_curve, dtype=dtype))